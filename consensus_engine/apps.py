@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_delete
 
 
 class ConsensusEngineConfig(AppConfig):
     name = 'consensus_engine'
+
+    def ready(self):
+        # imported here as the app registry must be ready first
+        from consensus_engine.caching import check_shared_caches
+        from consensus_engine.models.voting_models import ChoiceTicket, ticket_deleted
+        checks.register(check_shared_caches, checks.Tags.caches)
+        post_delete.connect(ticket_deleted, sender=ChoiceTicket)
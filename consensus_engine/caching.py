@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+class VersionedCache:
+    """
+    Caches computed values per owner (a user, a proposal...) under the owner's version number
+    - invalidate() moves the owner on to a new version so everything cached for it becomes unreachable
+    - the cache alias and timeout are read from settings so any django cache backend can be used
+    - hits and misses are counted in the process and added to counters in the cache every
+      CONSENSUS_CACHE_STATS_FLUSH seconds, so a lookup does not also write to the cache
+    - versions are millisecond timestamps so they also tell when the owner last changed
+    - versions only work when every process serving the site sees the same cache, so the cache is not used
+      (every value is computed and every version is new) when it is local memory and there is more than
+      one process (CONSENSUS_WEB_PROCESSES)
+    """
+
+    def __init__(self, key_prefix, cache_setting, timeout_setting, default_timeout):
+        self.key_prefix = key_prefix
+        self.cache_setting = cache_setting
+        self.timeout_setting = timeout_setting
+        self.default_timeout = default_timeout
+        # this process' hits and misses not yet added to the counters in the cache
+        self._pending_counts = Counter()
+        self._counts_added = time.monotonic()
+        self._counts_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, self.cache_setting, 'default')]
+
+    @property
+    def shared(self):
+        """ True if every process serving the site sees the versions set by the others """
+        return (getattr(settings, 'CONSENSUS_WEB_PROCESSES', 1) <= 1
+                or not isinstance(self.cache, LocMemCache))
+
+    def _version_key(self, owner_id):
+        return '{}:version:{}'.format(self.key_prefix, owner_id)
+
+    def _new_version(self):
+        # a fresh version never matches data cached under a version that has since been evicted
+        return int(time.time() * 1000)
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._pending_counts[name] += 1
+            if time.monotonic() - self._counts_added < getattr(settings, 'CONSENSUS_CACHE_STATS_FLUSH', 10):
+                return
+            counts, self._pending_counts = self._pending_counts, Counter()
+            self._counts_added = time.monotonic()
+        for counter_name, count in counts.items():
+            key = '{}:{}'.format(self.key_prefix, counter_name)
+            try:
+                self.cache.incr(key, count)
+            except ValueError:
+                self.cache.add(key, 0, None)
+                self.cache.incr(key, count)
+
+    def version(self, owner_id):
+        """ The owner's current version, starting one if the owner has none """
+        if not self.shared:
+            return self._new_version()
+        cache = self.cache
+        version_key = self._version_key(owner_id)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, self._new_version(), None)
+            version = cache.get(version_key)
+        return version
+
+    def version_time(self, owner_id):
+        """ When the owner's current version was started (an aware datetime) """
+        return datetime.fromtimestamp(self.version(owner_id) / 1000, tz=timezone.utc)
+
+    def get_or_set(self, owner_id, name, compute):
+        """ Gets the named value for the owner from the cache, computing and caching it on a miss """
+        if owner_id is None or not self.shared:
+            return compute()
+        cache = self.cache
+        key = '{}:{}:{}:{}'.format(self.key_prefix, owner_id, self.version(owner_id), name)
+        value = cache.get(key)
+        if value is None:
+            self._count('misses')
+            value = compute()
+            cache.set(key, value, getattr(settings, self.timeout_setting, self.default_timeout))
+        else:
+            self._count('hits')
+        return value
+
+    def invalidate(self, *owner_ids):
+        """
+        Moves the owners on to a new version so their cached values are recomputed
+        - moved on again when the current transaction commits, as a reader may have cached the data from
+          before the commit under the first new version
+        """
+        owner_ids = [owner_id for owner_id in owner_ids if owner_id is not None]
+        if not owner_ids or not self.shared:
+            return
+        self._move_versions(owner_ids)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self._move_versions(owner_ids))
+
+    def _move_versions(self, owner_ids):
+        cache = self.cache
+        for owner_id in owner_ids:
+            version_key = self._version_key(owner_id)
+            previous = cache.get(version_key)
+            version = self._new_version()
+            # always move forward, even when invalidated twice within a millisecond
+            if previous is not None and previous >= version:
+                version = previous + 1
+            cache.set(version_key, version, None)
+
+    def stats(self):
+        """
+        The hits, misses and hit rate since the counters were last reset
+        - the counters in the cache plus this process' counts not yet added to them
+        """
+        with self._counts_lock:
+            pending = Counter(self._pending_counts)
+        hits = self.cache.get('{}:hits'.format(self.key_prefix), 0) + pending['hits']
+        misses = self.cache.get('{}:misses'.format(self.key_prefix), 0) + pending['misses']
+        lookups = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0}
+
+    def reset_stats(self):
+        with self._counts_lock:
+            self._pending_counts = Counter()
+        self.cache.delete_many(['{}:hits'.format(self.key_prefix), '{}:misses'.format(self.key_prefix)])
+
+
+# per user sidebar data (visible groups and open invites count)
+sidebar_cache = VersionedCache('consensus_sidebar', 'CONSENSUS_SIDEBAR_CACHE',
+                               'CONSENSUS_SIDEBAR_CACHE_TIMEOUT', 300)
+# per proposal voting spread for each reporting state
+spread_cache = VersionedCache('consensus_spread', 'CONSENSUS_SPREAD_CACHE',
+                              'CONSENSUS_SPREAD_CACHE_TIMEOUT', 3600)
+# per group page version only (when the proposals the group page lists last changed, for conditional GETs)
+group_cache = VersionedCache('consensus_group', 'CONSENSUS_GROUP_CACHE',
+                             'CONSENSUS_GROUP_CACHE_TIMEOUT', 300)
+
+
+def check_shared_caches(app_configs, **kwargs):
+    """ Warns when a versioned cache is not used because it is not shared between the processes """
+    warnings = []
+    for versioned_cache in (sidebar_cache, spread_cache, group_cache):
+        if not versioned_cache.shared:
+            warnings.append(checks.Warning(
+                'The {} cache is local memory and {} processes serve the site, so it is not used.'.format(
+                    versioned_cache.key_prefix, getattr(settings, 'CONSENSUS_WEB_PROCESSES', 1)),
+                hint='Point {} at a cache shared between the processes (database or memcached).'.format(
+                    versioned_cache.cache_setting),
+                id='consensus_engine.W001'))
+    return warnings
@@ -0,0 +1,40 @@
+import csv
+import json
+from itertools import islice
+
+
+def file_format_for(name):
+    """ The format of an import file from its name - ndjson for .ndjson and .jsonl files, otherwise csv """
+    return 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def read_records(stream, file_format, fields):
+    """
+    Streams the records of a CSV file with a header row or of an NDJSON file as tuples of the fields
+    - a line that cannot be parsed, or is not a JSON object, is yielded with no fields set so it is rejected
+      as an invalid record
+    """
+    if file_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield tuple(row.get(field) for field in fields)
+    else:
+        for line in stream:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    yield (None,) * len(fields)
+                    continue
+                yield tuple(row.get(field) for field in fields)
+
+
+def batches(records, batch_size):
+    """ Splits the records into lists of up to batch_size records without reading ahead of the current batch """
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+def feed_enabled():
+    """
+    True if the pages open live feeds (CONSENSUS_LIVE_FEED)
+    - each open feed holds a worker thread, so it needs threaded workers (gunicorn gthread)
+    """
+    return getattr(settings, 'CONSENSUS_LIVE_FEED', False)
+
+
+def poll_interval():
+    """ Seconds between the polling bridge's reads of the proposals' last_changed (None if it is not used) """
+    return getattr(settings, 'CONSENSUS_LIVE_FEED_POLL', None)
+
+
+class Subscriber:
+    """ An open feed - collects the proposals changed on its channels until it sends them """
+
+    def __init__(self, channels):
+        self.channels = set(channels)
+        self.changed = set()
+        self.condition = threading.Condition()
+
+    def notify(self, proposal_ids):
+        with self.condition:
+            self.changed.update(proposal_ids)
+            self.condition.notify()
+
+    def wait(self, timeout, window):
+        """
+        Waits up to timeout seconds for a change and returns the ids of the changed proposals
+        - after the first change it waits for the coalescing window so a burst of changes is sent once
+        """
+        with self.condition:
+            if not self.changed:
+                self.condition.wait(timeout)
+            if not self.changed:
+                return set()
+        time.sleep(window)
+        with self.condition:
+            changed, self.changed = self.changed, set()
+        return changed
+
+
+class PollingBridge(threading.Thread):
+    """
+    Publishes the proposals changed by any process to this process' feeds by polling last_changed
+    - for deployments with several worker processes, runs while the process has subscribers
+    """
+
+    def __init__(self, hub, interval):
+        super().__init__(name='consensus-live-feed-bridge', daemon=True)
+        self.hub = hub
+        self.interval = interval
+        self.since = timezone.now()
+        self.seen = {}
+
+    def poll(self):
+        # imported here as the models import this module
+        from consensus_engine.models import Proposal
+        # read back over the last interval too so a change committed late is not missed
+        changes = list(Proposal.objects.filter(last_changed__gt=self.since - timedelta(seconds=self.interval))
+                                       .values_list('id', 'proposal_group_id', 'last_changed'))
+        self.since = timezone.now()
+        published = [(proposal_id, group_id) for proposal_id, group_id, last_changed in changes
+                     if self.seen.get(proposal_id) != last_changed]
+        self.seen = {proposal_id: last_changed for proposal_id, _, last_changed in changes}
+        if published:
+            self.hub.publish(published)
+        return len(published)
+
+    def run(self):
+        try:
+            while self.hub.subscribers:
+                time.sleep(self.interval)
+                self.poll()
+        finally:
+            connection.close()
+
+
+class FeedHub:
+    """
+    In-process fan out of proposal changes to the open feeds
+    - channels are 'proposal:<id>' and 'group:<id>'
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.bridge = None
+
+    def subscribe(self, channels):
+        subscriber = Subscriber(channels)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            interval = poll_interval()
+            if interval and (self.bridge is None or not self.bridge.is_alive()):
+                self.bridge = PollingBridge(self, interval)
+                self.bridge.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, changes):
+        """ Notifies the subscribers of the changed proposals in (proposal id, group id) pairs """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            proposal_ids = {proposal_id for proposal_id, group_id in changes
+                            if 'proposal:{}'.format(proposal_id) in subscriber.channels
+                            or 'group:{}'.format(group_id) in subscriber.channels}
+            if proposal_ids:
+                subscriber.notify(proposal_ids)
+
+    def publish_proposals(self, proposal_ids):
+        # imported here as the models import this module
+        from consensus_engine.models import Proposal
+        self.publish(list(Proposal.objects.filter(id__in=proposal_ids).values_list('id', 'proposal_group_id')))
+
+
+hub = FeedHub()
+
+
+def proposals_changed(proposal_ids):
+    """
+    Pushes changes to the proposals' spreads or consensus to this process' feeds once they are committed
+    - left to the polling bridge when it is used, as it sees the changes made by every process
+    """
+    if hub.subscribers and not poll_interval():
+        proposal_ids = set(proposal_ids)
+        transaction.on_commit(lambda: hub.publish_proposals(proposal_ids))
+
+
+def proposal_event(proposal):
+    """ The feed data for a proposal - its current voting spread and consensus """
+    consensus = proposal.current_consensus
+    return {'id': proposal.id, 'state': int(proposal.state),
+            'spread': proposal.get_voting_spread(),
+            'consensus': consensus.text if consensus is not None else None}
+
+
+def event_stream(channels, initial_proposal_ids=()):
+    """ Yields the server-sent events for changes on the channels until the feed has been open for the maximum age """
+    # imported here as the models import this module
+    from consensus_engine.models import Proposal
+    keepalive = getattr(settings, 'CONSENSUS_LIVE_FEED_KEEPALIVE', 15)
+    window = getattr(settings, 'CONSENSUS_LIVE_FEED_COALESCE', 0.5)
+    deadline = time.monotonic() + getattr(settings, 'CONSENSUS_LIVE_FEED_MAX_AGE', 300)
+    # subscribed once the response starts so a feed that is never read is never left subscribed
+    subscriber = hub.subscribe(channels)
+    try:
+        # the browser reconnects after the maximum age
+        yield 'retry: 1000\n\n'
+        proposal_ids = set(initial_proposal_ids)
+        while True:
+            if proposal_ids:
+                proposals = Proposal.objects.filter(id__in=proposal_ids).order_by('id')
+                data = json.dumps({'proposals': [proposal_event(proposal) for proposal in proposals]})
+                yield 'event: consensus\ndata: {}\n\n'.format(data)
+            else:
+                yield ': keep-alive\n\n'
+            if time.monotonic() >= deadline:
+                break
+            proposal_ids = subscriber.wait(min(keepalive, max(deadline - time.monotonic(), 0)), window)
+    finally:
+        hub.unsubscribe(subscriber)
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from consensus_engine.models import Proposal, ConsensusRollup
+
+
+def _rebuild_rollups(proposal_id):
+    # each worker thread has its own connection which is closed when the work is done
+    try:
+        return ConsensusRollup.objects.rebuild(Proposal(id=proposal_id))
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Backfills the daily and monthly consensus rollups from the consensus history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of proposals to process in parallel')
+        parser.add_argument('--proposal', type=int, action='append', dest='proposal_ids',
+                            help='Only backfill this proposal id (can be repeated)')
+
+    def handle(self, *args, **options):
+        proposals = Proposal.objects.filter(consensushistory__isnull=False).distinct()
+        if options['proposal_ids']:
+            proposals = proposals.filter(id__in=options['proposal_ids'])
+        proposal_ids = list(proposals.values_list('id', flat=True))
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                rollups = sum(executor.map(_rebuild_rollups, proposal_ids))
+        else:
+            rollups = sum(ConsensusRollup.objects.rebuild(Proposal(id=proposal_id)) for proposal_id in proposal_ids)
+        self.stdout.write('Backfilled {} rollups for {} proposals.'.format(rollups, len(proposal_ids)))
@@ -0,0 +1,133 @@
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.utils import timezone
+
+from consensus_engine.models import (ChoiceTicket, ConsensusHistory, GroupMembership, Proposal,
+                                     ProposalChoice, ProposalGroup)
+from consensus_engine.utils import ProposalState
+
+BENCHMARK_INDEXES = [(ChoiceTicket, 'ticket_current_choice_idx'),
+                     (ChoiceTicket, 'unique_current_ticket'),
+                     (ConsensusHistory, 'history_proposal_date_idx'),
+                     (GroupMembership, 'membership_group_user_idx')]
+
+
+def is_test_database():
+    """ True if the default database is one made for the tests """
+    name = str(connection.settings_dict['NAME'])
+    if name.startswith(TEST_DATABASE_PREFIX) or name == connection.settings_dict.get('TEST', {}).get('NAME'):
+        return True
+    return connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(name)
+
+
+class Command(BaseCommand):
+    help = ('Seeds a dataset inside a transaction, shows the query plans and timings of the hot lookups '
+            'with and without the indexes, then rolls everything back - only runs with DEBUG on or against a '
+            'test database, as the dropped indexes hold a lock on the choice tickets (blocking every vote) until '
+            'the rollback')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--proposals', type=int, default=50)
+        parser.add_argument('--history', type=int, default=3,
+                            help='Number of previous (not current) tickets per user and proposal')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of times each query is run for the timings')
+        parser.add_argument('--no-plans', action='store_false', dest='plans',
+                            help='Only show the timings')
+
+    def seed(self, options):
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username='benchmark-{}'.format(i), password='!')
+                                          for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith='benchmark-'))
+        group = ProposalGroup.objects.create(group_name='benchmark', owned_by=users[0])
+        GroupMembership.objects.bulk_create([GroupMembership(user=user, group=group, date_joined=now)
+                                             for user in users])
+        Proposal.objects.bulk_create([Proposal(proposal_name='benchmark {}'.format(i), date_proposed=now,
+                                               proposal_description='benchmark', owned_by=users[0],
+                                               proposal_group=group, state=ProposalState.PUBLISHED)
+                                      for i in range(options['proposals'])])
+        proposals = list(Proposal.objects.filter(proposal_group=group))
+        ProposalChoice.objects.bulk_create([ProposalChoice(proposal=proposal, text=text, priority=priority,
+                                                           activated_date=now)
+                                            for proposal in proposals
+                                            for priority, text in ((100, 'Yes'), (200, 'No'))])
+        choices = list(ProposalChoice.objects.filter(proposal__in=proposals).order_by('id'))
+        tickets = []
+        history = []
+        for p_index, proposal in enumerate(proposals):
+            proposal_choices = choices[p_index * 2:p_index * 2 + 2]
+            for u_index, user in enumerate(users):
+                for h in range(options['history'] + 1):
+                    tickets.append(ChoiceTicket(user=user, date_chosen=now, proposal=proposal,
+                                                proposal_choice=proposal_choices[(u_index + h) % 2],
+                                                current=(h == options['history']),
+                                                state=ProposalState.PUBLISHED))
+                history.append(ConsensusHistory(proposal=proposal, snapshot_date=now, consensus_data='[]'))
+        ChoiceTicket.objects.bulk_create(tickets, batch_size=1000)
+        ConsensusHistory.objects.bulk_create(history, batch_size=1000)
+        return users, group, proposals, choices
+
+    def hot_queries(self, users, group, proposals, choices):
+        user = users[len(users) // 2]
+        proposal = proposals[len(proposals) // 2]
+        return [
+            ('current_vote_count', ChoiceTicket.objects.filter(proposal_choice=choices[0], current=True,
+                                                               state=ProposalState.PUBLISHED)),
+            ('get_current_choice', ChoiceTicket.objects.filter(user=user, proposal=proposal,
+                                                               current=True, state=ProposalState.PUBLISHED)),
+            ('my_votes', ChoiceTicket.objects.my_votes(user)),
+            ('clear previous vote', ChoiceTicket.objects.filter(user=user, proposal=proposal,
+                                                                current=True)),
+            ('groups_for_member', ProposalGroup.objects.groups_for_member(user)),
+            ('history at date', ConsensusHistory.objects.filter(proposal=proposal, snapshot_date__lte=timezone.now())
+                                                        .order_by('-snapshot_date')[:1]),
+            ('membership', GroupMembership.objects.filter(group=group, user=user)),
+        ]
+
+    def run_queries(self, queries, label, options):
+        results = {}
+        with connection.cursor() as cursor:
+            for name, queryset in queries:
+                sql, params = queryset.query.sql_with_params()
+                # label the sql so that a statement prepared before the indexes were dropped is not reused
+                sql = '{} /* {} */'.format(sql, label)
+                plan = None
+                if options['plans']:
+                    cursor.execute('{} {}'.format(connection.ops.explain_query_prefix(), sql), params)
+                    plan = '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                results[name] = ((time.perf_counter() - start) * 1000.0 / options['repeat'], plan)
+        return results
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not is_test_database():
+            raise CommandError('Only run benchmark_indexes with DEBUG on or against a test database - '
+                               'dropping the indexes locks the choice tickets until the benchmark ends.')
+        with transaction.atomic():
+            queries = self.hot_queries(*self.seed(options))
+            with connection.cursor() as cursor:
+                # give the planner statistics for the seeded data
+                for model in {model for model, _ in BENCHMARK_INDEXES}:
+                    cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(model._meta.db_table)))
+            after = self.run_queries(queries, 'after', options)
+            with connection.cursor() as cursor:
+                for _, index_name in BENCHMARK_INDEXES:
+                    cursor.execute('DROP INDEX {}'.format(connection.ops.quote_name(index_name)))
+            before = self.run_queries(queries, 'before', options)
+            for name, _ in queries:
+                self.stdout.write('{}: {:.3f} ms before, {:.3f} ms after'
+                                  .format(name, before[name][0], after[name][0]))
+                if options['plans']:
+                    self.stdout.write('  plan before:\n    {}'.format(before[name][1].replace('\n', '\n    ')))
+                    self.stdout.write('  plan after:\n    {}'.format(after[name][1].replace('\n', '\n    ')))
+            # leave the database as it was
+            transaction.set_rollback(True)
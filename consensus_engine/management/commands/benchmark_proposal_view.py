@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from consensus_engine.caching import spread_cache
+from consensus_engine.models import Proposal, ProposalChoice, ProposalGroup
+from consensus_engine.views import ProposalView
+
+
+class Command(BaseCommand):
+    help = ('Seeds a voted proposal inside a transaction, shows the number of queries for repeated reads '
+            'of the proposal page and for the read after a vote, then rolls everything back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--choices', type=int, default=5)
+        parser.add_argument('--reads', type=int, default=5,
+                            help='Number of times the proposal page is read between votes')
+
+    def seed(self, options):
+        now = timezone.now()
+        users = [User.objects.create(username='benchmark-{}'.format(i), password='!') for i in range(options['users'])]
+        group = ProposalGroup.objects.create(group_name='benchmark', owned_by=users[0])
+        for user in users:
+            group.join_group(user)
+        proposal = Proposal.objects.create(proposal_name='benchmark', date_proposed=now,
+                                           proposal_description='benchmark', owned_by=users[0],
+                                           proposal_group=group)
+        choices = [ProposalChoice.objects.create(proposal=proposal, text='choice {}'.format(i),
+                                                 priority=i, activated_date=now)
+                   for i in range(options['choices'])]
+        proposal.publish()
+        for index, user in enumerate(users):
+            choices[index % len(choices)].vote(user)
+        return proposal, choices, users
+
+    def read(self, proposal, user):
+        """ Renders the proposal page and returns the number of queries it took """
+        request = RequestFactory().get(proposal.get_absolute_url())
+        request.user = user
+        with CaptureQueriesContext(connection) as queries:
+            ProposalView.as_view()(request, proposal_id=proposal.id).render()
+        return len(queries)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            proposal, choices, users = self.seed(options)
+            # start from a cold cache for the seeded proposal
+            spread_cache.invalidate(proposal.id)
+            reads = [self.read(proposal, users[0]) for _ in range(options['reads'])]
+            self.stdout.write('Queries per read: {}'.format(', '.join(str(count) for count in reads)))
+            choices[-1].vote(users[0])
+            reads = [self.read(proposal, users[0]) for _ in range(options['reads'])]
+            self.stdout.write('Queries per read after a vote: {}'.format(', '.join(str(count) for count in reads)))
+            stats = spread_cache.stats()
+            self.stdout.write('Spread cache: {hits} hits, {misses} misses.'.format(**stats))
+            # leave the database as it was
+            transaction.set_rollback(True)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from consensus_engine.caching import sidebar_cache, spread_cache
+
+
+class Command(BaseCommand):
+    help = ('Shows the hit rates of the sidebar and voting spread caches - each process adds its counts '
+            'every CONSENSUS_CACHE_STATS_FLUSH seconds')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        for name, versioned_cache in (('sidebar', sidebar_cache), ('spread', spread_cache)):
+            stats = versioned_cache.stats()
+            self.stdout.write('{}: {hits} hits, {misses} misses, {hit_rate:.1%} hit rate.'.format(name, **stats))
+            if options['reset']:
+                versioned_cache.reset_stats()
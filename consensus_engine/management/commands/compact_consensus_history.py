@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from consensus_engine.models import Proposal, ConsensusHistory
+
+
+class Command(BaseCommand):
+    help = 'Compacts the consensus history by coalescing snapshots and delta encoding them against keyframes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int,
+                            default=getattr(settings, 'CONSENSUS_HISTORY_COALESCE_SECONDS', 0),
+                            help='Snapshots in the same window of this many seconds are merged')
+        parser.add_argument('--keyframe-interval', type=int,
+                            default=getattr(settings, 'CONSENSUS_HISTORY_KEYFRAME_INTERVAL', 1),
+                            help='Store every nth snapshot in full and the rest as deltas')
+        parser.add_argument('--proposal', type=int, action='append', dest='proposal_ids',
+                            help='Only compact the history for this proposal id (can be repeated)')
+
+    def handle(self, *args, **options):
+        proposals = Proposal.objects.filter(consensushistory__isnull=False).distinct()
+        if options['proposal_ids']:
+            proposals = proposals.filter(id__in=options['proposal_ids'])
+        total_before = total_after = 0
+        for proposal in proposals.iterator():
+            before, after = ConsensusHistory.objects.compact(proposal, options['window'],
+                                                             options['keyframe_interval'])
+            total_before += before
+            total_after += after
+        self.stdout.write('Compacted {} snapshots into {}.'.format(total_before, total_after))
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.core.management.base import BaseCommand, CommandError
+
+from consensus_engine.imports import batches, file_format_for, read_records
+from consensus_engine.models import ProposalGroup
+
+
+class Command(BaseCommand):
+    help = 'Invites the people in a CSV or NDJSON file of username and can_trial records to a group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('group_id', type=int, help='Id of the group to invite the people to')
+        parser.add_argument('path', help='CSV file with a username,can_trial header or NDJSON file')
+        parser.add_argument('--inviter', required=True,
+                            help='Username of the group member sending the invites')
+        parser.add_argument('--join', action='store_true',
+                            help='Add the people as members without inviting them (the inviter must own the group)')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Format of the file (defaults to the file extension)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of records to resolve and write in each batch')
+
+    def handle(self, *args, **options):
+        file_format = options['format']
+        if file_format is None:
+            file_format = file_format_for(options['path'])
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+        try:
+            group = ProposalGroup.objects.get(pk=options['group_id'])
+            inviter = User.objects.get(username=options['inviter'])
+        except ProposalGroup.DoesNotExist:
+            raise CommandError('Group {} does not exist.'.format(options['group_id']))
+        except User.DoesNotExist:
+            raise CommandError('User {} does not exist.'.format(options['inviter']))
+        added = "Joined." if options['join'] else "Invited."
+        added_count = skipped_count = 0
+        with open(options['path'], newline='') as stream:
+            for batch in batches(read_records(stream, file_format, ('username', 'can_trial')),
+                                 options['batch_size']):
+                try:
+                    results = group.bulk_add_people(inviter, batch, join=options['join'])
+                except PermissionDenied as e:
+                    raise CommandError(str(e))
+                for record, result in results:
+                    self.stdout.write('{}: {}'.format(record[0], result))
+                    if result == added:
+                        added_count += 1
+                    else:
+                        skipped_count += 1
+        self.stdout.write('{} {} people, skipped {} records.'
+                          .format('Added' if options['join'] else 'Invited', added_count, skipped_count))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from consensus_engine.imports import batches, file_format_for, read_records
+from consensus_engine.models import ChoiceTicket
+
+
+class Command(BaseCommand):
+    help = 'Imports votes from a CSV or NDJSON file of user, proposal and choice records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a user,proposal,choice header or NDJSON file')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Format of the file (defaults to the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of records to cast in each batch')
+
+    def handle(self, *args, **options):
+        file_format = options['format']
+        if file_format is None:
+            file_format = file_format_for(options['path'])
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+        cast = 0
+        proposals = {}
+        rejected = []
+
+        def cast_batch(batch):
+            # consensus is updated once per proposal after all the batches
+            batch_cast, batch_proposals, batch_rejected = ChoiceTicket.objects.bulk_vote(
+                batch, update_consensus=False)
+            proposals.update(batch_proposals)
+            rejected.extend(batch_rejected)
+            return batch_cast
+
+        try:
+            with open(options['path'], newline='') as stream:
+                for batch in batches(read_records(stream, file_format, ('user', 'proposal', 'choice')),
+                                     options['batch_size']):
+                    cast += cast_batch(batch)
+        finally:
+            # the batches already cast are committed, so their consensus is updated even if the import fails
+            for proposal in proposals.values():
+                proposal.update_consensus()
+        for record, reason in rejected:
+            self.stderr.write('Rejected {}: {}'.format(record, reason))
+        self.stdout.write('Cast {} votes on {} proposals, rejected {} records.'
+                          .format(cast, len(proposals), len(rejected)))
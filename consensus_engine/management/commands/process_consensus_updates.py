@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+
+from consensus_engine.models import PendingConsensusUpdate
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the consensus and history for proposals queued by CONSENSUS_WRITE_BEHIND voting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process a single tick and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait between ticks')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximum number of proposals to recompute per tick')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = PendingConsensusUpdate.objects.process(batch_size=options['batch_size'])
+            if processed:
+                self.stdout.write('Recomputed consensus for {} proposals.'.format(processed))
+            if options['once']:
+                break
+            time.sleep(options['interval'])  # pragma: no cover
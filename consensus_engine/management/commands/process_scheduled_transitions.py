@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+
+from consensus_engine.models import ScheduledTransition
+
+
+class Command(BaseCommand):
+    help = 'Applies the scheduled publish, hold and archive transitions of proposals that are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process a single tick and exit')
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help='Seconds to wait between ticks')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of due transitions claimed per transaction')
+
+    def handle(self, *args, **options):
+        while True:
+            moved, rejected = ScheduledTransition.objects.process(batch_size=options['batch_size'])
+            if moved or rejected:
+                self.stdout.write('Applied {} scheduled transitions, rejected {}.'.format(len(moved), len(rejected)))
+            if options['once']:
+                break
+            time.sleep(options['interval'])  # pragma: no cover
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from consensus_engine.models import ChoiceVoteCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the maintained vote counters from the current choice tickets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proposal', type=int, action='append', dest='proposal_ids',
+                            help='Only rebuild the counters for this proposal id (can be repeated)')
+
+    def handle(self, *args, **options):
+        rebuilt = ChoiceVoteCount.objects.rebuild(proposal_ids=options['proposal_ids'])
+        self.stdout.write('Rebuilt {} vote counters.'.format(rebuilt))
@@ -0,0 +1,48 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from consensus_engine.models import Proposal, PendingArchiveRender
+from consensus_engine.static_archive import archive_root, render_batch
+from consensus_engine.utils import ProposalState
+
+
+class Command(BaseCommand):
+    help = ("Renders the archived proposals' pages, history by month pages and results to "
+            "CONSENSUS_STATIC_ARCHIVE_ROOT, in a pool of worker processes - run on a schedule to render "
+            "the proposals queued as they were archived")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes (1 renders in this process)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of proposals handed to a worker at a time')
+        parser.add_argument('--proposal', type=int, action='append', dest='proposal_ids',
+                            help='Only render this archived proposal id (can be repeated)')
+        parser.add_argument('--rerender', action='store_true',
+                            help='Render every archived proposal, not just the queued ones (fills a new archive)')
+
+    def handle(self, *args, **options):
+        if archive_root() is None:
+            raise CommandError('CONSENSUS_STATIC_ARCHIVE_ROOT is not set.')
+        started = timezone.now()
+        proposals = Proposal.objects.filter(state=ProposalState.ARCHIVED).order_by('id')
+        if options['proposal_ids']:
+            proposals = proposals.filter(id__in=options['proposal_ids'])
+        elif not options['rerender']:
+            proposals = proposals.filter(pendingarchiverender__isnull=False)
+        proposal_ids = list(proposals.values_list('id', flat=True))
+        batches = [proposal_ids[i:i + options['batch_size']]
+                   for i in range(0, len(proposal_ids), options['batch_size'])]
+        if options['workers'] > 1:
+            # the workers are forked and open their own database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'],
+                                     mp_context=multiprocessing.get_context('fork')) as pool:
+                written = sum(pool.map(render_batch, batches))
+        else:
+            written = sum(render_batch(batch) for batch in batches)
+        PendingArchiveRender.objects.rendered(proposal_ids, started)
+        self.stdout.write('Rendered {} archived proposals to {} files.'.format(len(proposal_ids), written))
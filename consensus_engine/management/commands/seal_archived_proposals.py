@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from consensus_engine.models import SealedTally
+
+
+class Command(BaseCommand):
+    help = 'Seals the final results of archived proposals in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of proposals to seal per batch')
+        parser.add_argument('--reseal', action='store_true',
+                            help='Seal the archived proposals that are already sealed again')
+
+    def handle(self, *args, **options):
+        after = 0
+        total = 0
+        while True:
+            sealed = SealedTally.objects.seal_archived(batch_size=options['batch_size'],
+                                                       reseal=options['reseal'], after=after)
+            if not sealed:
+                break
+            after = sealed[-1]
+            total += len(sealed)
+            self.stdout.write('Sealed {} proposals.'.format(len(sealed)))
+        self.stdout.write('Sealed {} archived proposals in total.'.format(total))
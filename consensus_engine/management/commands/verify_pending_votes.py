@@ -0,0 +1,81 @@
+import random
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from consensus_engine.models import GroupMembership, Proposal, ProposalChoice, ProposalGroup
+
+
+class Command(BaseCommand):
+    help = ('Compares the pending vote counters on the group memberships against the pending votes query, '
+            'optionally on a seeded dataset that is rolled back afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='Seed a dataset through the model methods, verify it and roll it back')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--proposals', type=int, default=10)
+        parser.add_argument('--repair', action='store_true',
+                            help='Recount the counters that do not match')
+
+    def seed(self, options):
+        # a fixed seed so a failing run can be repeated
+        chooser = random.Random(0)
+        now = timezone.now()
+        users = [User.objects.create(username='verify-{}'.format(i), password='!') for i in range(options['users'])]
+        groups = []
+        for g in range(2):
+            group = ProposalGroup.objects.create(group_name='verify {}'.format(g), owned_by=users[0])
+            for user in users:
+                if user == users[0] or chooser.random() < 0.8:
+                    group.join_group(user, can_trial=chooser.random() < 0.5)
+            groups.append(group)
+        for i in range(options['proposals']):
+            proposal = Proposal.objects.create(proposal_name='verify {}'.format(i), date_proposed=now,
+                                               proposal_description='verify', owned_by=users[0],
+                                               proposal_group=chooser.choice(groups))
+            for priority, text in ((100, 'Yes'), (200, 'No')):
+                ProposalChoice.objects.create(proposal=proposal, text=text, priority=priority, activated_date=now)
+            proposal.trial()
+            choices = list(proposal.proposalchoice_set.all())
+            members = [membership.user for membership in proposal.proposal_group.get_members()]
+            for user in members:
+                if chooser.random() < 0.3 and proposal.can_vote(user):
+                    chooser.choice(choices).vote(user)
+            proposal.publish()
+            for user in members:
+                if chooser.random() < 0.5:
+                    chooser.choice(choices).vote(user)
+            if chooser.random() < 0.2:
+                choices[0].deactivated_date = now
+                choices[0].save()
+            if chooser.random() < 0.2:
+                proposal.hold()
+        for group in groups:
+            for membership in group.get_members().exclude(user=users[0]):
+                if chooser.random() < 0.1:
+                    group.remove_member(membership.user)
+        return users
+
+    def verify(self, users, options):
+        mismatches = ProposalGroup.objects.pending_votes_mismatches(users)
+        for user_id, group_id, counter, expected in mismatches:
+            self.stdout.write('user {} group {}: counter {}, expected {}'.format(user_id, group_id, counter, expected))
+        self.stdout.write('Checked {} users, {} mismatched counters.'.format(len(users), len(mismatches)))
+        if mismatches and options['repair']:
+            repaired = GroupMembership.objects.recount_pending_votes(
+                GroupMembership.objects.filter(user_id__in={mismatch[0] for mismatch in mismatches}))
+            self.stdout.write('Recounted {} memberships.'.format(repaired))
+        return mismatches
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            with transaction.atomic():
+                mismatches = self.verify(self.seed(options), options)
+                # leave the database as it was
+                transaction.set_rollback(True)
+        else:
+            mismatches = self.verify(list(User.objects.filter(groupmembership__isnull=False).distinct()), options)
+        if mismatches and not options['repair']:
+            raise CommandError('The pending vote counters do not match the pending votes query.')
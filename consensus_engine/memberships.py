@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# the resolver of the request being handled (set by the MembershipMiddleware)
+_current_resolver = ContextVar('consensus_membership_resolver', default=None)
+
+
+class MembershipResolver:
+    """
+    The user's group memberships for one request
+    - loads the group ids and whether the user can trial in each with one query, on first use
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._memberships = None
+
+    @property
+    def user_id(self):
+        return self.user.id if self.user.is_authenticated else None
+
+    @property
+    def memberships(self):
+        if self._memberships is None:
+            # imported here as the models import this module
+            from consensus_engine.models import GroupMembership
+            if self.user_id is None:
+                self._memberships = {}
+            else:
+                self._memberships = dict(GroupMembership.objects.filter(user_id=self.user_id)
+                                                                .values_list('group_id', 'can_trial'))
+        return self._memberships
+
+    def is_member(self, group_id):
+        return group_id in self.memberships
+
+    def can_trial(self, group_id):
+        return bool(self.memberships.get(group_id, False))
+
+    def clear(self):
+        self._memberships = None
+
+
+def resolver_for(user):
+    """ The current request's resolver if it is for the user (None outside of a request) """
+    resolver = _current_resolver.get()
+    if resolver is None or user is None or user.id is None or resolver.user_id != user.id:
+        return None
+    return resolver
+
+
+def memberships_changed(user_id):
+    """ Makes the current request reload the user's memberships after they have changed """
+    resolver = _current_resolver.get()
+    if resolver is not None and resolver.user_id == user_id:
+        resolver.clear()
+
+
+@contextmanager
+def request_memberships(user):
+    """ Resolves the user's memberships from one load for the models and views called inside """
+    resolver = MembershipResolver(user)
+    token = _current_resolver.set(resolver)
+    try:
+        yield resolver
+    finally:
+        _current_resolver.reset(token)
@@ -0,0 +1,44 @@
+import mimetypes
+from django.http import FileResponse
+
+from consensus_engine.memberships import request_memberships
+from consensus_engine.static_archive import archived_file
+
+
+class MembershipMiddleware:
+    """
+    Gives each request a resolver of the user's group memberships (request.memberships)
+    - the membership and trial checks in the models and views read it instead of querying each time
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_memberships(request.user) as resolver:
+            request.memberships = resolver
+            return self.get_response(request)
+
+
+class StaticArchiveMiddleware:
+    """
+    Serves the pre-rendered pages and results of archived proposals from CONSENSUS_STATIC_ARCHIVE_ROOT
+    - runs once the url is resolved and the user is known, as the archive is still only for logged in users
+    - the files are the same for every user (the pages load the user's sidebar from the sidebar view)
+    - anything not in the archive goes on to the view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return None
+        path = archived_file(request.resolver_match.url_name, view_kwargs)
+        if path is None:
+            return None
+        content_type, _ = mimetypes.guess_type(path)
+        return FileResponse(open(path, 'rb'), content_type='{}; charset=utf-8'.format(content_type))
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:00
+
+import consensus_engine.utils
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_vote_counts(apps, schema_editor):
+    ChoiceTicket = apps.get_model('consensus_engine', 'ChoiceTicket')
+    ChoiceVoteCount = apps.get_model('consensus_engine', 'ChoiceVoteCount')
+    totals = (ChoiceTicket.objects.filter(current=True)
+              .values('proposal_choice_id', 'state')
+              .annotate(total=models.Count('id'))
+              .order_by())
+    ChoiceVoteCount.objects.bulk_create([ChoiceVoteCount(proposal_choice_id=total['proposal_choice_id'],
+                                                         state=total['state'],
+                                                         count=total['total'])
+                                         for total in totals])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0032_proposalgroup_group_default_choices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceVoteCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.IntegerField(choices=[(0, 'DRAFT'), (1, 'TRIAL'), (2, 'PUBLISHED'), (3, 'ON_HOLD'), (4, 'ARCHIVED')], default=consensus_engine.utils.ProposalState['PUBLISHED'])),
+                ('count', models.IntegerField(default=0)),
+                ('proposal_choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposalchoice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='choicevotecount',
+            constraint=models.UniqueConstraint(fields=('proposal_choice', 'state'), name='unique_choice_vote_count'),
+        ),
+        migrations.RunPython(populate_vote_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0033_choicevotecount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consensushistory',
+            name='keyframe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deltas', to='consensus_engine.consensushistory'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0034_consensushistory_keyframe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsensusRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.IntegerField(choices=[(0, 'DAY'), (1, 'MONTH')])),
+                ('period_start', models.DateField(verbose_name='period start')),
+                ('snapshot_date', models.DateTimeField(verbose_name='snapshot date')),
+                ('consensus_data', models.TextField()),
+                ('consensus', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposalchoice')),
+                ('proposal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposal')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='consensusrollup',
+            constraint=models.UniqueConstraint(fields=('proposal', 'period', 'period_start'), name='unique_consensus_rollup'),
+        ),
+    ]
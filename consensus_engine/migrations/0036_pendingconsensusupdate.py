@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0035_consensusrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingConsensusUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dirty_since', models.DateTimeField(db_index=True, verbose_name='dirty since')),
+                ('marked_date', models.DateTimeField(verbose_name='marked date')),
+                ('proposal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposal')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0036_pendingconsensusupdate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='choiceticket',
+            index=models.Index(condition=models.Q(current=True), fields=['proposal_choice', 'state'], name='ticket_current_choice_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='choiceticket',
+            index=models.Index(condition=models.Q(current=True), fields=['user', 'state', 'proposal_choice'], name='ticket_current_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consensushistory',
+            index=models.Index(fields=['proposal', 'snapshot_date'], name='history_proposal_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupmembership',
+            index=models.Index(fields=['group', 'user'], name='membership_group_user_idx'),
+        ),
+    ]
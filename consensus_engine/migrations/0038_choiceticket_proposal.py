@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0037_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='choiceticket',
+            name='ticket_current_user_idx',
+        ),
+        migrations.AddField(
+            model_name='choiceticket',
+            name='proposal',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposal'),
+        ),
+        migrations.AddIndex(
+            model_name='choiceticket',
+            index=models.Index(condition=models.Q(current=True), fields=['user', 'proposal', 'state'], name='ticket_current_user_idx'),
+        ),
+    ]
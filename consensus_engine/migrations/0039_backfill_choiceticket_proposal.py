@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def backfill_choiceticket_proposal(apps, schema_editor):
+    ChoiceTicket = apps.get_model('consensus_engine', 'ChoiceTicket')
+    ProposalChoice = apps.get_model('consensus_engine', 'ProposalChoice')
+    proposal_id = ProposalChoice.objects.filter(id=models.OuterRef('proposal_choice_id')).values('proposal_id')[:1]
+    last_id = ChoiceTicket.objects.aggregate(last_id=models.Max('id'))['last_id'] or 0
+    # chunks of ids so each update is short and committed on its own
+    for start in range(0, last_id + 1, BACKFILL_CHUNK_SIZE):
+        (ChoiceTicket.objects.filter(id__gte=start, id__lt=start + BACKFILL_CHUNK_SIZE, proposal__isnull=True)
+                             .update(proposal_id=models.Subquery(proposal_id)))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('consensus_engine', '0038_choiceticket_proposal'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_choiceticket_proposal, migrations.RunPython.noop),
+    ]
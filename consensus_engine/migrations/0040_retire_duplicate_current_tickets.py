@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:19
+
+from collections import Counter
+from django.db import migrations, models
+
+
+def retire_duplicate_current_tickets(apps, schema_editor):
+    # keep the latest current ticket for each user, proposal and state so the unique constraint can be added
+    ChoiceTicket = apps.get_model('consensus_engine', 'ChoiceTicket')
+    ChoiceVoteCount = apps.get_model('consensus_engine', 'ChoiceVoteCount')
+    duplicates = (ChoiceTicket.objects.filter(current=True, user__isnull=False)
+                  .values('user_id', 'proposal_id', 'state')
+                  .annotate(latest_id=models.Max('id'), total=models.Count('id'))
+                  .filter(total__gt=1)
+                  .order_by())
+    for duplicate in duplicates:
+        stale = (ChoiceTicket.objects.filter(user_id=duplicate['user_id'], proposal_id=duplicate['proposal_id'],
+                                             state=duplicate['state'], current=True)
+                 .exclude(id=duplicate['latest_id']))
+        retired = Counter(stale.values_list('proposal_choice_id', flat=True))
+        stale.update(current=False)
+        for choice_id, count in retired.items():
+            (ChoiceVoteCount.objects.filter(proposal_choice_id=choice_id, state=duplicate['state'])
+                                    .update(count=models.F('count') - count))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0039_backfill_choiceticket_proposal'),
+    ]
+
+    operations = [
+        migrations.RunPython(retire_duplicate_current_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0040_retire_duplicate_current_tickets'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='choiceticket',
+            name='ticket_current_user_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='choiceticket',
+            constraint=models.UniqueConstraint(condition=models.Q(current=True), fields=('user', 'proposal', 'state'), name='unique_current_ticket'),
+        ),
+    ]
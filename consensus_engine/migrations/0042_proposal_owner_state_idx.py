@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0041_unique_current_ticket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='proposal',
+            index=models.Index(fields=['owned_by', 'state', '-id'], name='proposal_owner_state_idx'),
+        ),
+    ]
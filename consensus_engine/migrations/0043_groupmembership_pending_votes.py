@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:28
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+PUBLISHED = 2
+
+
+def populate_pending_votes(apps, schema_editor):
+    ChoiceTicket = apps.get_model('consensus_engine', 'ChoiceTicket')
+    GroupMembership = apps.get_model('consensus_engine', 'GroupMembership')
+    Proposal = apps.get_model('consensus_engine', 'Proposal')
+    votes = ChoiceTicket.objects.filter(proposal=models.OuterRef('pk'),
+                                        user=models.OuterRef(models.OuterRef('user')),
+                                        current=True,
+                                        proposal_choice__deactivated_date__isnull=True)
+    pending = (Proposal.objects.filter(~models.Exists(votes),
+                                       proposal_group=models.OuterRef('group'),
+                                       state=PUBLISHED)
+               .order_by()
+               .values('proposal_group')
+               .annotate(total=models.Count('id'))
+               .values('total'))
+    GroupMembership.objects.update(pending_votes=Coalesce(models.Subquery(pending), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0042_proposal_owner_state_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmembership',
+            name='pending_votes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_pending_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations
+
+# case insensitive prefix search (istartswith) on the user names and emails for the invite typeahead
+USER_SEARCH_INDEXES = {
+    'postgresql': ['CREATE INDEX user_search_username_idx ON auth_user (UPPER(username::text) text_pattern_ops)',
+                   'CREATE INDEX user_search_email_idx ON auth_user (UPPER(email::text) text_pattern_ops)'],
+    # sqlite only uses an index for a case insensitive LIKE when the index is NOCASE
+    'sqlite': ['CREATE INDEX user_search_username_idx ON auth_user (username COLLATE NOCASE)',
+               'CREATE INDEX user_search_email_idx ON auth_user (email COLLATE NOCASE)'],
+}
+
+
+def create_user_search_indexes(apps, schema_editor):
+    for sql in USER_SEARCH_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_user_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in USER_SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX user_search_username_idx')
+        schema_editor.execute('DROP INDEX user_search_email_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('consensus_engine', '0043_groupmembership_pending_votes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_search_indexes, drop_user_search_indexes),
+    ]
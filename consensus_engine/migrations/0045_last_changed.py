@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0044_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposal',
+            name='last_changed',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='last changed'),
+        ),
+        migrations.AddField(
+            model_name='proposalgroup',
+            name='last_changed',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='last changed'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0045_last_changed'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='proposal',
+            index=models.Index(fields=['last_changed'], name='proposal_last_changed_idx'),
+        ),
+    ]
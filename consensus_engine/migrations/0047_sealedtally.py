@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0046_proposal_last_changed_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SealedTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sealed_date', models.DateTimeField(verbose_name='sealed date')),
+                ('spread', models.TextField()),
+                ('consensus_text', models.CharField(max_length=200, null=True)),
+                ('total_voters', models.IntegerField(default=0)),
+                ('total_votes', models.IntegerField(default=0)),
+                ('consensus', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='consensus_engine.proposalchoice')),
+                ('final_history', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='consensus_engine.consensushistory')),
+                ('proposal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sealed_tally', to='consensus_engine.proposal')),
+            ],
+        ),
+    ]
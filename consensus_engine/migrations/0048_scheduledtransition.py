@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0047_sealedtally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.IntegerField(choices=[(0, 'DRAFT'), (1, 'TRIAL'), (2, 'PUBLISHED'), (3, 'ON_HOLD'), (4, 'ARCHIVED')])),
+                ('due_date', models.DateTimeField(db_index=True, verbose_name='due date')),
+                ('proposal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_transitions', to='consensus_engine.proposal')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='scheduledtransition',
+            constraint=models.UniqueConstraint(fields=('proposal', 'state'), name='unique_scheduled_transition'),
+        ),
+    ]
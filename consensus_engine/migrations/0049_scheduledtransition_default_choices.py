@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0048_scheduledtransition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledtransition',
+            name='default_choices',
+            field=models.BooleanField(default=False),
+        ),
+    ]
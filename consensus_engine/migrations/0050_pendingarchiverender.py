@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 20:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consensus_engine', '0049_scheduledtransition_default_choices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingArchiveRender',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_date', models.DateTimeField(db_index=True, verbose_name='queued date')),
+                ('proposal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='consensus_engine.proposal')),
+            ],
+        ),
+    ]
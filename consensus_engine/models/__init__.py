@@ -1,7 +1,18 @@
 from .voting_models import ChoiceTicketManager
 from .voting_models import ChoiceTicket
+from .voting_models import ChoiceVoteCountManager
+from .voting_models import ChoiceVoteCount
 from .analytics_models import ConsensusHistoryManager
 from .analytics_models import ConsensusHistory
+from .analytics_models import ConsensusRollupManager
+from .analytics_models import ConsensusRollup
+from .analytics_models import PendingConsensusUpdateManager
+from .analytics_models import PendingConsensusUpdate
+from .analytics_models import PendingArchiveRenderManager
+from .analytics_models import PendingArchiveRender
+from .analytics_models import SealedTallyManager
+from .analytics_models import SealedTally
+from .proposal_group_membership_models import GroupMembershipManager
 from .proposal_group_membership_models import GroupMembership
 from .proposal_group_membership_models import GroupInviteManager
 from .proposal_group_membership_models import GroupInvite
@@ -9,11 +20,14 @@ from .proposal_models import ProposalManager
 from .proposal_models import Proposal
 from .proposal_models import ProposalChoiceManager
 from .proposal_models import ProposalChoice
+from .proposal_models import ScheduledTransitionManager
+from .proposal_models import ScheduledTransition
 from .proposal_group_models import ProposalGroupManager
 from .proposal_group_models import ProposalGroup
 
 
-__all__ = ['GroupMembership',
+__all__ = ['GroupMembershipManager',
+           'GroupMembership',
            'GroupInviteManager',
            'GroupInvite',
            'ProposalGroupManager',
@@ -22,8 +36,20 @@ __all__ = ['GroupMembership',
            'Proposal',
            'ProposalChoiceManager',
            'ProposalChoice',
+           'ScheduledTransitionManager',
+           'ScheduledTransition',
            'ChoiceTicketManager',
            'ChoiceTicket',
+           'ChoiceVoteCountManager',
+           'ChoiceVoteCount',
            'ConsensusHistoryManager',
            'ConsensusHistory',
+           'ConsensusRollupManager',
+           'ConsensusRollup',
+           'PendingConsensusUpdateManager',
+           'PendingConsensusUpdate',
+           'PendingArchiveRenderManager',
+           'PendingArchiveRender',
+           'SealedTallyManager',
+           'SealedTally',
            ]
@@ -1,17 +1,38 @@
-from django.db import models
+from django.db import models, transaction
+from django.conf import settings
 from django.utils import timezone
+from datetime import timedelta
+from consensus_engine.utils import RollupPeriod
 import json
 
 
+def _same_window(first_datetime, second_datetime, window_seconds):
+    """ True if both datetimes fall in the same coalescing window """
+    if window_seconds <= 0:
+        return False
+    return (int(first_datetime.timestamp() // window_seconds)
+            == int(second_datetime.timestamp() // window_seconds))
+
+
 class ConsensusHistoryManager(models.Manager):
     """ A manager to get the information for ConsensusHistory """
 
     def at_date(self, proposal, at_date):
+        # read the end of day rollup if there is one
+        try:
+            return (ConsensusRollup.objects.filter(proposal=proposal,
+                                                   period=RollupPeriod.DAY,
+                                                   period_start__lte=at_date.date())
+                    .latest('period_start'))
+        except ConsensusRollup.DoesNotExist:
+            pass
         # make it the end of the day
         query_datetime = at_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        snapshot = ConsensusHistory.objects.filter(proposal=proposal,
-                                                   snapshot_date__lte=query_datetime
-                                                   ).latest('snapshot_date')
+        snapshot = (ConsensusHistory.objects.filter(proposal=proposal,
+                                                    snapshot_date__lte=query_datetime
+                                                    )
+                    .select_related('keyframe')
+                    .latest('snapshot_date'))
         return snapshot
 
     def all_history_for_proposal(self, proposal):
@@ -23,19 +44,124 @@ class ConsensusHistoryManager(models.Manager):
                                                    ).earliest('snapshot_date')
         return snapshot
 
+    def earliest_snapshot_date(self, proposal):
+        """
+        Gets the date of the earliest snapshot, None if there is no history
+        - the earlier of the first monthly rollup and the first raw snapshot, as the rollups may only be
+          partly backfilled
+        """
+        dates = [ConsensusRollup.objects.filter(proposal=proposal, period=RollupPeriod.MONTH)
+                 .order_by('period_start')
+                 .values_list('snapshot_date', flat=True)
+                 .first(),
+                 ConsensusHistory.objects.filter(proposal=proposal)
+                 .order_by('snapshot_date')
+                 .values_list('snapshot_date', flat=True)
+                 .first()]
+        dates = [earliest_date for earliest_date in dates if earliest_date is not None]
+        return min(dates) if dates else None
+
+    def record_snapshot(self, proposal):
+        """
+        Records the current consensus of the proposal
+        - snapshots in the same CONSENSUS_HISTORY_COALESCE_SECONDS window are merged into one row
+        - only every CONSENSUS_HISTORY_KEYFRAME_INTERVAL rows is stored in full, the rest as deltas
+        """
+        coalesce_seconds = getattr(settings, 'CONSENSUS_HISTORY_COALESCE_SECONDS', 0)
+        keyframe_interval = getattr(settings, 'CONSENSUS_HISTORY_KEYFRAME_INTERVAL', 1)
+        snapshot = ConsensusHistory.build_snapshot(proposal)
+        data = snapshot.get_consensus_data()
+        latest = (ConsensusHistory.objects.filter(proposal=proposal)
+                  .select_related('keyframe')
+                  .order_by('-snapshot_date', '-id')
+                  .first())
+        if latest is not None and _same_window(latest.snapshot_date, snapshot.snapshot_date, coalesce_seconds):
+            # merge into the latest row rather than adding another one
+            latest.snapshot_date = snapshot.snapshot_date
+            latest.consensus = snapshot.consensus
+            latest.encode(data, latest.keyframe)
+            latest.save()
+            return latest
+        if latest is not None and keyframe_interval > 1:
+            keyframe = latest.keyframe or latest
+            if keyframe.deltas.count() < keyframe_interval - 1:
+                snapshot.encode(data, keyframe)
+        snapshot.save()
+        return snapshot
+
+    def record_snapshots(self, snapshots):
+        """
+        Records snapshots of several proposals taken at the same time with a bounded number of statements
+        - the snapshots are stored in full (no coalescing or deltas) and rolled up together
+        """
+        with transaction.atomic():
+            created = self.bulk_create(snapshots)
+            ConsensusRollup.objects.roll_up_many(created)
+        return created
+
+    def compact(self, proposal, coalesce_seconds, keyframe_interval):
+        """
+        Rewrites the history of the proposal with the coalescing window and keyframe interval given
+        - an archived proposal's sealed snapshot is never merged into a later one, it is rebuilt as a keyframe
+          and its sealed tally re-linked to it
+        """
+        history = list(ConsensusHistory.objects.filter(proposal=proposal)
+                       .select_related('keyframe')
+                       .order_by('snapshot_date', 'id'))
+        sealed_history_id = (SealedTally.objects.filter(proposal=proposal)
+                             .values_list('final_history_id', flat=True)
+                             .first())
+        kept = []
+        for item in history:
+            entry = (item.snapshot_date, item.consensus_id, item.get_consensus_data(), item.id == sealed_history_id)
+            if kept and not kept[-1][3] and _same_window(kept[-1][0], item.snapshot_date, coalesce_seconds):
+                kept[-1] = entry
+            else:
+                kept.append(entry)
+        with transaction.atomic():
+            ConsensusHistory.objects.filter(proposal=proposal).delete()
+            keyframe = None
+            deltas = 0
+            for snapshot_date, consensus_id, data, sealed in kept:
+                item = ConsensusHistory(snapshot_date=snapshot_date, proposal=proposal, consensus_id=consensus_id)
+                if keyframe is not None and deltas < keyframe_interval - 1 and not sealed:
+                    item.encode(data, keyframe)
+                    deltas += 1
+                else:
+                    item.encode(data)
+                    keyframe = item
+                    deltas = 0
+                item.save()
+                if sealed:
+                    SealedTally.objects.filter(proposal=proposal).update(final_history=item)
+        return len(history), len(kept)
+
 
 class ConsensusHistory(models.Model):
     """
     Saves a snapshot of the vote at a particular time
     - snapshot data is stored in a list of dictionaries
+    - delta snapshots store only the choices that differ from their keyframe
     """
     snapshot_date = models.DateTimeField('snapshot date')
     proposal = models.ForeignKey('Proposal', on_delete=models.CASCADE)
     consensus = models.ForeignKey('ProposalChoice', on_delete=models.CASCADE, null=True)
     consensus_data = models.TextField()
+    keyframe = models.ForeignKey('self', on_delete=models.CASCADE, null=True, related_name='deltas')
     # manager
     objects = ConsensusHistoryManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['proposal', 'snapshot_date'], name='history_proposal_date_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # keep the end of period rollups in step with the history
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            ConsensusRollup.objects.roll_up(self)
+
     # class functions
     @classmethod
     def build_snapshot(cls, proposal):
@@ -46,15 +172,318 @@ class ConsensusHistory(models.Model):
     def snapshot(self, proposal):
         self.snapshot_date = timezone.now()
         self.proposal = proposal
-        self.consensus = proposal.current_consensus
+        self.consensus = proposal.live_consensus()
         data_list = []
-        active_choices = proposal.get_active_choices()
+        active_choices = proposal.get_choice_tallies()
         for choice in active_choices:
             data_element = {"choice_id": choice.id,
                             "text": choice.text,
-                            "count": choice.current_vote_count}
+                            "count": choice.choice_votes}
             data_list.append(data_element)
         self.consensus_data = json.dumps(data_list)
 
+    def encode(self, data_list, keyframe=None):
+        """ Stores the data in full, or as a delta against the keyframe if one is passed """
+        self.keyframe = keyframe
+        if keyframe is None:
+            self.consensus_data = json.dumps(data_list)
+            return
+        keyframe_data = {item['choice_id']: item for item in keyframe.get_consensus_data()}
+        choice_ids = {item['choice_id'] for item in data_list}
+        delta = {"changed": [item for item in data_list if keyframe_data.get(item['choice_id']) != item],
+                 "removed": [choice_id for choice_id in keyframe_data if choice_id not in choice_ids]}
+        self.consensus_data = json.dumps(delta)
+
+    def get_consensus_data(self):
+        if self.keyframe_id is None:
+            return json.loads(self.consensus_data)
+        delta = json.loads(self.consensus_data)
+        changed = {item['choice_id']: item for item in delta['changed']}
+        data_list = []
+        for item in self.keyframe.get_consensus_data():
+            if item['choice_id'] not in delta['removed']:
+                data_list.append(changed.pop(item['choice_id'], item))
+        data_list.extend(changed.values())
+        return data_list
+
+
+class ConsensusRollupManager(models.Manager):
+    """ Manager for the end of period consensus rollups """
+
+    def roll_up(self, snapshot):
+        """ Makes the snapshot the end of period rollup for its day and month unless there is a later one """
+        values = {'snapshot_date': snapshot.snapshot_date,
+                  'consensus_id': snapshot.consensus_id,
+                  'consensus_data': json.dumps(snapshot.get_consensus_data())}
+        for period in RollupPeriod:
+            rollup = self.get_queryset().filter(proposal_id=snapshot.proposal_id, period=period,
+                                                period_start=period.period_start(snapshot.snapshot_date))
+            if not rollup.filter(snapshot_date__lte=snapshot.snapshot_date).update(**values):
+                rollup.get_or_create(proposal_id=snapshot.proposal_id, period=period,
+                                     period_start=period.period_start(snapshot.snapshot_date),
+                                     defaults=values)
+
+    def roll_up_many(self, snapshots):
+        """ roll_up for snapshots of different proposals taken at the same time, three statements a period """
+        if not snapshots:
+            return
+        snapshot_date = snapshots[0].snapshot_date
+        proposal_ids = [snapshot.proposal_id for snapshot in snapshots]
+        for period in RollupPeriod:
+            period_start = period.period_start(snapshot_date)
+            rollups = self.get_queryset().filter(proposal_id__in=proposal_ids, period=period,
+                                                 period_start=period_start)
+            rollups.filter(snapshot_date__lte=snapshot_date).delete()
+            # a later rollup stays
+            later = set(rollups.values_list('proposal_id', flat=True))
+            self.bulk_create([ConsensusRollup(proposal_id=snapshot.proposal_id, period=period,
+                                              period_start=period_start, snapshot_date=snapshot_date,
+                                              consensus_id=snapshot.consensus_id,
+                                              consensus_data=json.dumps(snapshot.get_consensus_data()))
+                              for snapshot in snapshots if snapshot.proposal_id not in later])
+
+    def rebuild(self, proposal):
+        """ Rebuilds the rollups for the proposal from its consensus history """
+        latest = {}
+        history = (ConsensusHistory.objects.filter(proposal=proposal)
+                   .select_related('keyframe')
+                   .order_by('snapshot_date', 'id'))
+        for snapshot in history.iterator():
+            for period in RollupPeriod:
+                latest[(period, period.period_start(snapshot.snapshot_date))] = snapshot
+        with transaction.atomic():
+            self.get_queryset().filter(proposal=proposal).delete()
+            rollups = self.bulk_create([ConsensusRollup(proposal=proposal, period=period, period_start=period_start,
+                                                        snapshot_date=snapshot.snapshot_date,
+                                                        consensus_id=snapshot.consensus_id,
+                                                        consensus_data=json.dumps(snapshot.get_consensus_data()))
+                                        for (period, period_start), snapshot in latest.items()])
+        return len(rollups)
+
+
+class ConsensusRollup(models.Model):
+    """
+    The last snapshot of the consensus in a day or a month
+    - snapshot data is stored in full in the same format as ConsensusHistory
+    """
+    proposal = models.ForeignKey('Proposal', on_delete=models.CASCADE)
+    period = models.IntegerField(choices=RollupPeriod.choices())
+    period_start = models.DateField('period start')
+    snapshot_date = models.DateTimeField('snapshot date')
+    consensus = models.ForeignKey('ProposalChoice', on_delete=models.CASCADE, null=True)
+    consensus_data = models.TextField()
+    # manager
+    objects = ConsensusRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['proposal', 'period', 'period_start'], name='unique_consensus_rollup'),
+        ]
+
     def get_consensus_data(self):
         return json.loads(self.consensus_data)
+
+
+class SealedTallyManager(models.Manager):
+    """ Manager for the final results of archived proposals """
+
+    def seal(self, proposal):
+        """
+        Records the final spread, consensus and totals of the archived proposal and a full history keyframe
+        - archived proposals never change state again so their reads are served from this record
+        """
+        return self.seal_many([proposal.id])[proposal.id]
+
+    def seal_many(self, proposal_ids):
+        """
+        seal for several archived proposals with a bounded number of statements
+        - one aggregated query each for the tallies and the voters, set based updates of the consensus flags,
+          bulk created history keyframes and tallies
+        - returns the tallies by proposal id
+        """
+        # imported here as the proposal models import this module
+        from django.db.models import Count, OuterRef, Subquery
+        from django.db.models.functions import Coalesce
+        from consensus_engine.models import Proposal, ProposalChoice, ChoiceTicket, ChoiceVoteCount
+        from consensus_engine.models.proposal_models import _choose_consensus
+        from consensus_engine.utils import ProposalState
+        proposal_ids = set(proposal_ids)
+        if not proposal_ids:
+            return {}
+        reporting_state = ProposalState.reporting_as_state(ProposalState.ARCHIVED)
+        with transaction.atomic():
+            # a pending write-behind consensus is settled as part of the final result
+            PendingConsensusUpdate.objects.filter(proposal_id__in=proposal_ids).delete()
+            votes = (ChoiceVoteCount.objects.filter(proposal_choice=OuterRef('id'), state=reporting_state)
+                                            .values('count'))
+            tallies = (ProposalChoice.objects.filter(proposal_id__in=proposal_ids, deactivated_date__isnull=True)
+                                             .annotate(choice_votes=Coalesce(Subquery(votes), 0))
+                                             .order_by('proposal_id', 'id'))
+            choices_by_proposal = {proposal_id: [] for proposal_id in proposal_ids}
+            for choice in tallies:
+                choices_by_proposal[choice.proposal_id].append(choice)
+            voters = dict(ChoiceTicket.objects.filter(proposal_choice__proposal_id__in=proposal_ids,
+                                                      current=True, state=reporting_state)
+                                              .values('proposal_choice__proposal_id')
+                                              .annotate(voters=Count('user_id', distinct=True))
+                                              .values_list('proposal_choice__proposal_id', 'voters'))
+            consensus = {proposal_id: _choose_consensus(choices)
+                         for proposal_id, choices in choices_by_proposal.items()}
+            consensus_ids = {choice.id for choice in consensus.values() if choice is not None}
+            active_choices = ProposalChoice.objects.filter(proposal_id__in=proposal_ids, deactivated_date__isnull=True)
+            active_choices.filter(id__in=consensus_ids, current_consensus=False).update(current_consensus=True)
+            active_choices.filter(current_consensus=True).exclude(id__in=consensus_ids).update(current_consensus=False)
+            sealed_date = timezone.now()
+            history = []
+            for proposal_id, choices in choices_by_proposal.items():
+                snapshot = ConsensusHistory(snapshot_date=sealed_date, proposal_id=proposal_id,
+                                            consensus=consensus[proposal_id])
+                snapshot.encode([{"choice_id": choice.id, "text": choice.text, "count": choice.choice_votes}
+                                 for choice in choices])
+                history.append(snapshot)
+            ConsensusHistory.objects.record_snapshots(history)
+            # bulk_create does not set the ids on every database
+            history_ids = dict(ConsensusHistory.objects.filter(proposal_id__in=proposal_ids, snapshot_date=sealed_date)
+                                                       .order_by('id')
+                                                       .values_list('proposal_id', 'id'))
+            sealed = []
+            for proposal_id, choices in choices_by_proposal.items():
+                total_voters = voters.get(proposal_id, 0)
+                spread = {choice.id: {'text': choice.text,
+                                      'count': choice.choice_votes,
+                                      'percentage': ((choice.choice_votes / total_voters) * 100.0
+                                                     if total_voters > 0 and choice.choice_votes > 0 else 0)}
+                          for choice in choices}
+                choice = consensus[proposal_id]
+                sealed.append(SealedTally(proposal_id=proposal_id, sealed_date=sealed_date,
+                                          spread=json.dumps(spread),
+                                          consensus=choice,
+                                          consensus_text=choice.text if choice is not None else None,
+                                          total_voters=total_voters,
+                                          total_votes=sum(item.choice_votes for item in choices),
+                                          final_history_id=history_ids.get(proposal_id)))
+            # resealing replaces the tallies
+            self.get_queryset().filter(proposal_id__in=proposal_ids).delete()
+            self.bulk_create(sealed)
+            Proposal.objects.mark_changed(proposal_ids)
+        return {tally.proposal_id: tally for tally in self.get_queryset().filter(proposal_id__in=proposal_ids)}
+
+    def seal_archived(self, batch_size=100, reseal=False, after=0):
+        """
+        Seals the next batch_size archived proposals after the id given, in id order
+        - only the ones not yet sealed unless reseal
+        - returns the ids of the proposals sealed
+        """
+        # imported here as the proposal models import this module
+        from consensus_engine.models import Proposal
+        from consensus_engine.utils import ProposalState
+        proposals = Proposal.objects.filter(state=ProposalState.ARCHIVED, id__gt=after).order_by('id')
+        if not reseal:
+            proposals = proposals.filter(sealed_tally__isnull=True)
+        sealed = list(proposals[:batch_size].values_list('id', flat=True))
+        self.seal_many(sealed)
+        return sealed
+
+
+class SealedTally(models.Model):
+    """
+    The final result of an archived proposal
+    - spread is stored in the get_voting_spread format, keyed by choice id
+    """
+    proposal = models.OneToOneField('Proposal', on_delete=models.CASCADE, related_name='sealed_tally')
+    sealed_date = models.DateTimeField('sealed date')
+    spread = models.TextField()
+    consensus = models.ForeignKey('ProposalChoice', on_delete=models.SET_NULL, null=True)
+    # kept as text so the result stands even if the choice is removed
+    consensus_text = models.CharField(max_length=200, null=True)
+    total_voters = models.IntegerField(default=0)
+    total_votes = models.IntegerField(default=0)
+    final_history = models.ForeignKey('ConsensusHistory', on_delete=models.SET_NULL, null=True)
+    # manager
+    objects = SealedTallyManager()
+
+    def get_spread(self):
+        return {int(choice_id): vote_analysis for choice_id, vote_analysis in json.loads(self.spread).items()}
+
+
+class PendingConsensusUpdateManager(models.Manager):
+    """ Manager for the queue of proposals whose consensus needs recomputing (CONSENSUS_WRITE_BEHIND) """
+
+    def mark(self, proposal):
+        """ Marks the proposal as needing its consensus recomputed """
+        now = timezone.now()
+        if not self.get_queryset().filter(proposal=proposal).update(marked_date=now):
+            self.get_or_create(proposal=proposal, defaults={'dirty_since': now, 'marked_date': now})
+
+    def process(self, batch_size=100):
+        """ Recomputes the consensus once for each of up to batch_size pending proposals, oldest first """
+        processed = []
+        while len(processed) < batch_size:
+            with transaction.atomic():
+                # lock the row so the proposal is only recomputed by one worker at a time
+                # - only the pending row, a proposal locked by a vote or a transition must not be skipped
+                pending = (self.get_queryset()
+                           .select_for_update(skip_locked=True, of=('self',))
+                           .exclude(id__in=processed)
+                           .select_related('proposal')
+                           .order_by('dirty_since')
+                           .first())
+                if pending is None:
+                    break
+                processed.append(pending.id)
+                self.recompute(pending)
+        return len(processed)
+
+    def refresh_if_stale(self, proposal):
+        """ Recomputes the consensus now if it has been pending for longer than the allowed staleness """
+        if not getattr(settings, 'CONSENSUS_WRITE_BEHIND', False):
+            return False
+        max_staleness = getattr(settings, 'CONSENSUS_WRITE_BEHIND_MAX_STALENESS', 30)
+        with transaction.atomic():
+            pending = (self.get_queryset()
+                       .select_for_update()
+                       .filter(proposal=proposal,
+                               dirty_since__lte=timezone.now() - timedelta(seconds=max_staleness))
+                       .first())
+            if pending is None:
+                return False
+            self.recompute(pending)
+        return True
+
+    def recompute(self, pending):
+        pending.proposal.update_consensus()
+        pending.delete()
+
+
+class PendingConsensusUpdate(models.Model):
+    """
+    A proposal that has had votes cast since its consensus was last computed
+    - dirty_since is when it was first marked, marked_date when it was last marked
+    """
+    proposal = models.OneToOneField('Proposal', on_delete=models.CASCADE)
+    dirty_since = models.DateTimeField('dirty since', db_index=True)
+    marked_date = models.DateTimeField('marked date')
+    # manager
+    objects = PendingConsensusUpdateManager()
+
+
+class PendingArchiveRenderManager(models.Manager):
+    """ Manager for the queue of archived proposals waiting for render_static_archive """
+
+    def queue(self, proposal_ids):
+        """ Queues the proposals' render (a proposal already queued stays queued once) """
+        now = timezone.now()
+        self.bulk_create([PendingArchiveRender(proposal_id=proposal_id, queued_date=now)
+                          for proposal_id in proposal_ids], ignore_conflicts=True)
+
+    def rendered(self, proposal_ids, queued_before):
+        """ Removes the proposals rendered from the queue, unless queued again since the render started """
+        self.get_queryset().filter(proposal_id__in=proposal_ids, queued_date__lte=queued_before).delete()
+
+
+class PendingArchiveRender(models.Model):
+    """ An archived proposal whose static archive files have not been rendered """
+    proposal = models.OneToOneField('Proposal', on_delete=models.CASCADE)
+    queued_date = models.DateTimeField('queued date', db_index=True)
+    # manager
+    objects = PendingArchiveRenderManager()
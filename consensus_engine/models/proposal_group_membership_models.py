@@ -1,6 +1,38 @@
 from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db.models.functions import Coalesce
+from consensus_engine.utils import ProposalState
+from consensus_engine.caching import sidebar_cache
+from consensus_engine.memberships import memberships_changed
+
+
+class GroupMembershipManager(models.Manager):
+    """ Manager for Group Memberships """
+
+    def recount_pending_votes(self, memberships):
+        """ Recounts the published proposals that each of the memberships has still to vote on """
+        # imported here as the proposal models import this module
+        from consensus_engine.models import ChoiceTicket, Proposal
+        votes = ChoiceTicket.objects.filter(proposal=models.OuterRef('pk'),
+                                            user=models.OuterRef(models.OuterRef('user')),
+                                            current=True,
+                                            proposal_choice__deactivated_date__isnull=True)
+        pending = (Proposal.objects.filter(~models.Exists(votes),
+                                           proposal_group=models.OuterRef('group'),
+                                           state=ProposalState.PUBLISHED)
+                   .order_by()
+                   .values('proposal_group')
+                   .annotate(total=models.Count('id'))
+                   .values('total'))
+        return memberships.update(pending_votes=Coalesce(models.Subquery(pending), 0))
+
+    def recount_for_proposals(self, proposal_ids, user_ids=None):
+        """ Recounts the memberships of the groups of the proposals (for the users if given) """
+        memberships = self.get_queryset().filter(group__proposal__id__in=proposal_ids)
+        if user_ids is not None:
+            memberships = memberships.filter(user_id__in=user_ids)
+        return self.recount_pending_votes(memberships)
 
 
 class GroupMembership(models.Model):
@@ -9,6 +41,35 @@ class GroupMembership(models.Model):
     group = models.ForeignKey('ProposalGroup', on_delete=models.CASCADE, null=False)
     date_joined = models.DateTimeField('date joined')
     can_trial = models.BooleanField(default=False, null=True)
+    # published proposals in the group that the user has not voted on (the sidebar badge)
+    pending_votes = models.IntegerField(default=0)
+    # managers
+    objects = GroupMembershipManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'user'], name='membership_group_user_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                GroupMembership.objects.recount_pending_votes(GroupMembership.objects.filter(pk=self.pk))
+            ProposalGroup.objects.mark_changed([self.group_id])
+        memberships_changed(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            ProposalGroup.objects.mark_changed([self.group_id])
+        memberships_changed(self.user_id)
+        return deleted
 
 
 class GroupInviteManager(models.Manager):
@@ -50,9 +111,11 @@ class GroupInvite(models.Model):
             self.date_accepted_or_declined = timezone.now()
             self.group.join_group(self.invitee, can_trial=self.can_trial)
             self.save()
+        sidebar_cache.invalidate(self.invitee_id)
 
     def decline(self):
         with transaction.atomic():
             self.accepted = False
             self.date_accepted_or_declined = timezone.now()
             self.save()
+        sidebar_cache.invalidate(self.invitee_id)
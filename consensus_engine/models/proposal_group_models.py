@@ -1,10 +1,12 @@
-from django.db import models, DataError
+from django.db import models, transaction, DataError
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from django.core.exceptions import PermissionDenied
 from consensus_engine.utils import ProposalState
-from django.db.models import IntegerField, Value, F, Count, Case, When, Sum
+from consensus_engine.caching import group_cache, sidebar_cache
+from consensus_engine.memberships import resolver_for, memberships_changed
+from django.db.models import IntegerField, Value, F, Count, Case, When, Sum, Q, Exists, OuterRef
 from . import ChoiceTicket, Proposal, GroupMembership, GroupInvite, ProposalChoice
 
 
@@ -18,6 +20,18 @@ class ProposalGroupManager(models.Manager):
         """
         gets a list of groups that the user is a member of plus
         a count of published proposals they have still to vote on
+        - the count is the pending_votes counter kept on the user's membership rows
+        """
+        return (self.get_queryset()
+                .filter(groupmembership__user=user)
+                .annotate(propcount=F('groupmembership__pending_votes'))
+                .values('id', 'group_name', 'propcount')
+                .order_by('group_name'))
+
+    def pending_votes_by_query(self, user):
+        """
+        gets the same list as groups_for_member by querying the votes rather than reading the counters
+        - used to verify the counters
         """
         # query for a list of current votes
         all_user_choices = ChoiceTicket.objects.filter(current=True, user=user).values('proposal_choice_id')
@@ -54,6 +68,20 @@ class ProposalGroupManager(models.Manager):
         # returns a single query (not yet executed that has all the detail above)
         return all_groups_member_of
 
+    def pending_votes_mismatches(self, users):
+        """ Returns (user id, group id, counter, expected) for each of the users' counters that is wrong """
+        mismatches = []
+        for user in users:
+            expected = {group['id']: group['propcount'] for group in self.pending_votes_by_query(user)}
+            for group in self.groups_for_member(user):
+                if group['propcount'] != expected.get(group['id']):
+                    mismatches.append((user.id, group['id'], group['propcount'], expected.get(group['id'])))
+        return mismatches
+
+    def mark_changed(self, group_ids):
+        """ Records that what the groups' pages show has changed (conditional GETs) by moving on their versions """
+        group_cache.invalidate(*(set(group_ids) - {None}))
+
     def list_of_membership(self, user):
         return self.get_queryset().filter(groupmembership__user=user).values_list('id', flat=True)
 
@@ -64,17 +92,29 @@ class ProposalGroup(models.Model):
     owned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     group_description = models.CharField(max_length=200, null=True)
     group_default_choices = models.BooleanField(default=False, null=True)
+    # when the group itself was last edited - changes to its proposals move on its version in group_cache
+    last_changed = models.DateTimeField('last changed', default=timezone.now)
     # managers
     objects = ProposalGroupManager()
 
+    def save(self, *args, **kwargs):
+        self.last_changed = timezone.now()
+        super().save(*args, **kwargs)
+
     # class functions
     def get_absolute_url(self):
         return reverse('group_proposals', kwargs={'proposal_group_id': str(self.pk)})
 
     def is_user_member(self, user):
+        resolver = resolver_for(user)
+        if resolver is not None:
+            return resolver.is_member(self.id)
         return GroupMembership.objects.filter(user=user, group=self).count() == 1
 
     def is_user_part_of_trial(self, user):
+        resolver = resolver_for(user)
+        if resolver is not None:
+            return resolver.can_trial(self.id)
         return GroupMembership.objects.filter(user=user, group=self, can_trial=True).count() == 1
 
     def has_user_been_invited(self, user):
@@ -84,6 +124,7 @@ class ProposalGroup(models.Model):
         if not self.is_user_member(user):
             membership = GroupMembership(user=user, group=self, date_joined=timezone.now(), can_trial=can_trial)
             membership.save()
+            sidebar_cache.invalidate(user.id)
         else:
             raise DataError("User is already a member of this group.")
 
@@ -99,14 +140,101 @@ class ProposalGroup(models.Model):
                              can_trial=allow_trials,
                              invite_date_time=timezone.now())
         invite.save()
+        sidebar_cache.invalidate(invitee_user.id)
         return invite
 
+    def bulk_add_people(self, inviter_user, records, join=False):
+        """
+        Invites the people in (username, can trial) records to the group in bulk, or adds them as members if join
+        - the inviter is checked once, joining people without an invite is for the group owner only
+        - the usernames are resolved with whether each user is a member or has an open invite in one query
+        - the new invites or memberships are written with one bulk_create
+        - returns a (record, result) for each record, in order
+        """
+        if join and self.owned_by_id != inviter_user.id:
+            raise PermissionDenied("Only the owner can add people to the group without an invite")
+        if not self.is_user_member(inviter_user):
+            raise PermissionDenied("Inviter is not a member of the group")
+        people = []
+        for record in records:
+            username = str(record[0]).strip() if record[0] is not None else ''
+            can_trial = str(record[1]).strip().lower() in ('1', 'true', 'yes', 'y') if len(record) > 1 else False
+            people.append((record, username, can_trial))
+        members = GroupMembership.objects.filter(group=self, user=OuterRef('pk'))
+        open_invites = GroupInvite.objects.filter(group=self, invitee=OuterRef('pk'), accepted=None)
+        users = {username: (user_id, is_member, invited) for username, user_id, is_member, invited in
+                 User.objects.filter(username__in={username for _, username, _ in people if username})
+                             .annotate(has_membership=Exists(members), has_open_invite=Exists(open_invites))
+                             .values_list('username', 'id', 'has_membership', 'has_open_invite')}
+        results = []
+        added = {}
+        for record, username, can_trial in people:
+            user_id, is_member, invited = users.get(username, (None, False, False))
+            if not username:
+                results.append((record, "Invalid record."))
+            elif user_id is None:
+                results.append((record, "Unknown user."))
+            elif user_id in added:
+                results.append((record, "Duplicate record."))
+            elif is_member:
+                results.append((record, "Already a member."))
+            elif invited and not join:
+                results.append((record, "Already invited."))
+            else:
+                added[user_id] = can_trial
+                results.append((record, "Joined." if join else "Invited."))
+        if not added:
+            return results
+        now = timezone.now()
+        with transaction.atomic():
+            if join:
+                GroupMembership.objects.bulk_create([GroupMembership(user_id=user_id, group=self, date_joined=now,
+                                                                     can_trial=can_trial)
+                                                     for user_id, can_trial in added.items()])
+                GroupMembership.objects.recount_pending_votes(GroupMembership.objects.filter(group=self,
+                                                                                             user_id__in=added))
+                # the open invites of the people added are accepted
+                GroupInvite.objects.filter(group=self, invitee_id__in=added, accepted=None).update(
+                    accepted=True, date_accepted_or_declined=now)
+                ProposalGroup.objects.mark_changed([self.id])
+            else:
+                GroupInvite.objects.bulk_create([GroupInvite(group=self, invitee_id=user_id, inviter=inviter_user,
+                                                             can_trial=can_trial, invite_date_time=now)
+                                                 for user_id, can_trial in added.items()])
+        if join:
+            for user_id in added:
+                memberships_changed(user_id)
+        sidebar_cache.invalidate(*added)
+        return results
+
     def get_members(self):
         return GroupMembership.objects.filter(group=self)
 
+    def users_to_invite(self, prefix, page_size, after=None):
+        """
+        Gets a page of the users whose username or email starts with the prefix, ordered by username
+        - members and users with an open invite to the group are left out in the same query
+        - after is the last username of the previous page (keyset pagination)
+        - returns (users, next_after), next_after is None on the last page
+        """
+        users = (User.objects.filter(Q(username__istartswith=prefix) | Q(email__istartswith=prefix))
+                             .filter(~Exists(GroupMembership.objects.filter(group=self, user=OuterRef('pk'))),
+                                     ~Exists(GroupInvite.objects.filter(group=self, invitee=OuterRef('pk'),
+                                                                        accepted=None)))
+                             .order_by('username')
+                             .values('id', 'username'))
+        if after is not None:
+            users = users.filter(username__gt=after)
+        users = list(users[:page_size + 1])
+        return users[:page_size], users[page_size - 1]['username'] if len(users) > page_size else None
+
     def deactivate_votes_for_user_in_group(self, user):
-        ChoiceTicket.objects.filter(proposal_choice__proposal__proposal_group=self,
-                                    user=user).update(current=False)
+        """ Retires the user's votes in the group and recomputes the consensus of the proposals they were in """
+        tickets = ChoiceTicket.objects.filter(proposal__proposal_group=self, user=user)
+        with transaction.atomic():
+            affected = set(tickets.filter(current=True).values_list('proposal_id', flat=True))
+            ChoiceTicket.objects.retire(tickets)
+            Proposal.objects.recompute_consensus(affected)
 
     def remove_member(self, user):
         if user == self.owned_by:
@@ -118,6 +246,37 @@ class ProposalGroup(models.Model):
             removed_membership.delete()
         except GroupMembership.DoesNotExist:
             raise DataError("User is not a member of the group and cannot be removed")
+        sidebar_cache.invalidate(user.id)
+
+    def get_default_choices(self):
+        """ The (text, priority) of the group's default choices - the choices of its first published proposal """
+        copy_from_proposal = (Proposal.objects.filter(proposal_group=self, state=ProposalState.PUBLISHED)
+                                              .first())
+        if not copy_from_proposal:
+            raise DataError("No default data found")
+        return list(ProposalChoice.objects.filter(proposal=copy_from_proposal, deactivated_date__isnull=True)
+                                          .order_by('id')
+                                          .values_list('text', 'priority'))
+
+    def propagate_default_choices(self, proposals=None):
+        """
+        Publishes the group's draft proposals (or the draft proposals given) with the group's default choices
+        - the default choices are read once and copied to all of the proposals with one bulk_create
+        - returns the proposals published
+        """
+        if not self.has_default_group_proposal_choices:
+            raise DataError("Proposal Group does not have default choices.")
+        if proposals is None:
+            proposals = Proposal.objects.filter(proposal_group=self, state=ProposalState.DRAFT)
+        proposals = list(proposals)
+        if any(proposal.proposal_group_id != self.id or proposal.state != ProposalState.DRAFT
+               for proposal in proposals):
+            raise DataError("Only draft proposals in the group can be published with its default choices.")
+        with transaction.atomic():
+            ProposalChoice.objects.replace_choices(proposals, self.get_default_choices())
+            published, _ = Proposal.objects.transition(
+                Proposal.objects.filter(id__in=[proposal.id for proposal in proposals]), ProposalState.PUBLISHED)
+        return list(Proposal.objects.filter(id__in=published))
 
     def set_has_default_choices(self, default_choices_requested):
         if Proposal.objects.filter(proposal_group=self, state=ProposalState.PUBLISHED).count() == 0:
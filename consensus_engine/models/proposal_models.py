@@ -1,12 +1,42 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+import operator
 from django.db import models, transaction, DataError
+from django.conf import settings
+from django.db.models import Q, Sum, F, Case, When, Value, OuterRef, Subquery, Exists
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.urls import reverse
 from django.core.exceptions import PermissionDenied
 from consensus_engine.utils import ProposalState
-from . import GroupMembership, ChoiceTicket, ConsensusHistory
+from consensus_engine.caching import sidebar_cache, spread_cache
+from consensus_engine.live_feed import proposals_changed
+from consensus_engine.memberships import resolver_for
+from consensus_engine.static_archive import proposals_archived, proposal_unarchived
+from . import GroupMembership, ChoiceTicket, ChoiceVoteCount, ConsensusHistory, PendingConsensusUpdate, SealedTally
 from consensus_engine.exceptions import ProposalStateInvalid
 
+# the proposals marked changed inside ProposalManager.gathering_changes (None outside of one)
+_gathered_changes = ContextVar('consensus_gathered_changes', default=None)
+
+
+def _choose_consensus(choices):
+    """ The choice with the most votes (choice_votes), None if there are no votes or the most are tied """
+    # utilise simple - most votes = consensus
+    max_votes = 0
+    current_consensus = None
+    for choice in choices:
+        choice_votes = choice.choice_votes
+        if choice_votes > max_votes:
+            current_consensus = choice
+            max_votes = choice_votes
+        elif choice_votes == max_votes:  # tie break (no consensus)
+            current_consensus = None
+    return current_consensus
+
 
 class ProposalManager(models.Manager):
     """ Manager for Proposal data """
@@ -20,6 +50,203 @@ class ProposalManager(models.Manager):
         return (self.get_queryset().filter(proposal_group__id=group.id, state__in=states)
                     .values('id', 'proposal_name', 'proposal_description', 'state'))
 
+    def owned_with_votes(self, user, states={ProposalState.DRAFT, ProposalState.TRIAL, ProposalState.PUBLISHED,
+                                             ProposalState.ON_HOLD, ProposalState.ARCHIVED}):
+        return self.with_list_data(self.owned(user, states), user)
+
+    def in_group_with_votes(self, group, user, states={ProposalState.PUBLISHED}):
+        return self.with_list_data(self.in_group(group, states), user)
+
+    def owned_by_state(self, user, page_size, before={}):
+        """
+        Gets a page of the proposals owned by the user for each state in one query, newest first
+        - before maps a state to the id that its page starts below (keyset pagination)
+        - returns {state: (proposals, next_before)}, next_before is None on the last page
+        """
+        owned = self.get_queryset().filter(owned_by_id=user.id)
+        pages = []
+        for state in ProposalState:
+            page = Q(state=state)
+            if state in before:
+                page &= Q(id__lt=before[state])
+            # the id of the first proposal after the page (one extra row shows there is a next page)
+            boundary = owned.filter(page).order_by('-id').values('id')[page_size:page_size + 1]
+            pages.append(page & Q(id__gte=Coalesce(Subquery(boundary), 0)))
+        proposals = (owned.filter(reduce(operator.or_, pages))
+                          .order_by('state', '-id')
+                          .values('id', 'proposal_name', 'proposal_description', 'state'))
+        buckets = {state: [] for state in ProposalState}
+        for proposal in self.with_list_data(proposals, user):
+            buckets[proposal['state']].append(proposal)
+        return {state: (bucket[:page_size], bucket[page_size - 1]['id'] if len(bucket) > page_size else None)
+                for state, bucket in buckets.items()}
+
+    def mark_changed(self, proposal_ids):
+        """
+        Records that what the proposals' pages show has changed
+        - drops their cached spreads, moves on last_changed for the proposals (conditional GETs and the live feed
+          polling bridge) and the versions of their groups' pages, and pushes them to the live feeds
+        - inside gathering_changes only the cached spreads are dropped straight away, the rest is done once at its end
+        """
+        proposal_ids = set(proposal_ids) - {None}
+        if not proposal_ids:
+            return
+        spread_cache.invalidate(*proposal_ids)
+        gathered = _gathered_changes.get()
+        if gathered is not None:
+            gathered.update(proposal_ids)
+        else:
+            self._record_changed(proposal_ids)
+
+    def _record_changed(self, proposal_ids):
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        self.get_queryset().filter(id__in=proposal_ids).update(last_changed=timezone.now())
+        # the group pages' versions are kept in the cache so a vote never updates the group row all its
+        # proposals share
+        ProposalGroup.objects.mark_changed(self.get_queryset().filter(id__in=proposal_ids)
+                                               .values_list('proposal_group_id', flat=True))
+        proposals_changed(proposal_ids)
+
+    @contextmanager
+    def gathering_changes(self):
+        """
+        Marks the proposals changed inside the block once, when it ends (a vote marks its proposal several times)
+        - used around the transaction so the proposal rows are not held locked until it commits
+        - nested blocks are gathered by the outermost one, nothing is recorded if the block raises
+        """
+        if _gathered_changes.get() is not None:
+            yield
+            return
+        gathered = set()
+        token = _gathered_changes.set(gathered)
+        try:
+            yield
+        finally:
+            _gathered_changes.reset(token)
+        if gathered:
+            self._record_changed(gathered)
+
+    def transition(self, proposals, state):
+        """
+        Moves the proposals in the queryset to the state with one update per state they move from
+        - each move is checked against ProposalState.get_next_states as updateState does
+        - archived proposals are sealed and queued for render_static_archive as they are by save
+        - publishing this way does not apply the group's default choices (see ProposalGroup.propagate_default_choices)
+        - returns (ids moved, ids rejected)
+        """
+        state = ProposalState(state)
+        with transaction.atomic():
+            proposals = list(proposals.order_by('id').select_for_update()
+                                      .values_list('id', 'state', 'proposal_group_id'))
+            moves = defaultdict(list)
+            rejected = []
+            for proposal_id, current_state, _ in proposals:
+                if state in ProposalState(current_state).get_next_states():
+                    moves[current_state].append(proposal_id)
+                else:
+                    rejected.append(proposal_id)
+            moved = [proposal_id for proposal_ids in moves.values() for proposal_id in proposal_ids]
+            if not moved:
+                return moved, rejected
+            for current_state, proposal_ids in moves.items():
+                self.get_queryset().filter(id__in=proposal_ids, state=current_state).update(state=state)
+            group_ids = {group_id for _, current_state, group_id in proposals if current_state in moves} - {None}
+            if group_ids:
+                GroupMembership.objects.recount_pending_votes(GroupMembership.objects.filter(group_id__in=group_ids))
+                # the members' sidebar counts have changed
+                sidebar_cache.invalidate(*GroupMembership.objects.filter(group_id__in=group_ids)
+                                                                 .values_list('user_id', flat=True))
+            if state == ProposalState.ARCHIVED:
+                # archived proposals never change state again so their final result is sealed now
+                SealedTally.objects.seal_many(moved)
+                proposals_archived(moved)
+            self.mark_changed(moved)
+        return moved, rejected
+
+    def recompute_consensus(self, proposal_ids):
+        """
+        Recomputes the consensus of the proposals and records it in their history with a bounded number of statements
+        - one aggregated query for all the tallies, set based updates of the consensus flags and bulk created history
+        - archived proposals keep their sealed result
+        - returns the ids of the proposals whose consensus changed
+        """
+        proposal_ids = set(self.get_queryset().filter(id__in=set(proposal_ids) - {None})
+                                              .exclude(state=ProposalState.ARCHIVED)
+                                              .values_list('id', flat=True))
+        if not proposal_ids:
+            return set()
+        # on-hold proposals report results from published state
+        reporting_state = Case(When(proposal__state=ProposalState.ON_HOLD, then=Value(ProposalState.PUBLISHED.value)),
+                               default=F('proposal__state'))
+        votes = (ChoiceVoteCount.objects.filter(proposal_choice=OuterRef('id'), state=OuterRef('reporting_state'))
+                                        .values('count'))
+        tallies = (ProposalChoice.objects.filter(proposal_id__in=proposal_ids, deactivated_date__isnull=True)
+                                         .annotate(reporting_state=reporting_state)
+                                         .annotate(choice_votes=Coalesce(Subquery(votes), 0))
+                                         .order_by('proposal_id', 'id'))
+        choices_by_proposal = {proposal_id: [] for proposal_id in proposal_ids}
+        for choice in tallies:
+            choices_by_proposal[choice.proposal_id].append(choice)
+        consensus = {proposal_id: _choose_consensus(choices) for proposal_id, choices in choices_by_proposal.items()}
+        consensus_ids = {choice.id for choice in consensus.values() if choice is not None}
+        changed = {proposal_id for proposal_id, choices in choices_by_proposal.items()
+                   if any(bool(choice.current_consensus) != (choice.id in consensus_ids) for choice in choices)}
+        snapshot_date = timezone.now()
+        history = []
+        for proposal_id, choices in choices_by_proposal.items():
+            snapshot = ConsensusHistory(snapshot_date=snapshot_date, proposal_id=proposal_id,
+                                        consensus=consensus[proposal_id])
+            snapshot.encode([{"choice_id": choice.id, "text": choice.text, "count": choice.choice_votes}
+                             for choice in choices])
+            history.append(snapshot)
+        with transaction.atomic():
+            active_choices = ProposalChoice.objects.filter(proposal_id__in=changed, deactivated_date__isnull=True)
+            active_choices.filter(id__in=consensus_ids).update(current_consensus=True)
+            active_choices.filter(current_consensus=True).exclude(id__in=consensus_ids).update(current_consensus=False)
+            ConsensusHistory.objects.record_snapshots(history)
+            # settles any write-behind recompute of the proposals too
+            PendingConsensusUpdate.objects.filter(proposal_id__in=proposal_ids).delete()
+            self.mark_changed(changed)
+        return changed
+
+    def with_list_data(self, proposals, user):
+        """
+        Annotates the proposals with what a proposal list shows so it renders in one query
+        - total_votes, consensus_text (None if no consensus) and my_vote (None if the user has not voted)
+        - archived proposals report their sealed final result
+        """
+        sealed = SealedTally.objects.filter(proposal=OuterRef('id'))
+        # on-hold and archived proposals report results from published state
+        reporting_state = Case(When(state__in=[ProposalState.ON_HOLD, ProposalState.ARCHIVED],
+                                    then=Value(ProposalState.PUBLISHED.value)),
+                               default=F('state'))
+        total_votes = (ChoiceVoteCount.objects.filter(proposal_choice__proposal=OuterRef('id'),
+                                                      proposal_choice__deactivated_date__isnull=True,
+                                                      state=OuterRef('reporting_state'))
+                       .order_by()
+                       .values('proposal_choice__proposal')
+                       .annotate(total=Sum('count'))
+                       .values('total'))
+        consensus_text = (ProposalChoice.objects.filter(proposal=OuterRef('id'),
+                                                        deactivated_date__isnull=True,
+                                                        current_consensus=True)
+                          .values('text')[:1])
+        my_vote = (ChoiceTicket.objects.filter(proposal=OuterRef('id'),
+                                               user_id=user.id,
+                                               current=True,
+                                               state=OuterRef('state'),
+                                               proposal_choice__deactivated_date__isnull=True)
+                   .values('proposal_choice__text')[:1])
+        return (proposals.annotate(reporting_state=reporting_state, is_sealed=Exists(sealed))
+                         .annotate(total_votes=Case(When(is_sealed=True,
+                                                         then=Subquery(sealed.values('total_votes'))),
+                                                    default=Coalesce(Subquery(total_votes), 0)),
+                                   consensus_text=Case(When(is_sealed=True,
+                                                            then=Subquery(sealed.values('consensus_text'))),
+                                                       default=Subquery(consensus_text)),
+                                   my_vote=Subquery(my_vote)))
+
 
 class Proposal(models.Model):
     proposal_name = models.CharField(max_length=200)
@@ -30,9 +257,71 @@ class Proposal(models.Model):
     proposal_group = models.ForeignKey('ProposalGroup',
                                        on_delete=models.SET_NULL, null=True)
     state = models.IntegerField(choices=ProposalState.choices(), default=ProposalState.DRAFT)
+    # when anything the proposal page shows last changed (conditional GETs)
+    last_changed = models.DateTimeField('last changed', default=timezone.now)
     # managers
     objects = ProposalManager()
 
+    # the (state, group id) the group members' pending vote counters were last counted with
+    _pending_key = None
+
+    class Meta:
+        indexes = [
+            # an owner's proposals by state, newest first (my proposals pages)
+            models.Index(fields=['owned_by', 'state', '-id'], name='proposal_owner_state_idx'),
+            # the recently changed proposals (the live feed polling bridge)
+            models.Index(fields=['last_changed'], name='proposal_last_changed_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._pending_key = (instance.__dict__.get('state'), instance.__dict__.get('proposal_group_id'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        self.last_changed = timezone.now()
+        # keep the group members' pending vote counters in step with the state and group
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            pending_key = (self.state, self.proposal_group_id)
+            if self._pending_key is not None and self.state != self._pending_key[0]:
+                if self.state == ProposalState.ARCHIVED:
+                    # archived proposals never change state again so their final result is sealed now
+                    self.sealed_tally = SealedTally.objects.seal(self)
+                    proposals_archived([self.id])
+                elif self._pending_key[0] == ProposalState.ARCHIVED:
+                    proposal_unarchived(self.id)
+                spread_cache.invalidate(self.id)
+                proposals_changed([self.id])
+            previous_group_id = self._pending_key[1] if self._pending_key else None
+            group_ids = {self.proposal_group_id, previous_group_id} - {None}
+            # the group pages list the proposal
+            ProposalGroup.objects.mark_changed(group_ids)
+            if pending_key != self._pending_key:
+                if group_ids:
+                    GroupMembership.objects.recount_pending_votes(
+                        GroupMembership.objects.filter(group_id__in=group_ids))
+                    # the members' sidebar counts have changed
+                    sidebar_cache.invalidate(*GroupMembership.objects.filter(group_id__in=group_ids)
+                                                                     .values_list('user_id', flat=True))
+                self._pending_key = pending_key
+
+    def delete(self, *args, **kwargs):
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        with transaction.atomic():
+            proposal_id = self.id
+            deleted = super().delete(*args, **kwargs)
+            if self.proposal_group_id is not None:
+                ProposalGroup.objects.mark_changed([self.proposal_group_id])
+                GroupMembership.objects.recount_pending_votes(
+                    GroupMembership.objects.filter(group_id=self.proposal_group_id))
+            proposal_unarchived(proposal_id)
+        return deleted
+
     # class functions
     def get_absolute_url(self):
         return reverse('view_proposal', kwargs={'proposal_id': str(self.pk)})
@@ -49,23 +338,29 @@ class Proposal(models.Model):
         # 1. proposal is in state Trial or Published
         # 2. User is a member of the group or the proposal does not have a group
         # 3. User can trial if the Proposal state is Trial or the proposal does not have a group
-        if self.proposal_group is None:
-            membership_okay = True
-            trial_okay = True
-        else:
-            membership = GroupMembership.objects.filter(group=self.proposal_group, user=user)
-            membership_okay = membership.count() == 1
-            if membership_okay:
-                trial_okay = membership.first().can_trial
-            else:
-                trial_okay = False
+        if self.proposal_group_id is None:
+            return self.voting_allowed(membership_okay=True, trial_okay=True)
+        resolver = resolver_for(user)
+        if resolver is not None:
+            return self.voting_allowed(resolver.is_member(self.proposal_group_id),
+                                       resolver.can_trial(self.proposal_group_id))
+        memberships = list(GroupMembership.objects.filter(group_id=self.proposal_group_id, user=user)
+                                                  .values_list('can_trial', flat=True)[:1])
+        return self.voting_allowed(membership_okay=len(memberships) == 1,
+                                   trial_okay=bool(memberships and memberships[0]))
+
+    def voting_allowed(self, membership_okay, trial_okay):
+        """ Applies the voting rules given whether the user is a member and whether they can trial """
         return ((self.state == ProposalState.PUBLISHED and membership_okay)
                 or (self.state == ProposalState.TRIAL and membership_okay and trial_okay))
 
     def get_total_votes(self):
+        sealed_result = self.sealed_result
+        if sealed_result is not None:
+            return sealed_result.total_votes
         total_votes = (ChoiceTicket.objects
                        .filter(proposal_choice__deactivated_date__isnull=True,
-                               proposal_choice__proposal=self,
+                               proposal=self,
                                state=ProposalState.reporting_as_state(self.state),
                                current=True)
                        .count())
@@ -75,29 +370,30 @@ class Proposal(models.Model):
         """ Gets the ProposalChoices that are active currently """
         return ProposalChoice.objects.filter(proposal=self, deactivated_date__isnull=True)
 
+    def get_choice_tallies(self):
+        """ Gets the active choices annotated with their current vote count as choice_votes """
+        reporting_state = ProposalState.reporting_as_state(self.state)
+        return (self.get_active_choices()
+                    .annotate(choice_votes=Coalesce(Sum('choicevotecount__count',
+                                                        filter=Q(choicevotecount__state=reporting_state)), 0))
+                    .order_by('id'))
+
     def determine_consensus(self):
         """ Sets the current consensus across the Proposal Choices on this proposal """
-        active_choices = self.get_active_choices()
-        # utilise simple - most votes = consensus
-        max_votes = 0
-        current_consensus = None
-        for choice in active_choices:
-            choice_votes = choice.current_vote_count
-            if choice_votes > max_votes:
-                current_consensus = choice
-                max_votes = choice_votes
-            elif choice_votes == max_votes:  # tie break (no consensus)
-                current_consensus = None
-        # update all the choices to the new values
+        # one aggregated query for all the tallies
+        active_choices = list(self.get_choice_tallies())
+        current_consensus = _choose_consensus(active_choices)
+        # update all the choices to the new values with at most two set based updates
         if (current_consensus is None or not current_consensus.current_consensus):
             with transaction.atomic():
-                for choice in active_choices:
-                    old_value = choice.current_consensus
-                    new_value = (choice == current_consensus)  # i.e. only true if is current choice
-                    if old_value != new_value:
-                        # only update if the state changes
-                        choice.current_consensus = new_value
-                        choice.save()
+                previous_consensus = self.get_active_choices().filter(current_consensus=True)
+                if current_consensus is not None:
+                    previous_consensus = previous_consensus.exclude(id=current_consensus.id)
+                    self.get_active_choices().filter(id=current_consensus.id).update(current_consensus=True)
+                previous_consensus.update(current_consensus=False)
+                Proposal.objects.mark_changed([self.id])
+            for choice in active_choices:
+                choice.current_consensus = (choice == current_consensus)  # i.e. only true if is current choice
         return current_consensus
 
     def populate_from_template(self, template):
@@ -105,34 +401,27 @@ class Proposal(models.Model):
         # return if no template selected
         if template is None:
             return
-        # deactivate existing choices if there are any
-        if self.proposalchoice_set.count() > 0:
-            for existing_choice in self.get_active_choices():
-                existing_choice.deactivated_date = timezone.now()
-                existing_choice.save()
-        # create new choices based on the template
-        for template_choice in template:
-            new_choice = ProposalChoice(proposal=self,
-                                        text=template_choice['text'],
-                                        priority=template_choice['priority'],
-                                        activated_date=timezone.now())
-            new_choice.save()
+        # deactivate existing choices and create new choices based on the template
+        ProposalChoice.objects.replace_choices([self], [(template_choice['text'], template_choice['priority'])
+                                                        for template_choice in template])
 
     def get_voting_spread(self, analysis_date=None):
         """ Gets the spread of votes in a dictionary based on the date and time """
+        if analysis_date is None:
+            # cached until the proposal's votes, choices or state change
+            reporting_state = ProposalState.reporting_as_state(self.state)
+            return spread_cache.get_or_set(self.id, 'spread:{}'.format(int(reporting_state)),
+                                           lambda: self.compute_voting_spread())
+        return self.compute_voting_spread(analysis_date)
+
+    def compute_voting_spread(self, analysis_date=None):
         spread = {}
         if(analysis_date is None):
-            num_total_votes_cast = self.total_votes
-            for choice in self.get_active_choices():
-                vote_analysis = {}
-                vote_count = choice.current_vote_count
-                vote_analysis['text'] = choice.text
-                vote_analysis['count'] = vote_count
-                if num_total_votes_cast > 0 and vote_count > 0:
-                    vote_analysis['percentage'] = (vote_count / num_total_votes_cast) * 100.0
-                else:
-                    vote_analysis['percentage'] = 0
-                spread[choice.id] = vote_analysis
+            # archived proposals report their sealed final result
+            sealed_result = self.sealed_result
+            if sealed_result is not None:
+                return sealed_result.get_spread()
+            return self.live_voting_spread()
         else:
             historical_data = self.get_consensus_at_datetime(analysis_date).get_consensus_data()
             num_total_votes_cast = sum(item['count'] for item in historical_data)
@@ -148,6 +437,64 @@ class Proposal(models.Model):
                 spread[data_element['choice_id']] = vote_analysis
         return spread
 
+    def live_total_votes(self):
+        """ The number of users with a current vote, counted from the votes """
+        reporting_state = ProposalState.reporting_as_state(self.state)
+        return (Proposal.objects.filter(id=self.id,
+                proposalchoice__choiceticket__current=True, proposalchoice__choiceticket__state=reporting_state)
+                .values('proposalchoice__choiceticket__user_id')
+                .distinct().count())
+
+    def live_consensus(self):
+        """ The current consensus choice from the choices' consensus flags """
+        try:
+            current_consensus = ProposalChoice.objects.get(deactivated_date__isnull=True,
+                                                           proposal=self,
+                                                           current_consensus=True)
+        except ProposalChoice.DoesNotExist:
+            current_consensus = None
+        return current_consensus
+
+    def live_voting_spread(self):
+        """ The current spread of votes, counted from the vote counters """
+        spread = {}
+        num_total_votes_cast = self.live_total_votes()
+        for choice in self.get_active_choices():
+            vote_analysis = {}
+            vote_count = choice.current_vote_count
+            vote_analysis['text'] = choice.text
+            vote_analysis['count'] = vote_count
+            if num_total_votes_cast > 0 and vote_count > 0:
+                vote_analysis['percentage'] = (vote_count / num_total_votes_cast) * 100.0
+            else:
+                vote_analysis['percentage'] = 0
+            spread[choice.id] = vote_analysis
+        return spread
+
+    def get_result(self):
+        """ The proposal's current (or sealed final) result as a JSON serialisable document """
+        sealed_result = self.sealed_result
+        if sealed_result is not None:
+            consensus_text = sealed_result.consensus_text
+        else:
+            consensus = self.live_consensus()
+            consensus_text = consensus.text if consensus is not None else None
+        return {'id': self.id,
+                'proposal_name': self.proposal_name,
+                'proposal_description': self.proposal_description,
+                'proposal_group': self.proposal_group.group_name if self.proposal_group is not None else None,
+                'state': int(self.state),
+                'spread': self.get_voting_spread(),
+                'consensus': consensus_text,
+                'total_voters': self.total_votes,
+                'total_votes': self.get_total_votes(),
+                'sealed_date': sealed_result.sealed_date.isoformat() if sealed_result is not None else None}
+
+    def update_consensus(self):
+        """ Determines the consensus and records it in the consensus history """
+        self.determine_consensus()
+        ConsensusHistory.objects.record_snapshot(self)
+
     def get_consensus_at_datetime(self, request_datetime):
         return ConsensusHistory.objects.at_date(self, request_datetime)
 
@@ -172,38 +519,31 @@ class Proposal(models.Model):
                     # set the group so it knows it has a default
                     self.proposal_group.set_has_default_choices(True)
                     # move all ON_HOLD proposals to archived
-                    on_hold_proposals = Proposal.objects.filter(proposal_group=self.proposal_group,
-                                                                state=ProposalState.ON_HOLD)
-                    for on_hold_proposal in on_hold_proposals:
-                        on_hold_proposal.archive()
+                    Proposal.objects.transition(Proposal.objects.filter(proposal_group=self.proposal_group,
+                                                                        state=ProposalState.ON_HOLD),
+                                                ProposalState.ARCHIVED)
 
                 else:
                     raise DataError('Default choices cannot be set as Proposal Group has published proposals.')
             else:
                 if self.proposal_group.has_default_group_proposal_choices:
-                    # deactivate all the existing choices on the proposal
-                    (ProposalChoice.objects.filter(proposal=self, deactivated_date__isnull=True)
-                                           .update(deactivated_date=timezone.now()))
-                    # copy from first published proposal
-                    copy_from_proposal = (Proposal.objects
-                                          .filter(proposal_group=self.proposal_group, state=ProposalState.PUBLISHED)
-                                          .first())
-                    if not copy_from_proposal:
-                        raise DataError("No default data found")
-                    cloned_choices = ProposalChoice.objects.filter(proposal=copy_from_proposal,
-                                                                   deactivated_date__isnull=True)
-                    for choice in cloned_choices:
-                        # use Django method for cloning objects
-                        choice.pk = None
-                        choice.proposal = self
-                        choice.current_consensus = False
-                        choice.activated_date = timezone.now()
-                        choice.save()
+                    # replace the existing choices on the proposal with the group's default choices
+                    ProposalChoice.objects.replace_choices([self], self.proposal_group.get_default_choices())
         self.updateState(ProposalState.PUBLISHED)
 
     def hold(self):
         self.updateState(ProposalState.ON_HOLD)
 
+    def publish_at(self, due_date, default_group_to_these_choices=False):
+        return ScheduledTransition.objects.schedule(self, ProposalState.PUBLISHED, due_date,
+                                                    default_choices=default_group_to_these_choices)
+
+    def hold_at(self, due_date):
+        return ScheduledTransition.objects.schedule(self, ProposalState.ON_HOLD, due_date)
+
+    def archive_at(self, due_date):
+        return ScheduledTransition.objects.schedule(self, ProposalState.ARCHIVED, due_date)
+
     def archive(self):
         self.updateState(ProposalState.ARCHIVED)
 
@@ -216,21 +556,27 @@ class Proposal(models.Model):
 
     @property
     def total_votes(self):
-        reporting_state = ProposalState.reporting_as_state(self.state)
-        return (Proposal.objects.filter(id=self.id,
-                proposalchoice__choiceticket__current=True, proposalchoice__choiceticket__state=reporting_state)
-                .values('proposalchoice__choiceticket__user_id')
-                .distinct().count())
+        sealed_result = self.sealed_result
+        if sealed_result is not None:
+            return sealed_result.total_voters
+        return self.live_total_votes()
 
     @property
     def current_consensus(self):
+        sealed_result = self.sealed_result
+        if sealed_result is not None:
+            return sealed_result.consensus
+        return self.live_consensus()
+
+    @property
+    def sealed_result(self):
+        """ The final result of an archived proposal (None if it is not archived or not sealed yet) """
+        if self.state != ProposalState.ARCHIVED:
+            return None
         try:
-            current_consensus = ProposalChoice.objects.get(deactivated_date__isnull=True,
-                                                           proposal=self,
-                                                           current_consensus=True)
-        except ProposalChoice.DoesNotExist:
-            current_consensus = None
-        return current_consensus
+            return self.sealed_tally
+        except SealedTally.DoesNotExist:
+            return None
 
     @property
     def current_state(self):
@@ -244,6 +590,29 @@ class Proposal(models.Model):
 class ProposalChoiceManager(models.Manager):
     """ Manager for Proposal Choice """
 
+    def replace_choices(self, proposals, choices):
+        """
+        Deactivates the active choices of the proposals and gives each of them the choices in (text, priority) pairs
+        - one update and one bulk_create however many proposals and choices
+        """
+        proposals = list(proposals)
+        proposal_ids = [proposal.id for proposal in proposals]
+        now = timezone.now()
+        with transaction.atomic():
+            (self.get_queryset().filter(proposal_id__in=proposal_ids, deactivated_date__isnull=True)
+                                .update(deactivated_date=now))
+            created = self.bulk_create([ProposalChoice(proposal=proposal, text=text, priority=priority,
+                                                       activated_date=now)
+                                        for proposal in proposals for text, priority in choices])
+            Proposal.objects.mark_changed(proposal_ids)
+            published_ids = [proposal.id for proposal in proposals if proposal.state == ProposalState.PUBLISHED]
+            if published_ids:
+                # votes for the deactivated choices no longer count as voted
+                GroupMembership.objects.recount_for_proposals(published_ids)
+                sidebar_cache.invalidate(*GroupMembership.objects.filter(group__proposal__id__in=published_ids)
+                                                                 .values_list('user_id', flat=True))
+        return created
+
     def activated(self):
         return (self.get_queryset()
                 .filter(activated_date__isnull=False,
@@ -259,6 +628,27 @@ class ProposalChoice(models.Model):
     objects = ProposalChoiceManager()
     current_consensus = models.BooleanField(default=False, null=False)
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Proposal.objects.mark_changed([self.proposal_id])
+            if self.deactivated_date is not None and self.proposal.state == ProposalState.PUBLISHED:
+                # votes for a deactivated choice no longer count as voted
+                GroupMembership.objects.recount_for_proposals([self.proposal_id])
+                sidebar_cache.invalidate(*GroupMembership.objects.filter(group__proposal__id=self.proposal_id)
+                                                                 .values_list('user_id', flat=True))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted = super().delete(*args, **kwargs)
+            Proposal.objects.mark_changed([self.proposal_id])
+            if self.proposal.state == ProposalState.PUBLISHED:
+                # the votes for the choice are deleted with it so no longer count as voted
+                GroupMembership.objects.recount_for_proposals([self.proposal_id])
+                sidebar_cache.invalidate(*GroupMembership.objects.filter(group__proposal__id=self.proposal_id)
+                                                                 .values_list('user_id', flat=True))
+        return deleted
+
     # class functions
     def get_absolute_url(self):
         return reverse('view_proposal', kwargs={'proposal_id': str(self.proposal.id)})
@@ -266,9 +656,9 @@ class ProposalChoice(models.Model):
     # properties
     @property
     def current_vote_count(self):
-        # counts all the choice tickets for this choice where it is the current choice ticket
+        # reads the maintained counter of current choice tickets for this choice
         reporting_state = ProposalState.reporting_as_state(self.proposal.state)
-        return ChoiceTicket.objects.filter(proposal_choice=self, current=True, state=reporting_state).count()
+        return ChoiceVoteCount.objects.count_for(self, reporting_state)
 
     def vote(self, user):
         # reset the current flag on the last vote for this proposal and add another one.
@@ -277,18 +667,131 @@ class ProposalChoice(models.Model):
         # model class (apart from joining to proposal choice) - TODO: Refactor
         # -------------------------------------------------------------------------------
         if self.proposal.can_vote(user):
-            with transaction.atomic():
-                # important: do not consider state in clearing the previous current
-                ChoiceTicket.objects.filter(user=user,
-                                            proposal_choice__proposal=self.proposal,
-                                            current=True).update(current=False)
-                ticket = ChoiceTicket(user=user,
-                                      date_chosen=timezone.now(), proposal_choice=self, state=self.proposal.state)
-                ticket.save()
-                # determine consensus opinion after voting
-                self.proposal.determine_consensus()
-                # save consensus history
-                snapshot = ConsensusHistory.build_snapshot(self.proposal)
-                snapshot.save()
+            with Proposal.objects.gathering_changes(), transaction.atomic():
+                ChoiceTicket.objects.cast(user, self)
+                if getattr(settings, 'CONSENSUS_WRITE_BEHIND', False):
+                    # leave the consensus and history to the process_consensus_updates worker
+                    PendingConsensusUpdate.objects.mark(self.proposal)
+                else:
+                    # determine consensus opinion after voting and save consensus history
+                    self.proposal.update_consensus()
+            sidebar_cache.invalidate(user.id)
         else:
             raise PermissionDenied("Cannot vote in a proposal in this state.")
+
+
+class ScheduledTransitionManager(models.Manager):
+    """ Manager for the state changes scheduled for a due date """
+
+    def schedule(self, proposal, state, due_date, default_choices=False):
+        """
+        Schedules the proposal's move to the state at the due date (replacing any schedule for that state)
+        - default_choices publishes with default_group_to_these_choices as publish() does
+        """
+        state = ProposalState(state)
+        if state not in ScheduledTransition.SCHEDULABLE_STATES:
+            raise ProposalStateInvalid()
+        transition, _ = self.update_or_create(proposal=proposal, state=state, defaults={
+            'due_date': due_date, 'default_choices': default_choices and state == ProposalState.PUBLISHED})
+        return transition
+
+    def process(self, batch_size=500, now=None):
+        """
+        Applies all the transitions due by now, batch_size at a time in due date order
+        - rows are claimed with select_for_update(skip_locked=True) so several workers can share the due rows
+        - rows due at the same time are claimed publish, then hold, then archive - the order the states are reached in
+        - a proposal's moves are applied in that order, so the result does not depend on batch_size
+        - a batch's moves are checked with the updateState rules and applied with one bulk transition per state
+        - a move that is no longer valid is dropped (e.g. the proposal was archived by hand)
+        - a publish that makes its choices the group's default is applied on its own through publish()
+        - returns (ids moved, ids rejected)
+        """
+        now = now or timezone.now()
+        moved = []
+        rejected = []
+        while True:
+            with transaction.atomic():
+                due = list(self.get_queryset()
+                               .select_for_update(skip_locked=True)
+                               .filter(due_date__lte=now)
+                               .order_by('due_date', 'state', 'id')
+                               .values_list('id', 'proposal_id', 'state', 'default_choices')[:batch_size])
+                if not due:
+                    break
+                # the first move of each proposal in the batch, then the second...
+                rounds = defaultdict(lambda: defaultdict(list))
+                claimed = Counter()
+                for _, proposal_id, state, default_choices in due:
+                    rounds[claimed[proposal_id]][state].append((proposal_id, default_choices))
+                    claimed[proposal_id] += 1
+                for round_number in sorted(rounds):
+                    for state, moves in sorted(rounds[round_number].items()):
+                        state_moved, state_rejected = self._apply(state, moves)
+                        moved.extend(state_moved)
+                        rejected.extend(state_rejected)
+                self.get_queryset().filter(id__in=[transition_id for transition_id, _, _, _ in due]).delete()
+        return moved, rejected
+
+    def _apply(self, state, moves):
+        """ Moves the (proposal id, default choices) to the state, returns (ids moved, ids rejected) """
+        # imported here as the proposal group models import this module
+        from consensus_engine.models import ProposalGroup
+        moved = []
+        rejected = []
+        proposal_ids = set()
+        for proposal_id, default_choices in moves:
+            if default_choices:
+                # publish() archives the group's held proposals, so this one is published on its own
+                try:
+                    with transaction.atomic():
+                        Proposal.objects.get(id=proposal_id).publish(default_group_to_these_choices=True)
+                    moved.append(proposal_id)
+                except (DataError, ProposalStateInvalid):
+                    rejected.append(proposal_id)
+            else:
+                proposal_ids.add(proposal_id)
+        default_choices = {}
+        if state == ProposalState.PUBLISHED:
+            # publishing gives the proposals the group's default choices as publish() does
+            # - read before the move, as the group's first published proposal holds them
+            for group in ProposalGroup.objects.filter(proposal__id__in=proposal_ids,
+                                                      group_default_choices=True).distinct():
+                try:
+                    default_choices[group.id] = group.get_default_choices()
+                except DataError:
+                    # no default data found - left for the owner to publish
+                    group_proposal_ids = set(Proposal.objects.filter(id__in=proposal_ids, proposal_group=group)
+                                                             .values_list('id', flat=True))
+                    proposal_ids -= group_proposal_ids
+                    rejected.extend(group_proposal_ids)
+        if not proposal_ids:
+            return moved, rejected
+        state_moved, state_rejected = Proposal.objects.transition(Proposal.objects.filter(id__in=proposal_ids), state)
+        moved.extend(state_moved)
+        rejected.extend(state_rejected)
+        if default_choices:
+            # only the proposals the move was valid for
+            proposals_by_group = defaultdict(list)
+            for proposal in Proposal.objects.filter(id__in=state_moved, proposal_group_id__in=default_choices):
+                proposals_by_group[proposal.proposal_group_id].append(proposal)
+            for group_id, proposals in proposals_by_group.items():
+                ProposalChoice.objects.replace_choices(proposals, default_choices[group_id])
+        return moved, rejected
+
+
+class ScheduledTransition(models.Model):
+    """ A state change to make to a proposal at a due date (publish at, hold at and archive at) """
+    SCHEDULABLE_STATES = (ProposalState.PUBLISHED, ProposalState.ON_HOLD, ProposalState.ARCHIVED)
+
+    proposal = models.ForeignKey(Proposal, on_delete=models.CASCADE, related_name='scheduled_transitions')
+    state = models.IntegerField(choices=ProposalState.choices())
+    due_date = models.DateTimeField('due date', db_index=True)
+    # publish making the proposal's choices the group's default choices
+    default_choices = models.BooleanField(default=False)
+    # manager
+    objects = ScheduledTransitionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['proposal', 'state'], name='unique_scheduled_transition'),
+        ]
@@ -1,6 +1,12 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
+from django.utils import timezone
 from consensus_engine.utils import ProposalState
+from consensus_engine.caching import sidebar_cache, spread_cache
+
+# the number of times a vote is tried when a concurrent vote takes the current ticket first
+CAST_ATTEMPTS = 3
 
 
 class ChoiceTicketManager(models.Manager):
@@ -12,9 +18,8 @@ class ChoiceTicketManager(models.Manager):
                                             proposal_choice__deactivated_date__isnull=True,
                                             )
                 .annotate(choice_text=models.F('proposal_choice__text'))
-                .annotate(proposal_id=models.F('proposal_choice__proposal__id'))
-                .annotate(proposal_name=models.F('proposal_choice__proposal__proposal_name'))
-                .annotate(proposal_group=models.F('proposal_choice__proposal__proposal_group__group_name'))
+                .annotate(proposal_name=models.F('proposal__proposal_name'))
+                .annotate(proposal_group=models.F('proposal__proposal_group__group_name'))
                 .values('proposal_id', 'proposal_name',
                         'choice_text', 'proposal_group')
                 .order_by('proposal_group', 'proposal_name'))
@@ -25,12 +30,122 @@ class ChoiceTicketManager(models.Manager):
         try:
             current_choice = (ChoiceTicket.objects
                               .get(user=user,
-                                   proposal_choice__proposal=proposal,
+                                   proposal=proposal,
                                    current=True, state=reporting_state))
         except (KeyError, ChoiceTicket.DoesNotExist):
             current_choice = None
         return current_choice
 
+    def retire(self, tickets):
+        """ Sets the current tickets in the queryset to not current and takes them off the vote counters """
+        # imported here as the proposal models import this module
+        from consensus_engine.models import GroupMembership, Proposal
+        with transaction.atomic():
+            retired = list(tickets.filter(current=True)
+                                  .select_for_update()
+                                  .values_list('id', 'proposal_choice_id', 'state', 'proposal_id', 'user_id'))
+            ChoiceTicket.objects.filter(id__in=[ticket[0] for ticket in retired]).update(current=False)
+            retired_counts = Counter((choice_id, state) for _, choice_id, state, _, _ in retired)
+            ChoiceVoteCount.objects.adjust_many({key: -count for key, count in retired_counts.items()})
+            if retired:
+                GroupMembership.objects.recount_for_proposals({ticket[3] for ticket in retired},
+                                                              {ticket[4] for ticket in retired})
+                Proposal.objects.mark_changed({ticket[3] for ticket in retired})
+                # the users' pending votes and my votes pages have changed
+                sidebar_cache.invalidate(*{ticket[4] for ticket in retired})
+        return len(retired)
+
+    def cast(self, user, proposal_choice):
+        """
+        Makes a new ticket for the choice the user's current ticket for the proposal
+        - the unique_current_ticket constraint rejects a concurrent vote that got in first
+          and the swap is retried, so the last vote wins rather than both staying current
+        """
+        proposal = proposal_choice.proposal
+        for attempt in range(CAST_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    # important: do not consider state in clearing the previous current
+                    self.retire(ChoiceTicket.objects.filter(user=user, proposal=proposal, current=True))
+                    ticket = ChoiceTicket(user=user, date_chosen=timezone.now(), proposal=proposal,
+                                          proposal_choice=proposal_choice, state=proposal.state)
+                    ticket.save()
+                return ticket
+            except IntegrityError:
+                if attempt == CAST_ATTEMPTS - 1:
+                    raise
+
+    def bulk_vote(self, records, update_consensus=True):
+        """
+        Casts the votes in (username, proposal id, choice id) records in bulk
+        - the last record for a user and proposal wins
+        - returns the number of votes cast, the affected proposals by id and a list of (record, reason) rejections
+        """
+        # imported here as the proposal models import this module
+        from consensus_engine.models import GroupMembership, Proposal, ProposalChoice
+        ballots = []
+        rejected = []
+        for record in records:
+            try:
+                ballots.append((record, str(record[0]), int(record[1]), int(record[2])))
+            except (IndexError, TypeError, ValueError):
+                rejected.append((record, "Invalid record."))
+        users = dict(User.objects.filter(username__in={ballot[1] for ballot in ballots})
+                                 .values_list('username', 'id'))
+        choices = (ProposalChoice.objects.filter(id__in={ballot[3] for ballot in ballots},
+                                                 deactivated_date__isnull=True)
+                                         .select_related('proposal'))
+        choices = {choice.id: choice for choice in choices}
+        # set based membership lookup for all the groups and users in the records
+        memberships = dict(((group_id, user_id), can_trial) for group_id, user_id, can_trial in
+                           GroupMembership.objects.filter(group_id__in={choice.proposal.proposal_group_id
+                                                                        for choice in choices.values()},
+                                                          user_id__in=users.values())
+                                                  .values_list('group_id', 'user_id', 'can_trial'))
+        current_choices = {}
+        for record, username, proposal_id, choice_id in ballots:
+            user_id = users.get(username)
+            choice = choices.get(choice_id)
+            if user_id is None:
+                rejected.append((record, "Unknown user."))
+            elif choice is None or choice.proposal_id != proposal_id:
+                rejected.append((record, "Unknown choice for this proposal."))
+            else:
+                proposal = choice.proposal
+                if proposal.proposal_group_id is None:
+                    allowed = proposal.voting_allowed(membership_okay=True, trial_okay=True)
+                else:
+                    membership_key = (proposal.proposal_group_id, user_id)
+                    allowed = proposal.voting_allowed(membership_key in memberships,
+                                                      bool(memberships.get(membership_key)))
+                if allowed:
+                    current_choices[(user_id, proposal_id)] = choice
+                else:
+                    rejected.append((record, "Cannot vote in a proposal in this state."))
+        choices_by_proposal = defaultdict(dict)
+        for (user_id, proposal_id), choice in current_choices.items():
+            choices_by_proposal[proposal_id][user_id] = choice
+        proposals = {}
+        date_chosen = timezone.now()
+        for proposal_id, user_choices in choices_by_proposal.items():
+            proposal = next(iter(user_choices.values())).proposal
+            with Proposal.objects.gathering_changes(), transaction.atomic():
+                # important: do not consider state in clearing the previous current
+                self.retire(ChoiceTicket.objects.filter(user_id__in=user_choices.keys(),
+                                                        proposal_id=proposal_id,
+                                                        current=True))
+                tickets = self.bulk_create([ChoiceTicket(user_id=user_id, date_chosen=date_chosen, proposal=proposal,
+                                                         proposal_choice=choice, state=proposal.state)
+                                            for user_id, choice in user_choices.items()])
+                ChoiceVoteCount.objects.adjust_many(Counter(ticket.counter_key for ticket in tickets))
+                GroupMembership.objects.recount_for_proposals([proposal_id], user_choices.keys())
+                Proposal.objects.mark_changed([proposal_id])
+                if update_consensus:
+                    proposal.update_consensus()
+            proposals[proposal_id] = proposal
+        sidebar_cache.invalidate(*{user_id for user_id, _ in current_choices})
+        return len(current_choices), proposals, rejected
+
 
 class ChoiceTicket(models.Model):
     """ Defines a specific choice at a specific time """
@@ -39,6 +154,144 @@ class ChoiceTicket(models.Model):
     date_chosen = models.DateTimeField('date chosen')
     proposal_choice = models.ForeignKey('ProposalChoice',
                                         on_delete=models.CASCADE)
+    # denormalised from proposal_choice so the voting lookups do not need to join
+    proposal = models.ForeignKey('Proposal', on_delete=models.CASCADE, null=True)
     current = models.BooleanField(default=True, null=True)
     state = models.IntegerField(choices=ProposalState.choices(), default=ProposalState.PUBLISHED)
     objects = ChoiceTicketManager()
+    # the vote counter this ticket was last counted against (None if not counted)
+    _counted_as = None
+
+    class Meta:
+        indexes = [
+            # votes for a choice (vote counts and tallies)
+            models.Index(fields=['proposal_choice', 'state'], condition=models.Q(current=True),
+                         name='ticket_current_choice_idx'),
+        ]
+        constraints = [
+            # one current ticket per user, proposal and state - also the index for a user's votes
+            # (current choice, my votes, clearing the previous vote, groups for member)
+            models.UniqueConstraint(fields=['user', 'proposal', 'state'], condition=models.Q(current=True),
+                                    name='unique_current_ticket'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted_as = instance.counter_key
+        return instance
+
+    def save(self, *args, **kwargs):
+        # imported here as the proposal models import this module
+        from consensus_engine.models import GroupMembership, Proposal
+        if self.proposal_id is None:
+            self.proposal_id = self.proposal_choice.proposal_id
+        # keep the vote counters in step with the ticket
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            counter_key = self.counter_key
+            if counter_key != self._counted_as:
+                if self._counted_as is not None:
+                    ChoiceVoteCount.objects.adjust(*self._counted_as, -1)
+                if counter_key is not None:
+                    ChoiceVoteCount.objects.adjust(*counter_key, 1)
+                self._counted_as = counter_key
+                Proposal.objects.mark_changed([self.proposal_id])
+                if self.user_id is not None:
+                    GroupMembership.objects.recount_for_proposals([self.proposal_id], [self.user_id])
+
+    # properties
+    @property
+    def counter_key(self):
+        """ The (proposal choice id, state) counter that this ticket counts towards """
+        if self.__dict__.get('current'):
+            return (self.proposal_choice_id, self.state)
+        return None
+
+
+def ticket_deleted(sender, instance, **kwargs):
+    """
+    Takes a deleted ticket off its vote counter (post_delete, so queryset, admin and cascade deletes are covered)
+    - a counter already deleted with its choice is left alone rather than created again
+    """
+    # imported here as the proposal models import this module
+    from consensus_engine.models import GroupMembership, Proposal
+    if instance._counted_as is None:
+        return
+    proposal_choice_id, state = instance._counted_as
+    (ChoiceVoteCount.objects.filter(proposal_choice_id=proposal_choice_id, state=state)
+                            .update(count=models.F('count') - 1))
+    instance._counted_as = None
+    Proposal.objects.mark_changed([instance.proposal_id])
+    if instance.user_id is not None:
+        GroupMembership.objects.recount_for_proposals([instance.proposal_id], [instance.user_id])
+        sidebar_cache.invalidate(instance.user_id)
+
+
+class ChoiceVoteCountManager(models.Manager):
+    """ Manager for the maintained vote counters """
+
+    def count_for(self, proposal_choice, state):
+        count = (self.get_queryset()
+                 .filter(proposal_choice_id=proposal_choice.id, state=state)
+                 .values_list('count', flat=True)
+                 .first())
+        return count or 0
+
+    def adjust(self, proposal_choice_id, state, delta):
+        """ Adds delta to the counter for the choice and state, creating the counter if required """
+        counter, _ = self.get_or_create(proposal_choice_id=proposal_choice_id, state=state)
+        self.get_queryset().filter(pk=counter.pk).update(count=models.F('count') + delta)
+
+    def adjust_many(self, deltas):
+        """
+        Adds the deltas to the counters keyed by (choice id, state), creating the counters if required
+        - one update per distinct state and delta rather than one per counter
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        counters = self.get_queryset().filter(proposal_choice_id__in={choice_id for choice_id, _ in deltas})
+        existing = set(counters.values_list('proposal_choice_id', 'state'))
+        self.bulk_create([ChoiceVoteCount(proposal_choice_id=choice_id, state=state)
+                          for choice_id, state in deltas if (choice_id, state) not in existing],
+                         ignore_conflicts=True)
+        updates = defaultdict(set)
+        for (choice_id, state), delta in deltas.items():
+            updates[(state, delta)].add(choice_id)
+        for (state, delta), choice_ids in updates.items():
+            counters.filter(proposal_choice_id__in=choice_ids, state=state).update(count=models.F('count') + delta)
+
+    def rebuild(self, proposal_ids=None):
+        """ Rebuilds the counters from the current choice tickets """
+        tickets = ChoiceTicket.objects.filter(current=True)
+        counters = self.get_queryset()
+        if proposal_ids is not None:
+            tickets = tickets.filter(proposal_id__in=proposal_ids)
+            counters = counters.filter(proposal_choice__proposal_id__in=proposal_ids)
+        totals = (tickets.values('proposal_choice_id', 'state')
+                         .annotate(total=models.Count('id'))
+                         .order_by())
+        with transaction.atomic():
+            counters.delete()
+            rebuilt = self.bulk_create([ChoiceVoteCount(proposal_choice_id=total['proposal_choice_id'],
+                                                        state=total['state'],
+                                                        count=total['total'])
+                                        for total in totals])
+        if proposal_ids is None:
+            proposal_ids = ChoiceTicket.objects.values_list('proposal_id', flat=True).distinct()
+        spread_cache.invalidate(*proposal_ids)
+        return len(rebuilt)
+
+
+class ChoiceVoteCount(models.Model):
+    """ Maintained count of the current choice tickets for a choice in a state """
+    proposal_choice = models.ForeignKey('ProposalChoice', on_delete=models.CASCADE)
+    state = models.IntegerField(choices=ProposalState.choices(), default=ProposalState.PUBLISHED)
+    count = models.IntegerField(default=0)
+    objects = ChoiceVoteCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['proposal_choice', 'state'], name='unique_choice_vote_count'),
+        ]
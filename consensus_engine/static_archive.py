@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import HttpRequest
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+# the url names served from the archive and the file under the proposal's directory for each
+# - the files are the same for every user, the pages load the user's sidebar from the sidebar view
+ARCHIVED_FILES = {'view_proposal': 'index.html',
+                  'view_proposal_at_date': os.path.join('{query_date}', 'index.html'),
+                  'proposal_result': 'result.json'}
+
+
+def archive_root():
+    """ The directory the archived proposals are rendered to (None if the static archive is not used) """
+    return getattr(settings, 'CONSENSUS_STATIC_ARCHIVE_ROOT', None)
+
+
+def proposal_directory(proposal_id):
+    # mirrors the urls so a web server can also serve the files
+    return os.path.join(archive_root(), 'proposals', str(proposal_id))
+
+
+def archived_file(url_name, kwargs):
+    """ The path of the pre-rendered file for the url if there is one """
+    if archive_root() is None or url_name not in ARCHIVED_FILES or 'proposal_id' not in kwargs:
+        return None
+    query_date = kwargs['query_date'].strftime('%d-%m-%Y') if 'query_date' in kwargs else ''
+    path = os.path.join(proposal_directory(kwargs['proposal_id']),
+                        ARCHIVED_FILES[url_name].format(query_date=query_date))
+    return path if os.path.isfile(path) else None
+
+
+def _write(path, content):
+    # written to a temporary file and moved into place so a request never reads a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+
+def _render_page(proposal_id, query_date=None):
+    """ Renders the proposal page as seen by no particular user, returns (context, html) """
+    # imported here as the models import this module
+    from consensus_engine.views import ProposalView
+    kwargs = {'proposal_id': proposal_id}
+    if query_date is not None:
+        kwargs['query_date'] = query_date
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = reverse('view_proposal_at_date' if query_date else 'view_proposal',
+                                               kwargs=kwargs)
+    request.user = AnonymousUser()
+    view = ProposalView()
+    view.setup(request, **kwargs)
+    context = view.get_context_data(**kwargs)
+    # leaves out the parts of the page that belong to the user, the sidebar groups and invites are loaded by the page
+    context['static_archive'] = True
+    return context, render_to_string(ProposalView.template_name, context, request)
+
+
+def render_proposal(proposal_id):
+    """ Renders the proposal's page, its history by month pages and its result document, returns the files written """
+    # imported here as the models import this module
+    from consensus_engine.models import Proposal
+    proposal = Proposal.objects.get(pk=proposal_id)
+    directory = proposal_directory(proposal_id)
+    context, html = _render_page(proposal_id)
+    _write(os.path.join(directory, ARCHIVED_FILES['view_proposal']), html)
+    written = 1
+    for history_date in context.get('history_date_list', []):
+        _, html = _render_page(proposal_id, history_date)
+        _write(os.path.join(directory, ARCHIVED_FILES['view_proposal_at_date'].format(
+            query_date=history_date.strftime('%d-%m-%Y'))), html)
+        written += 1
+    _write(os.path.join(directory, ARCHIVED_FILES['proposal_result']), json.dumps(proposal.get_result()))
+    return written + 1
+
+
+def render_batch(proposal_ids):
+    """ Renders the proposals, returns the number of files written (run in the bulk render's worker pool) """
+    return sum(render_proposal(proposal_id) for proposal_id in proposal_ids)
+
+
+def proposals_archived(proposal_ids):
+    """ Queues the render of the newly archived proposals for render_static_archive """
+    # imported here as the models import this module
+    from consensus_engine.models import PendingArchiveRender
+    if archive_root() is not None:
+        PendingArchiveRender.objects.queue(proposal_ids)
+
+
+def proposal_unarchived(proposal_id):
+    """ Removes the pre-rendered files of a deleted or no longer archived proposal once that is committed """
+    # imported here as the models import this module
+    from consensus_engine.models import PendingArchiveRender
+    if archive_root() is not None:
+        PendingArchiveRender.objects.filter(proposal_id=proposal_id).delete()
+        transaction.on_commit(lambda: shutil.rmtree(proposal_directory(proposal_id), ignore_errors=True))
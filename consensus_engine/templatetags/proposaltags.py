@@ -1,27 +1,33 @@
 from django import template
 from consensus_engine.models import ProposalGroup, ProposalChoice, Proposal
-from consensus_engine.models import GroupInvite
-from django.contrib.auth.models import User
+from consensus_engine.models import GroupInvite, SealedTally
+from consensus_engine.caching import sidebar_cache
 
 register = template.Library()
 
 
 @register.inclusion_tag('consensus_engine/visible_groups.html')
 def visible_groups(user):
-    visible_groups = ProposalGroup.objects.groups_for_member(user).order_by('group_name')
+    visible_groups = sidebar_cache.get_or_set(user.id, 'visible_groups',
+                                              lambda: list(ProposalGroup.objects.groups_for_member(user)
+                                                                                .order_by('group_name')))
     return {'visible_groups': visible_groups}
 
 
-# this needs refactoring as it calls multiple times per view...
+# one proposal at a time - lists render from ProposalManager.with_list_data instead
 @register.inclusion_tag('consensus_engine/total_votes.html')
 def total_votes(proposal_id):
     proposal = Proposal.objects.get(pk=proposal_id)
     return {'total_votes': proposal.get_total_votes()}
 
 
-# this needs refactoring as it calls multiple times per view...
+# one proposal at a time - lists render from ProposalManager.with_list_data instead
 @register.inclusion_tag('consensus_engine/current_consensus.html')
 def current_consensus(proposal_id):
+    # archived proposals report their sealed final result
+    sealed = list(SealedTally.objects.filter(proposal_id=proposal_id).values_list('consensus_text', flat=True))
+    if sealed:
+        return {'current_consensus': sealed[0] or "No consensus"}
     try:
         consensus_consensus = (ProposalChoice.objects.get(deactivated_date__isnull=True,
                                                           proposal__id=proposal_id,
@@ -32,7 +38,7 @@ def current_consensus(proposal_id):
     return {'current_consensus': consensus_consensus}
 
 
-# this needs refactoring as it calls multiple times per view...
+# one proposal at a time - lists render from ProposalManager.with_list_data instead
 @register.inclusion_tag('consensus_engine/my_vote.html')
 def my_vote(proposal_id, user_id):
     proposal = Proposal.objects.get(pk=proposal_id)
@@ -50,7 +56,8 @@ def my_vote(proposal_id, user_id):
 
 @register.inclusion_tag('consensus_engine/my_open_invites_count.html')
 def my_open_invites_count(user):
-    open_invites_count = GroupInvite.objects.my_open_invites_count(user)
+    open_invites_count = sidebar_cache.get_or_set(user.id, 'open_invites_count',
+                                                  lambda: GroupInvite.objects.my_open_invites_count(user))
     return {'open_invites_count': open_invites_count}
 
 
@@ -61,9 +68,9 @@ def release_notes():
 
 
 @register.inclusion_tag('consensus_engine/user_search.html')
-def user_search():
-    users = User.objects.all
-    return {'users': users}
+def user_search(group=None):
+    # the users are fetched as they type from the invite_user_search endpoint
+    return {'group': group}
 
 
 @register.inclusion_tag('consensus_engine/proposal_state.html')
@@ -71,6 +78,7 @@ def proposal_state(proposal):
     return {'proposal_state': proposal.current_state.name}
 
 
+# the proposal needs the annotations from ProposalManager.with_list_data
 @register.inclusion_tag('consensus_engine/proposal_list_element.html')
 def proposal_list_element(proposal, current_user_id, vote_enabled='', next=''):
     return {'proposal': proposal, 'current_user_id': current_user_id, 'vote_enabled': vote_enabled, 'next': next}
@@ -5,10 +5,13 @@ from django.contrib.sessions.middleware import SessionMiddleware
 from django.views.generic.edit import CreateView, UpdateView
 from django.contrib.auth.views import LoginView
 from django.db import DataError
+from django.core.cache import cache
 
 
 class OneUserMixin(object):
     def setUp(self):
+        # user ids are reused between tests so start with an empty sidebar cache
+        cache.clear()
         # Every test needs access to the request factory.
         self.user = User.objects.create_user(
             username='jacob', email='jacob@…', password='top_secret')
@@ -195,3 +198,10 @@ class TemplateViewMixin(ViewMixin):
             p = None
 
         return (c, p)
+
+
+def membership_reads(queries, user):
+    """ The captured queries that read the user's group memberships """
+    return [query for query in queries if query['sql'].startswith('SELECT')
+            and 'FROM "consensus_engine_groupmembership" WHERE' in query['sql']
+            and '"consensus_engine_groupmembership"."user_id" = {}'.format(user.id) in query['sql']]
@@ -0,0 +1,82 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
+from django.db import transaction
+
+from consensus_engine.caching import VersionedCache, check_shared_caches
+
+SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                 # two handles on the same table stand in for two processes
+                 'first_process': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                   'LOCATION': 'consensus_test_cache'},
+                 'second_process': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                    'LOCATION': 'consensus_test_cache'}}
+
+
+class Counter:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+# caching test
+class VersionedCacheTest(TestCase):
+
+    @override_settings(CACHES=SHARED_CACHES, FIRST_CACHE='first_process', SECOND_CACHE='second_process')
+    def test_invalidation_seen_across_caches(self):
+        call_command('createcachetable', 'consensus_test_cache')
+        first = VersionedCache('consensus_test', 'FIRST_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        second = VersionedCache('consensus_test', 'SECOND_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        self.assertTrue(first.cache is not second.cache)
+        compute = Counter()
+        self.assertTrue(first.get_or_set(1, 'spread', compute) == 1)
+        self.assertTrue(second.get_or_set(1, 'spread', compute) == 1)
+        # invalidated by the other process
+        second.invalidate(1)
+        self.assertTrue(first.get_or_set(1, 'spread', compute) == 2)
+        self.assertTrue(second.get_or_set(1, 'spread', compute) == 2)
+
+    @override_settings(CONSENSUS_WEB_PROCESSES=2)
+    def test_local_memory_cache_not_used_by_several_processes(self):
+        versioned_cache = VersionedCache('consensus_test', 'TEST_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        compute = Counter()
+        self.assertFalse(versioned_cache.shared)
+        self.assertTrue(versioned_cache.get_or_set(1, 'spread', compute) == 1)
+        self.assertTrue(versioned_cache.get_or_set(1, 'spread', compute) == 2)
+        self.assertTrue([warning.id for warning in check_shared_caches(None)] == ['consensus_engine.W001'] * 3)
+        with self.settings(CONSENSUS_WEB_PROCESSES=1):
+            self.assertTrue(versioned_cache.shared)
+            self.assertTrue(check_shared_caches(None) == [])
+
+    @override_settings(CONSENSUS_CACHE_STATS_FLUSH=3600)
+    def test_stats_counted_in_process(self):
+        this_process = VersionedCache('consensus_stats_test', 'TEST_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        other_process = VersionedCache('consensus_stats_test', 'TEST_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        this_process.reset_stats()
+        compute = Counter()
+        this_process.get_or_set(1, 'spread', compute)
+        this_process.get_or_set(1, 'spread', compute)
+        self.assertTrue(this_process.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+        # not yet added to the counters in the cache
+        self.assertTrue(other_process.stats()['hits'] == 0)
+        with self.settings(CONSENSUS_CACHE_STATS_FLUSH=0):
+            this_process.get_or_set(1, 'spread', compute)
+        self.assertTrue(other_process.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3})
+        self.assertTrue(this_process.stats() == other_process.stats())
+
+
+class VersionedCacheCommitTest(TransactionTestCase):
+
+    def test_invalidated_again_on_commit(self):
+        versioned_cache = VersionedCache('consensus_commit_test', 'TEST_CACHE', 'TEST_CACHE_TIMEOUT', 60)
+        compute = Counter()
+        versioned_cache.get_or_set(1, 'spread', compute)
+        with transaction.atomic():
+            versioned_cache.invalidate(1)
+            # a concurrent reader caches the data from before the commit under the new version
+            self.assertTrue(versioned_cache.get_or_set(1, 'spread', compute) == 2)
+            self.assertTrue(versioned_cache.get_or_set(1, 'spread', compute) == 2)
+        self.assertTrue(versioned_cache.get_or_set(1, 'spread', compute) == 3)
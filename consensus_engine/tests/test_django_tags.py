@@ -1,24 +1,61 @@
 from django.test import TestCase
-from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from django.core.management import call_command
+from io import StringIO
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin, ProposalTestHelper
 from consensus_engine.models import Proposal, ChoiceTicket
+from consensus_engine.caching import sidebar_cache
 from django.utils import timezone
 from consensus_engine.templatetags.proposaltags import (visible_groups, total_votes, my_vote, current_consensus,
                                                         release_notes, user_search, proposal_state,
-                                                        proposal_list_element)
+                                                        proposal_list_element, my_open_invites_count)
 
 
 class ProposalGroupTagsTest(TwoUserMixin, ProposalGroupMixin, TestCase):
 
     def test_proposal_tags_visible_groups(self):
-        self.assertTrue(visible_groups(self.user)['visible_groups'].count() == 0)
+        self.assertTrue(len(visible_groups(self.user)['visible_groups']) == 0)
         _ = self.create_proposal_group()
-        self.assertTrue(visible_groups(self.user)['visible_groups'].count() == 1)
+        self.assertTrue(len(visible_groups(self.user)['visible_groups']) == 1)
         _ = self.create_proposal_group()
-        self.assertTrue(visible_groups(self.user)['visible_groups'].count() == 2)
+        self.assertTrue(len(visible_groups(self.user)['visible_groups']) == 2)
         # add a group under another user and test to see if it works
         _ = self.create_proposal_group(owned_by=self.user2)
-        self.assertTrue(visible_groups(self.user)['visible_groups'].count() == 2)
-        self.assertTrue(visible_groups(self.user2)['visible_groups'].count() == 1)
+        self.assertTrue(len(visible_groups(self.user)['visible_groups']) == 2)
+        self.assertTrue(len(visible_groups(self.user2)['visible_groups']) == 1)
+
+    def test_sidebar_cache(self):
+        sidebar_cache.reset_stats()
+        pg = self.create_proposal_group()
+        p = ProposalTestHelper.new_proposal_with_two_choices(proposal_group=pg, owned_by=self.user)
+        p.publish()
+        self.assertTrue(visible_groups(self.user)['visible_groups'][0]['propcount'] == 1)
+        # served from the cache
+        with self.assertNumQueries(1):
+            self.assertTrue(visible_groups(self.user)['visible_groups'][0]['propcount'] == 1)
+            self.assertTrue(my_open_invites_count(self.user2)['open_invites_count'] == 0)
+            self.assertTrue(my_open_invites_count(self.user2)['open_invites_count'] == 0)
+        self.assertTrue(sidebar_cache.stats() == {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+        # voting
+        p.proposalchoice_set.first().vote(self.user)
+        self.assertTrue(visible_groups(self.user)['visible_groups'][0]['propcount'] == 0)
+        # invites
+        invite = pg.invite_user(self.user, self.user2)
+        self.assertTrue(my_open_invites_count(self.user2)['open_invites_count'] == 1)
+        self.assertTrue(len(visible_groups(self.user2)['visible_groups']) == 0)
+        invite.accept()
+        self.assertTrue(my_open_invites_count(self.user2)['open_invites_count'] == 0)
+        self.assertTrue(visible_groups(self.user2)['visible_groups'][0]['propcount'] == 1)
+        # proposal state changes update every member
+        p.hold()
+        self.assertTrue(visible_groups(self.user2)['visible_groups'][0]['propcount'] == 0)
+        pg.remove_member(self.user2)
+        self.assertTrue(len(visible_groups(self.user2)['visible_groups']) == 0)
+        pg.join_group(self.user2)
+        self.assertTrue(len(visible_groups(self.user2)['visible_groups']) == 1)
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        self.assertTrue('sidebar: 2 hits' in out.getvalue())
+        self.assertTrue(sidebar_cache.stats()['hits'] == 0)
 
 
 class ProposalTagsTest(TwoUserMixin, ProposalMixin, TestCase):
@@ -36,10 +73,10 @@ class ProposalTagsTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(isinstance(v, ChoiceTicket))
         self.assertTrue(total_votes(w.id)['total_votes'] == 1)
         # change votes - change current
-        _ = ChoiceTicket.objects.create(user=self.user,
-                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current = False
         v.save()
+        _ = ChoiceTicket.objects.create(user=self.user,
+                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(total_votes(w.id)['total_votes'] == 1)
         # create a vote by another user and test that we have two votes
         _ = ChoiceTicket.objects.create(user=self.user2,
@@ -58,10 +95,10 @@ class ProposalTagsTest(TwoUserMixin, ProposalMixin, TestCase):
                                         date_chosen=timezone.now(), proposal_choice=pc1, current=True)
         self.assertTrue(my_vote(w.id, self.user.id)['my_vote'] == pc1.text)
         # change votes - change current
-        _ = ChoiceTicket.objects.create(user=self.user,
-                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current = False
         v.save()
+        _ = ChoiceTicket.objects.create(user=self.user,
+                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(my_vote(w.id, self.user.id)['my_vote'] == pc2.text)
         # create a vote by another user and test that we have two votes
         _ = ChoiceTicket.objects.create(user=self.user2,
@@ -84,10 +121,10 @@ class ProposalTagsTest(TwoUserMixin, ProposalMixin, TestCase):
         w.determine_consensus()
         self.assertTrue(current_consensus(w.id)['current_consensus'] == 'Yes')
         # change votes - change current
-        _ = ChoiceTicket.objects.create(user=self.user,
-                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current = False
         v.save()
+        _ = ChoiceTicket.objects.create(user=self.user,
+                                        date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         w.determine_consensus()
         self.assertTrue(current_consensus(w.id)['current_consensus'] == 'No')
         # create a vote by another user and test that we have two votes
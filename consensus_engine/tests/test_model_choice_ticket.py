@@ -1,12 +1,24 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import AnonymousUser, User
 
-from .mixins import TwoUserMixin, ProposalMixin
+from django.core.management import call_command
+from django.db import connection, connections, transaction, IntegrityError, OperationalError
+from django.core.management.base import CommandError
+from io import StringIO
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from .mixins import TwoUserMixin, ProposalMixin, ProposalGroupMixin
 
 # Create your tests here.
 
 from consensus_engine.models import (Proposal, ProposalChoice, ChoiceTicket,
-                                        ProposalGroup)
+                                        ProposalGroup, ConsensusHistory, ChoiceVoteCount)
+from consensus_engine.utils import ProposalState
 from django.utils import timezone
 
 
@@ -25,6 +37,63 @@ class ChoiceTicketTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(v.proposal_choice == pc1)
         self.assertTrue(v.current == True)
 
+    def test_choiceticket_proposal_is_denormalised(self):
+        w = self.create_proposal_with_two_proposal_choices()
+        w.publish()
+        pc1 = w.proposalchoice_set.first()
+        v = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc1, current=True)
+        self.assertTrue(v.proposal_id == w.id)
+        pc1.vote(self.user2)
+        self.assertTrue(ChoiceTicket.objects.filter(proposal=w, current=True).count() == 2)
+        # the voting lookups no longer join through the proposal choice
+        self.assertTrue('proposalchoice' not in
+                        str(ChoiceTicket.objects.filter(user=self.user, proposal=w, current=True).query))
+        self.assertTrue(ChoiceTicket.objects.get_current_choice(self.user2, w).proposal_choice == pc1)
+
+    def test_only_one_current_ticket_per_user_and_proposal(self):
+        w = self.create_proposal_with_two_proposal_choices()
+        w.publish()
+        pc1 = w.proposalchoice_set.first()
+        pc2 = w.proposalchoice_set.last()
+        ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc1, current=True)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(),
+                                            proposal_choice=pc2, current=True)
+        # not current, a different state and a different user are all allowed
+        ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=False)
+        ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=True,
+                                    state=ProposalState.TRIAL)
+        ChoiceTicket.objects.create(user=self.user2, date_chosen=timezone.now(), proposal_choice=pc2, current=True)
+        self.assertTrue(ChoiceTicket.objects.filter(proposal=w, current=True).count() == 3)
+
+    def test_cast_retries_when_a_concurrent_vote_gets_in_first(self):
+        w = self.create_proposal_with_two_proposal_choices()
+        w.publish()
+        pc1 = w.proposalchoice_set.first()
+        pc2 = w.proposalchoice_set.last()
+        pc1.vote(self.user)
+        retire = ChoiceTicket.objects.retire
+        calls = []
+
+        def retire_then_concurrent_vote(tickets):
+            retired = retire(tickets)
+            if not calls:
+                # another request casts its vote between the retire and the insert
+                ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal=w,
+                                            proposal_choice=pc1, current=True)
+            calls.append(retired)
+            return retired
+
+        with patch.object(ChoiceTicket.objects, 'retire', side_effect=retire_then_concurrent_vote):
+            ticket = ChoiceTicket.objects.cast(self.user, pc2)
+        self.assertTrue(len(calls) == 2)
+        current = ChoiceTicket.objects.get(user=self.user, proposal=w, current=True)
+        self.assertTrue(current.id == ticket.id)
+        self.assertTrue(current.proposal_choice == pc2)
+        self.assertTrue(pc1.current_vote_count == 0)
+        self.assertTrue(pc2.current_vote_count == 1)
+
     def test_my_votes_with_with_voting(self):
         w = self.create_proposal_with_two_proposal_choices()
         # check that total votes = 0 if there are no votes
@@ -37,10 +106,10 @@ class ChoiceTicketTest(TwoUserMixin, ProposalMixin, TestCase):
         # test my_votes
         self.assertTrue(ChoiceTicket.objects.my_votes(self.user).count() == 1)
         # change votes - change current
-        v2 = ChoiceTicket.objects.create(user=self.user,
-            date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current=False;
         v.save();
+        v2 = ChoiceTicket.objects.create(user=self.user,
+            date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(ChoiceTicket.objects.my_votes(self.user).count() == 1)
         # create a vote by another user and test that we have two votes
         v3 = ChoiceTicket.objects.create(user=self.user2,
@@ -60,10 +129,10 @@ class ChoiceTicketTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(isinstance(v, ChoiceTicket))
         self.assertTrue(ChoiceTicket.objects.my_votes(self.user).count() == 1)
         # change votes - change current
-        v2 = ChoiceTicket.objects.create(user=self.user,
-            date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current=False;
         v.save();
+        v2 = ChoiceTicket.objects.create(user=self.user,
+            date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(ChoiceTicket.objects.my_votes(self.user).count() == 1)
         # create a vote by another user and test that we have two votes
         v3 = ChoiceTicket.objects.create(user=self.user2,
@@ -123,3 +192,160 @@ class ChoiceTicketTest(TwoUserMixin, ProposalMixin, TestCase):
         pc3.deactivated_date = timezone.now()
         pc3.save()
         self.assertTrue(ChoiceTicket.objects.my_votes(self.user2).count() == 1)
+
+
+class ChoiceTicketBulkVoteTest(TwoUserMixin, ProposalMixin, ProposalGroupMixin, TestCase):
+
+    def test_bulk_vote(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        p2 = self.create_proposal_with_two_proposal_choices()
+        p2.publish()
+        pc3 = p2.proposalchoice_set.first()
+        pc1.vote(self.user)
+        records = [('jacob', p.id, pc2.id),
+                   ('jacob2', p.id, pc1.id),  # not a member of the group
+                   ('jacob', p2.id, pc3.id),
+                   ('jacob2', p2.id, pc3.id),
+                   ('jacob2', p2.id, pc3.id + 1),  # last vote wins
+                   ('nobody', p.id, pc1.id),
+                   ('jacob', p2.id, pc1.id),
+                   ('jacob', 'x', pc1.id)]
+        cast, proposals, rejected = ChoiceTicket.objects.bulk_vote(records)
+        self.assertTrue(cast == 3)
+        self.assertTrue(set(proposals.keys()) == {p.id, p2.id})
+        self.assertTrue([reason for _, reason in rejected] == ["Invalid record.",
+                                                               "Cannot vote in a proposal in this state.",
+                                                               "Unknown user.",
+                                                               "Unknown choice for this proposal."])
+        # previous vote is retired and the counters, consensus and history are updated
+        self.assertTrue(ChoiceTicket.objects.filter(user=self.user, current=True).count() == 2)
+        self.assertTrue(pc1.current_vote_count == 0 and pc2.current_vote_count == 1)
+        self.assertTrue(p.current_consensus == pc2)
+        self.assertTrue(p2.current_consensus is None)
+        self.assertTrue(ConsensusHistory.objects.filter(proposal=p2).count() == 1)
+
+    def test_bulk_vote_trial(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        pg.join_group(self.user2)
+        p.trial()
+        pc1 = p.proposalchoice_set.first()
+        cast, _, rejected = ChoiceTicket.objects.bulk_vote([('jacob', p.id, pc1.id), ('jacob2', p.id, pc1.id)],
+                                                           update_consensus=False)
+        self.assertTrue(cast == 1 and len(rejected) == 1)
+        self.assertTrue(ChoiceTicket.objects.get(current=True).state == ProposalState.TRIAL)
+        self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 0)
+
+    def test_import_votes_command(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'votes.csv')
+            with open(csv_path, 'w') as f:
+                f.write('user,proposal,choice\njacob,{0},{1}\njacob2,{0},{1}\nnobody,{0},{1}\n'.format(p.id, pc1.id))
+            out, err = StringIO(), StringIO()
+            call_command('import_votes', csv_path, '--batch-size=2', stdout=out, stderr=err)
+            self.assertTrue('Cast 2 votes on 1 proposals, rejected 1 records.' in out.getvalue())
+            self.assertTrue('Unknown user.' in err.getvalue())
+            self.assertTrue(pc1.current_vote_count == 2)
+            ndjson_path = os.path.join(directory, 'votes.ndjson')
+            with open(ndjson_path, 'w') as f:
+                f.write(json.dumps({'user': 'jacob', 'proposal': p.id, 'choice': pc2.id}) + '\n\n')
+            call_command('import_votes', ndjson_path, stdout=out, stderr=err)
+            self.assertTrue(pc1.current_vote_count == 1 and pc2.current_vote_count == 1)
+            self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 2)
+            with self.assertRaises(CommandError):
+                call_command('import_votes', csv_path, '--batch-size=0')
+
+    def test_import_votes_command_bad_lines(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        with tempfile.TemporaryDirectory() as directory:
+            ndjson_path = os.path.join(directory, 'votes.ndjson')
+            with open(ndjson_path, 'w') as f:
+                f.write(json.dumps({'user': 'jacob', 'proposal': p.id, 'choice': pc1.id}) + '\n{"user": "jacob2", \n')
+            out, err = StringIO(), StringIO()
+            call_command('import_votes', ndjson_path, '--batch-size=1', stdout=out, stderr=err)
+            self.assertTrue('Cast 1 votes on 1 proposals, rejected 1 records.' in out.getvalue())
+            self.assertTrue('Invalid record.' in err.getvalue())
+            # the committed vote has its consensus and history
+            self.assertTrue(ProposalChoice.objects.get(pk=pc1.id).current_consensus)
+            self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 1)
+
+            def failing_records(stream, file_format, fields):
+                yield ('jacob2', p.id, pc1.id)
+                raise OSError('read failed')
+            with patch('consensus_engine.management.commands.import_votes.read_records', failing_records):
+                with self.assertRaises(OSError):
+                    call_command('import_votes', ndjson_path, '--batch-size=1', stdout=out, stderr=err)
+            # the batch cast before the failure still has its consensus updated
+            self.assertTrue(pc1.current_vote_count == 2)
+            self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 2)
+
+    def test_benchmark_indexes_command(self):
+        out = StringIO()
+        call_command('benchmark_indexes', '--users=4', '--proposals=2', '--history=1', '--repeat=1', stdout=out)
+        self.assertTrue('current_vote_count:' in out.getvalue())
+        self.assertTrue('plan after:' in out.getvalue())
+        call_command('benchmark_indexes', '--users=2', '--proposals=1', '--repeat=1', '--no-plans', stdout=out)
+        # the seeded data and the dropped indexes are rolled back
+        self.assertTrue(ChoiceTicket.objects.count() == 0)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, ChoiceTicket._meta.db_table)
+        self.assertTrue('unique_current_ticket' in constraints)
+        # refused against a live database unless DEBUG is on
+        with patch('consensus_engine.management.commands.benchmark_indexes.is_test_database', lambda: False):
+            with self.assertRaises(CommandError):
+                call_command('benchmark_indexes', '--users=2', '--proposals=1', '--repeat=1', stdout=out)
+            with self.settings(DEBUG=True):
+                call_command('benchmark_indexes', '--users=2', '--proposals=1', '--repeat=1', '--no-plans',
+                             stdout=out)
+
+
+class ChoiceTicketConcurrentVoteTest(TwoUserMixin, ProposalMixin, TransactionTestCase):
+
+    def test_concurrent_voters(self):
+        w = self.create_proposal_with_two_proposal_choices()
+        w.publish()
+        choices = list(w.proposalchoice_set.all())
+        users = [self.user, self.user2]
+        errors = []
+        start = threading.Barrier(8)
+
+        def voter(index):
+            try:
+                start.wait()
+                for vote in range(10):
+                    choice = choices[(index + vote) % 2]
+                    while True:
+                        try:
+                            choice.vote(users[index % 2])
+                            break
+                        except OperationalError:
+                            # sqlite serialises writers, so wait for the lock and try again
+                            time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=voter, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(errors == [])
+        for user in users:
+            self.assertTrue(ChoiceTicket.objects.filter(user=user, proposal=w, current=True).count() == 1)
+            self.assertTrue(ChoiceTicket.objects.get_current_choice(user, w) is not None)
+        self.assertTrue(w.total_votes == 2)
+        self.assertTrue(sum(choice.current_vote_count for choice in choices) == 2)
+        counts = dict(ChoiceVoteCount.objects.values_list('proposal_choice_id', 'count'))
+        for choice in choices:
+            self.assertTrue(counts.get(choice.id, 0)
+                            == ChoiceTicket.objects.filter(proposal_choice=choice, current=True).count())
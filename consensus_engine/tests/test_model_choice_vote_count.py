@@ -0,0 +1,102 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.utils import timezone
+from io import StringIO
+
+from .mixins import TwoUserMixin, ProposalMixin, ProposalGroupMixin
+from consensus_engine.models import ChoiceTicket, ChoiceVoteCount, GroupMembership
+from consensus_engine.utils import ProposalState
+
+
+# models test
+class ChoiceVoteCountTest(TwoUserMixin, ProposalMixin, ProposalGroupMixin, TestCase):
+
+    def test_counts_follow_votes(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc1, ProposalState.PUBLISHED) == 0)
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc1, ProposalState.PUBLISHED) == 2)
+        # changing a vote moves the count between the choices
+        pc2.vote(self.user)
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc1, ProposalState.PUBLISHED) == 1)
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc2, ProposalState.PUBLISHED) == 1)
+        # voting for the same choice again does not change the count
+        pc2.vote(self.user)
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc2, ProposalState.PUBLISHED) == 1)
+        self.assertTrue(ChoiceVoteCount.objects.count_for(pc2, ProposalState.TRIAL) == 0)
+
+    def test_counts_follow_ticket_saves(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        ct = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc1, current=True)
+        self.assertTrue(pc1.current_vote_count == 1)
+        # reloaded tickets remember what they were counted as
+        ct = ChoiceTicket.objects.get(pk=ct.pk)
+        ct.proposal_choice = pc2
+        ct.save()
+        self.assertTrue(pc1.current_vote_count == 0)
+        self.assertTrue(pc2.current_vote_count == 1)
+        ct.current = False
+        ct.save()
+        self.assertTrue(pc2.current_vote_count == 0)
+        _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc1, current=False)
+        self.assertTrue(pc1.current_vote_count == 0)
+
+    def test_counts_follow_ticket_deletes(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        pg.join_group(self.user2)
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        ChoiceTicket.objects.get(user=self.user, current=True).delete()
+        self.assertTrue(pc1.current_vote_count == 1)
+        self.assertTrue(GroupMembership.objects.get(group=pg, user=self.user).pending_votes == 1)
+        # queryset deletes and tickets that are not current
+        pc1.vote(self.user)
+        pc1.vote(self.user)
+        ChoiceTicket.objects.filter(proposal=p).exclude(user=self.user2).delete()
+        self.assertTrue(pc1.current_vote_count == 1)
+        # the counter deleted with the choice is not made again
+        pc1.delete()
+        self.assertFalse(ChoiceVoteCount.objects.filter(proposal_choice_id=pc1.id).exists())
+
+    def test_counts_follow_member_removal(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        pg.join_group(self.user2)
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        self.assertTrue(pc1.current_vote_count == 2)
+        pg.remove_member(self.user2)
+        self.assertTrue(pc1.current_vote_count == 1)
+
+    def test_rebuild(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        p2 = self.create_proposal_with_two_proposal_choices()
+        p2.publish()
+        pc3 = p2.proposalchoice_set.first()
+        pc3.vote(self.user)
+        # tickets flipped by a bulk update are not counted until the counters are rebuilt
+        ChoiceTicket.objects.filter(user=self.user2).update(current=False)
+        ChoiceVoteCount.objects.filter(proposal_choice=pc3).update(count=10)
+        self.assertTrue(pc1.current_vote_count == 2)
+        self.assertTrue(ChoiceVoteCount.objects.rebuild(proposal_ids=[p.id]) == 1)
+        self.assertTrue(pc1.current_vote_count == 1)
+        self.assertTrue(pc3.current_vote_count == 10)
+        out = StringIO()
+        call_command('rebuild_vote_counts', stdout=out)
+        self.assertTrue('Rebuilt 2 vote counters.' in out.getvalue())
+        self.assertTrue(pc1.current_vote_count == 1)
+        self.assertTrue(pc3.current_vote_count == 1)
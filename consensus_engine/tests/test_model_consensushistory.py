@@ -1,7 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.management import call_command
 from .mixins import TwoUserMixin, ProposalMixin
-from consensus_engine.models import ConsensusHistory
+from consensus_engine.models import ConsensusHistory, ConsensusRollup, ProposalChoice, SealedTally
+from consensus_engine.utils import RollupPeriod
 from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+import json
 
 
 # models test
@@ -32,3 +38,169 @@ class ConsensusHistoryTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(ss2.get_consensus_data() == one_vote_data)
         all_history = ConsensusHistory.objects.all_history_for_proposal(p)
         self.assertTrue(all_history.count() == 2)
+
+    @override_settings(CONSENSUS_HISTORY_KEYFRAME_INTERVAL=3)
+    def test_delta_snapshots(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        pc1.vote(self.user)
+        pc2.vote(self.user2)
+        pc2.vote(self.user)
+        pc1.vote(self.user2)
+        history = list(ConsensusHistory.objects.filter(proposal=p).order_by('id'))
+        self.assertTrue(len(history) == 4)
+        self.assertTrue([h.keyframe_id is None for h in history] == [True, False, False, True])
+        self.assertTrue(history[1].keyframe_id == history[0].id)
+        # the delta only stores the choice that changed
+        self.assertTrue(json.loads(history[1].consensus_data) ==
+                        {'changed': [{'choice_id': pc2.id, 'text': "No", 'count': 1}], 'removed': []})
+        self.assertTrue(history[2].get_consensus_data() == [
+                         {'choice_id': pc1.id, 'text': "Yes", 'count': 0},
+                         {'choice_id': pc2.id, 'text': "No", 'count': 2}
+                        ])
+        ss = ConsensusHistory.objects.at_date(proposal=p, at_date=timezone.now())
+        self.assertTrue(ss.snapshot_date == history[3].snapshot_date)
+        spread = p.get_voting_spread(timezone.now())
+        self.assertTrue(spread[pc1.id]['count'] == 1 and spread[pc2.id]['count'] == 1)
+
+    def test_delta_with_removed_and_added_choices(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        keyframe = ConsensusHistory.objects.record_snapshot(p)
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        pc1.deactivated_date = timezone.now()
+        pc1.save()
+        pc3 = ProposalChoice.objects.create(proposal=p, text="Maybe", priority=300, activated_date=timezone.now())
+        delta = ConsensusHistory.build_snapshot(p)
+        delta.encode(delta.get_consensus_data(), keyframe)
+        delta.save()
+        self.assertTrue(json.loads(delta.consensus_data)['removed'] == [pc1.id])
+        self.assertTrue([item['choice_id'] for item in delta.get_consensus_data()] ==
+                        [pc2.id, pc3.id])
+
+    @override_settings(CONSENSUS_HISTORY_COALESCE_SECONDS=3600, CONSENSUS_HISTORY_KEYFRAME_INTERVAL=2)
+    def test_coalesced_snapshots(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        earlier = timezone.now() - timedelta(hours=2)
+        keyframe = ConsensusHistory.objects.record_snapshot(p)
+        ConsensusHistory.objects.filter(id=keyframe.id).update(snapshot_date=earlier)
+        with patch('django.utils.timezone.now', return_value=earlier + timedelta(hours=1)):
+            pc1.vote(self.user)
+            pc2.vote(self.user2)
+        pc2.vote(self.user)
+        history = list(ConsensusHistory.objects.filter(proposal=p).order_by('snapshot_date'))
+        # the two votes an hour later are merged into one delta, the last vote starts a new keyframe
+        self.assertTrue(len(history) == 3)
+        self.assertTrue(history[1].keyframe_id == keyframe.id)
+        self.assertTrue(history[2].keyframe_id is None)
+        self.assertTrue([item['count'] for item in history[1].get_consensus_data()] == [1, 1])
+        self.assertTrue([item['count'] for item in history[2].get_consensus_data()] == [0, 2])
+
+    def test_compact_history(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        pc1.vote(self.user)
+        pc2.vote(self.user2)
+        pc2.vote(self.user)
+        expected = [h.get_consensus_data() for h in ConsensusHistory.objects.filter(proposal=p).order_by('id')]
+        out = StringIO()
+        call_command('compact_consensus_history', '--keyframe-interval=2', stdout=out)
+        self.assertTrue('Compacted 3 snapshots into 3.' in out.getvalue())
+        history = list(ConsensusHistory.objects.filter(proposal=p).order_by('snapshot_date', 'id'))
+        self.assertTrue([h.keyframe_id is None for h in history] == [True, False, True])
+        self.assertTrue([h.get_consensus_data() for h in history] == expected)
+        # everything happened within the hour, so it collapses to the latest snapshot
+        call_command('compact_consensus_history', '--window=86400', '--proposal={}'.format(p.id), stdout=out)
+        history = ConsensusHistory.objects.filter(proposal=p)
+        self.assertTrue(history.count() == 1)
+        self.assertTrue(history.first().get_consensus_data() == expected[-1])
+
+    def test_compact_sealed_history(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        p.archive()
+        final_data = SealedTally.objects.get(proposal=p).final_history.get_consensus_data()
+        call_command('compact_consensus_history', '--keyframe-interval=4', stdout=StringIO())
+        # the sealed snapshot is rebuilt as a keyframe rather than a delta and the tally still points at it
+        tally = SealedTally.objects.get(proposal=p)
+        history = list(ConsensusHistory.objects.filter(proposal=p).order_by('snapshot_date', 'id'))
+        self.assertTrue(tally.final_history == history[-1])
+        self.assertTrue(tally.final_history.keyframe is None)
+        self.assertTrue(tally.final_history.get_consensus_data() == final_data)
+        call_command('compact_consensus_history', '--window=86400', stdout=StringIO())
+        tally.refresh_from_db()
+        self.assertTrue(tally.final_history is not None)
+        self.assertTrue(tally.final_history.get_consensus_data() == final_data)
+
+    def test_rollups(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        last_year = timezone.now() - timedelta(days=365)
+        with patch('django.utils.timezone.now', return_value=last_year):
+            pc1.vote(self.user)
+            pc2.vote(self.user2)
+        pc2.vote(self.user)
+        # one row per day and per month holding the end of period spread
+        rollups = ConsensusRollup.objects.filter(proposal=p)
+        self.assertTrue(rollups.filter(period=RollupPeriod.DAY).count() == 2)
+        self.assertTrue(rollups.filter(period=RollupPeriod.MONTH).count() == 2)
+        old_day = rollups.get(period=RollupPeriod.DAY, period_start=RollupPeriod.DAY.period_start(last_year))
+        self.assertTrue([item['count'] for item in old_day.get_consensus_data()] == [1, 1])
+        # an older snapshot written later does not replace the end of day rollup
+        ss = ConsensusHistory.build_snapshot(p)
+        ss.snapshot_date = last_year - timedelta(seconds=1)
+        ss.save()
+        old_day.refresh_from_db()
+        self.assertTrue([item['count'] for item in old_day.get_consensus_data()] == [1, 1])
+        # reads come from the rollups
+        with self.assertNumQueries(1):
+            at_date = ConsensusHistory.objects.at_date(proposal=p, at_date=last_year + timedelta(days=1))
+        self.assertTrue(at_date.get_consensus_data() == old_day.get_consensus_data())
+        with self.assertNumQueries(2):
+            earliest_date = ConsensusHistory.objects.earliest_snapshot_date(p)
+        self.assertTrue(earliest_date.date() == last_year.date())
+
+    def test_backfill_rollups(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        self.assertTrue(ConsensusHistory.objects.earliest_snapshot_date(p) is None)
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        expected = list(ConsensusRollup.objects.filter(proposal=p).order_by('period')
+                        .values_list('period', 'period_start', 'snapshot_date', 'consensus_data'))
+        ConsensusRollup.objects.all().delete()
+        # falls back to the raw history until the rollups are backfilled
+        self.assertTrue(ConsensusHistory.objects.earliest_snapshot_date(p) is not None)
+        self.assertTrue(ConsensusHistory.objects.at_date(proposal=p, at_date=timezone.now()).id is not None)
+        out = StringIO()
+        call_command('backfill_consensus_rollups', '--proposal={}'.format(p.id), stdout=out)
+        self.assertTrue('Backfilled 2 rollups for 1 proposals.' in out.getvalue())
+        self.assertTrue(list(ConsensusRollup.objects.filter(proposal=p).order_by('period')
+                             .values_list('period', 'period_start', 'snapshot_date', 'consensus_data')) == expected)
+
+    def test_earliest_snapshot_date_partial_rollups(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        last_year = timezone.now() - timedelta(days=365)
+        with patch('django.utils.timezone.now', return_value=last_year):
+            pc1.vote(self.user)
+        pc1.vote(self.user2)
+        # a backfill that has only reached the recent months
+        ConsensusRollup.objects.filter(proposal=p, period_start__lt=timezone.now().date().replace(day=1)).delete()
+        self.assertTrue(ConsensusRollup.objects.filter(proposal=p, period=RollupPeriod.MONTH).count() == 1)
+        self.assertTrue(ConsensusHistory.objects.earliest_snapshot_date(p).date() == last_year.date())
+
@@ -1,7 +1,13 @@
 from django.test import TestCase
 from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from io import StringIO
+import os
+import tempfile
 
-from .mixins import TwoUserMixin, ProposalGroupMixin
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from consensus_engine.models import GroupInvite, GroupMembership, ProposalGroup
 from django.db import DataError
 
 # Create your tests here.
@@ -9,7 +15,7 @@ from django.utils import timezone
 
 
 # models test
-class InviteTest(TwoUserMixin, ProposalGroupMixin, TestCase):
+class InviteTest(TwoUserMixin, ProposalGroupMixin, ProposalMixin, TestCase):
 
     def test_invite_creation(self):
         dt = timezone.now()
@@ -65,3 +71,57 @@ class InviteTest(TwoUserMixin, ProposalGroupMixin, TestCase):
         self.assertTrue(i.accepted == False)
         self.assertTrue(i.date_accepted_or_declined >= dt and i.date_accepted_or_declined <= timezone.now())
         self.assertTrue(pg.has_user_been_invited(self.user2) == False)
+
+    def test_bulk_add_people(self):
+        pg = self.create_proposal_group()
+        for i in range(5):
+            User.objects.create_user(username='user{}'.format(i), email='', password='top_secret')
+        pg.join_group(User.objects.get(username='user0'))
+        pg.invite_user(self.user, User.objects.get(username='user1'))
+        records = [('user0', ''), ('user1', ''), ('user2', 'true'), ('user3', '0'), ('user2', ''),
+                   ('nobody', ''), (None, '')]
+        # the inviter, the users with their memberships and invites, the bulk_create in its savepoint
+        with self.assertNumQueries(5):
+            results = pg.bulk_add_people(self.user, records)
+        self.assertTrue([result for _, result in results] ==
+                        ["Already a member.", "Already invited.", "Invited.", "Invited.", "Duplicate record.",
+                         "Unknown user.", "Invalid record."])
+        self.assertTrue(GroupInvite.objects.get(group=pg, invitee__username='user2').can_trial)
+        self.assertFalse(GroupInvite.objects.get(group=pg, invitee__username='user3').can_trial)
+        self.assertTrue(GroupInvite.objects.filter(group=pg, inviter=self.user, accepted=None).count() == 3)
+        with self.assertRaises(PermissionDenied):
+            pg.bulk_add_people(self.user2, [('user4', '')])
+        # only the owner can add members without an invite
+        pg.join_group(self.user2)
+        with self.assertRaises(PermissionDenied):
+            pg.bulk_add_people(self.user2, [('user4', '')], join=True)
+
+    def test_bulk_join_people(self):
+        pg = self.create_proposal_group()
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+        user3 = User.objects.create_user(username='user3', email='', password='top_secret')
+        pg.invite_user(self.user, user3)
+        results = pg.bulk_add_people(self.user, [('jacob2', 'yes'), ('user3', '')], join=True)
+        self.assertTrue([result for _, result in results] == ["Joined.", "Joined."])
+        self.assertTrue(pg.is_user_part_of_trial(self.user2))
+        self.assertTrue(pg.is_user_member(user3) and not pg.has_user_been_invited(user3))
+        # the new members' counters count the published proposal
+        self.assertTrue(GroupMembership.objects.get(group=pg, user=user3).pending_votes == 1)
+        self.assertTrue(ProposalGroup.objects.groups_for_member(self.user2)[0]['propcount'] == 1)
+
+    def test_import_group_people_command(self):
+        pg = self.create_proposal_group()
+        User.objects.create_user(username='user3', email='', password='top_secret')
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'people.ndjson')
+        with open(path, 'w') as f:
+            f.write('{"username": "jacob2", "can_trial": true}\n\n{"username": "user3"}\n{"username": "nobody"}\n')
+        out = StringIO()
+        call_command('import_group_people', str(pg.id), path, '--inviter=' + self.user.username, '--batch-size=2',
+                     stdout=out)
+        os.remove(path)
+        os.rmdir(directory)
+        self.assertTrue('nobody: Unknown user.' in out.getvalue())
+        self.assertTrue(out.getvalue().endswith('Invited 2 people, skipped 1 records.\n'))
+        self.assertTrue(GroupInvite.objects.get(group=pg, invitee=self.user2).can_trial)
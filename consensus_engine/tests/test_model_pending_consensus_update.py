@@ -0,0 +1,79 @@
+from django.test import TestCase, RequestFactory, override_settings
+from django.core.management import call_command
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from .mixins import TwoUserMixin, ProposalMixin, TemplateViewMixin
+from consensus_engine.models import ConsensusHistory, PendingConsensusUpdate
+from consensus_engine.views import ProposalView
+
+
+# models test
+@override_settings(CONSENSUS_WRITE_BEHIND=True, CONSENSUS_WRITE_BEHIND_MAX_STALENESS=30)
+class PendingConsensusUpdateTest(TwoUserMixin, ProposalMixin, TemplateViewMixin, TestCase):
+    view = ProposalView
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TwoUserMixin.setUp(self)
+
+    def test_vote_marks_proposal(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        # one pending row per proposal, no consensus or history yet
+        self.assertTrue(PendingConsensusUpdate.objects.filter(proposal=p).count() == 1)
+        self.assertTrue(p.current_consensus is None)
+        self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 0)
+        self.assertTrue(pc1.current_vote_count == 2)
+        out = StringIO()
+        call_command('process_consensus_updates', '--once', stdout=out)
+        self.assertTrue('Recomputed consensus for 1 proposals.' in out.getvalue())
+        self.assertTrue(p.current_consensus == pc1)
+        self.assertTrue(ConsensusHistory.objects.filter(proposal=p).count() == 1)
+        self.assertTrue(PendingConsensusUpdate.objects.count() == 0)
+        self.assertTrue(PendingConsensusUpdate.objects.process() == 0)
+
+    def test_process_batch_size(self):
+        for _ in range(3):
+            p = self.create_proposal_with_two_proposal_choices()
+            p.publish()
+            p.proposalchoice_set.first().vote(self.user)
+        self.assertTrue(PendingConsensusUpdate.objects.process(batch_size=2) == 2)
+        self.assertTrue(PendingConsensusUpdate.objects.count() == 1)
+
+    def test_stale_read_recomputes(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        # within the staleness bound the view does not recompute
+        self.getView(p)
+        self.assertTrue(p.current_consensus is None)
+        PendingConsensusUpdate.objects.update(dirty_since=timezone.now() - timedelta(seconds=60))
+        refresh_if_stale = PendingConsensusUpdate.objects.refresh_if_stale
+        with patch.object(PendingConsensusUpdate.objects, 'refresh_if_stale', wraps=refresh_if_stale) as refresh:
+            self.getView(p)
+        # checked once per request, by the conditional page check
+        self.assertTrue(refresh.call_count == 1)
+        self.assertTrue(p.current_consensus == pc1)
+        self.assertTrue(PendingConsensusUpdate.objects.count() == 0)
+
+    def getView(self, proposal):
+        request = self.factory.get('/')
+        request.user = self.user
+        return ProposalView.as_view()(request, proposal_id=proposal.id)
+
+    @override_settings(CONSENSUS_WRITE_BEHIND=False)
+    def test_synchronous_when_disabled(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        self.assertTrue(p.current_consensus == pc1)
+        self.assertTrue(PendingConsensusUpdate.objects.count() == 0)
+        self.assertFalse(PendingConsensusUpdate.objects.refresh_if_stale(p))
@@ -1,3 +1,5 @@
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
 
 from .mixins import TwoUserMixin, ProposalMixin
@@ -57,9 +59,9 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(isinstance(v, ChoiceTicket))
         self.assertTrue(w.total_votes == 1)
         # change votes - change current
-        _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current = False
         v.save()
+        _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(w.total_votes == 1)
         # create a vote by another user and test that we have two votes
         _ = ChoiceTicket.objects.create(user=self.user2,
@@ -79,9 +81,9 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(isinstance(v, ChoiceTicket))
         self.assertTrue(w.total_votes == 1)
         # change votes - change current
-        _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         v.current = False
         v.save()
+        _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(), proposal_choice=pc2, current=True)
         self.assertTrue(w.total_votes == 1)
         # create a vote by another user and test that we have two votes
         _ = ChoiceTicket.objects.create(user=self.user2, date_chosen=timezone.now(), proposal_choice=pc1, current=True)
@@ -192,6 +194,28 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
         self.assertTrue(pc1.current_consensus is False)
         self.assertTrue(pc2.current_consensus is False)
 
+    def test_determine_consensus_query_count(self):
+        # the number of queries must not depend on the number of choices
+        p = self.create_new_proposal()
+        p.populate_from_template(ChoiceTemplates.genericYesNo)
+        p.publish()
+        p2 = self.create_new_proposal()
+        p2.populate_from_template(ChoiceTemplates.generic1to5)
+        p2.publish()
+        for proposal in (p, p2):
+            pc = proposal.get_active_choices().first()
+            _ = ChoiceTicket.objects.create(user=self.user, date_chosen=timezone.now(),
+                                            proposal_choice=pc, current=True)
+            # tally query, savepoint, set new consensus, clear previous consensus,
+            # mark the proposal and its group changed, release savepoint
+            with self.assertNumQueries(7):
+                c = proposal.determine_consensus()
+            self.assertTrue(c.id == pc.id and c.current_consensus is True)
+            # no changes needed
+            with self.assertNumQueries(1):
+                proposal.determine_consensus()
+            self.assertTrue(ProposalChoice.objects.filter(proposal=proposal, current_consensus=True).count() == 1)
+
     def test_populate_proposal_from_template(self):
         p = self.create_new_proposal()
         self.populate_from_template(p, ChoiceTemplates.genericMoscow)
@@ -242,6 +266,40 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
                 self.assertTrue(s2[c2]['count'] == 0)
                 self.assertTrue(s2[c2]['percentage'] == 0)
 
+    def test_voting_spread_cache(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.trial()
+        pc1, pc2 = p.get_active_choices()
+        s = p.get_voting_spread()
+        # repeated reads come from the cache
+        with self.assertNumQueries(0):
+            self.assertTrue(p.get_voting_spread() == s)
+        # a vote invalidates the cached spread
+        pc1.vote(self.user)
+        self.assertTrue(p.get_voting_spread()[pc1.id]['count'] == 1)
+        pc2.vote(self.user)
+        self.assertTrue(p.get_voting_spread()[pc1.id]['count'] == 0)
+        self.assertTrue(p.get_voting_spread()[pc2.id]['count'] == 1)
+        # as does editing and deleting a choice
+        pc2.text = "Changed"
+        pc2.save()
+        self.assertTrue(p.get_voting_spread()[pc2.id]['text'] == "Changed")
+        pc1.delete()
+        self.assertTrue(pc1.id not in p.get_voting_spread())
+        # and a state change, which reports the votes for the new state
+        p.publish()
+        self.assertTrue(p.get_voting_spread()[pc2.id]['count'] == 0)
+
+    def test_benchmark_proposal_view_command(self):
+        out = StringIO()
+        call_command('benchmark_proposal_view', '--users=3', '--choices=2', '--reads=3', stdout=out)
+        # the repeated reads after the first take the same number of queries
+        for line in out.getvalue().splitlines()[:2]:
+            reads = line.split(': ')[1].split(', ')
+            self.assertTrue(len(set(reads[1:])) == 1 and int(reads[1]) < int(reads[0]))
+        # the seeded data is rolled back
+        self.assertTrue(Proposal.objects.filter(proposal_name='benchmark').count() == 0)
+
     def test_proposal_state(self):
         # change the state and check the value
         p = self.create_new_proposal()
@@ -391,6 +449,39 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
         with self.assertRaises(ProposalStateInvalid):
             p4.hold()
 
+    def test_bulk_transition(self):
+        pg = ProposalGroup.objects.create(group_name="test group", owned_by=self.user)
+        pg.join_group(self.user)
+        pg.join_group(self.user2)
+        draft = self.create_new_proposal(proposal_group=pg)
+        published = [self.create_proposal_with_two_proposal_choices(proposal_group=pg) for _ in range(3)]
+        for proposal in published:
+            proposal.publish()
+            proposal.proposalchoice_set.first().vote(self.user2)
+        archived = self.create_new_proposal(proposal_group=pg)
+        archived.archive()
+        self.assertTrue(pg.get_members().get(user=self.user2).pending_votes == 0)
+        # one update per state moved from, the archived proposal cannot move
+        moved, rejected = Proposal.objects.transition(Proposal.objects.filter(proposal_group=pg),
+                                                      ProposalState.ON_HOLD)
+        self.assertTrue(set(moved) == {draft.id} | {proposal.id for proposal in published})
+        self.assertTrue(rejected == [archived.id])
+        self.assertTrue(Proposal.objects.filter(proposal_group=pg, state=ProposalState.ON_HOLD).count() == 4)
+        moved, rejected = Proposal.objects.transition(Proposal.objects.filter(proposal_group=pg),
+                                                      ProposalState.PUBLISHED)
+        self.assertTrue(len(moved) == 4 and rejected == [archived.id])
+        # the published proposals count for the members again
+        self.assertTrue(pg.get_members().get(user=self.user).pending_votes == 4)
+        # archiving seals each proposal
+        moved, rejected = Proposal.objects.transition(Proposal.objects.filter(id__in=[p.id for p in published]),
+                                                      ProposalState.ARCHIVED)
+        self.assertTrue(len(moved) == 3 and rejected == [])
+        for proposal in published:
+            proposal = Proposal.objects.get(pk=proposal.id)
+            self.assertTrue(proposal.state == ProposalState.ARCHIVED)
+            self.assertTrue(proposal.sealed_result.total_voters == 1)
+        self.assertTrue(pg.get_members().get(user=self.user).pending_votes == 1)
+
     def test_can_vote_no_group(self):
         p = self.create_new_proposal()
         self.assertFalse(p.can_vote(self.user))
@@ -407,3 +498,30 @@ class ProposalTest(TwoUserMixin, ProposalMixin, TestCase):
         p.archive()
         self.assertFalse(p.can_vote(self.user))
         self.assertFalse(p.can_vote(self.user2))
+
+    def test_owned_with_votes(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        proposal = Proposal.objects.owned_with_votes(self.user).get(id=p.id)
+        self.assertTrue(proposal['total_votes'] == 0)
+        self.assertTrue(proposal['consensus_text'] is None)
+        self.assertTrue(proposal['my_vote'] is None)
+        pc1.vote(self.user)
+        pc2.vote(self.user2)
+        pc1.vote(self.user2)
+        proposal = Proposal.objects.owned_with_votes(self.user).get(id=p.id)
+        self.assertTrue(proposal['total_votes'] == p.get_total_votes() == 2)
+        self.assertTrue(proposal['consensus_text'] == p.current_consensus.text == pc1.text)
+        self.assertTrue(proposal['my_vote'] == pc1.text)
+        # on hold proposals report the published votes
+        p.hold()
+        proposal = Proposal.objects.owned_with_votes(self.user, states={ProposalState.ON_HOLD}).get(id=p.id)
+        self.assertTrue(proposal['total_votes'] == 2)
+        # votes for a deactivated choice are not counted
+        pc1.deactivated_date = timezone.now()
+        pc1.save()
+        proposal = Proposal.objects.owned_with_votes(self.user, states={ProposalState.ON_HOLD}).get(id=p.id)
+        self.assertTrue(proposal['total_votes'] == 0)
+        self.assertTrue(proposal['consensus_text'] is None)
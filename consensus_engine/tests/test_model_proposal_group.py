@@ -1,9 +1,15 @@
 from django.test import TestCase
-from django.db import DataError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from django.db import DataError, connection
+from django.test.utils import CaptureQueriesContext
 from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalTestHelper
-from consensus_engine.models import ProposalGroup, Proposal, ChoiceTicket, ProposalChoice
+from consensus_engine.models import ProposalGroup, Proposal, ChoiceTicket, ProposalChoice, GroupMembership
+from consensus_engine.models import ConsensusHistory, ConsensusRollup
 from django.core.exceptions import PermissionDenied
-from consensus_engine.utils import ProposalState
+from consensus_engine.utils import ProposalState, RollupPeriod
+from consensus_engine.memberships import request_memberships
 from django.utils import timezone
 
 
@@ -108,6 +114,49 @@ class ProposalGroupTest(TwoUserMixin, ProposalGroupMixin, TestCase):
         self.assertTrue(len(ml2) == 1)
         self.assertTrue(ml.first().id == self.user.id)
 
+    def test_remove_group_member_recomputes_consensus(self):
+        pg = self.create_proposal_group()
+        pg.join_group(self.user2, can_trial=True)
+        p1 = ProposalTestHelper.new_proposal_with_two_choices(owned_by=self.user, proposal_group=pg)
+        p1.publish()
+        p2 = ProposalTestHelper.new_proposal_with_two_choices(owned_by=self.user, proposal_group=pg)
+        p2.publish()
+        yes1, no1 = p1.get_active_choices().order_by('id')
+        yes2, _ = p2.get_active_choices().order_by('id')
+        no1.vote(self.user2)
+        yes2.vote(self.user2)
+        yes2.vote(self.user)
+        self.assertTrue(p1.current_consensus == no1 and p2.current_consensus == yes2)
+        history_count = ConsensusHistory.objects.count()
+        pg.remove_member(self.user2)
+        # p1 has no votes left and p2 keeps its consensus from the other vote
+        self.assertTrue(p1.current_consensus is None and p2.current_consensus == yes2)
+        self.assertFalse(ProposalChoice.objects.get(pk=no1.id).current_consensus)
+        self.assertTrue(ConsensusHistory.objects.count() == history_count + 2)
+        latest = ConsensusHistory.objects.filter(proposal=p2).latest('snapshot_date')
+        self.assertTrue(latest.consensus == yes2)
+        self.assertTrue({item['choice_id']: item['count'] for item in latest.get_consensus_data()}[yes2.id] == 1)
+        rollup = ConsensusRollup.objects.get(proposal=p1, period=RollupPeriod.DAY)
+        self.assertTrue(rollup.consensus is None and rollup.snapshot_date == latest.snapshot_date)
+        self.assertTrue(p1.get_voting_spread()[no1.id]['count'] == 0)
+
+    def test_remove_group_member_statements_bounded(self):
+        def remove_member_queries(proposal_count):
+            pg = self.create_proposal_group(group_name="group of {}".format(proposal_count))
+            pg.join_group(self.user2)
+            for _ in range(proposal_count):
+                p = ProposalTestHelper.new_proposal_with_two_choices(owned_by=self.user, proposal_group=pg)
+                p.publish()
+                p.get_active_choices().first().vote(self.user2)
+            with CaptureQueriesContext(connection) as queries:
+                pg.remove_member(self.user2)
+            self.assertTrue(ChoiceTicket.objects.filter(proposal__proposal_group=pg, current=True).count() == 0)
+            self.assertTrue(ProposalChoice.objects.filter(proposal__proposal_group=pg,
+                                                          current_consensus=True).count() == 0)
+            return len(queries)
+        # the same statements however many proposals the member voted in
+        self.assertTrue(remove_member_queries(3) == remove_member_queries(30))
+
     def test_can_vote_group_no_user2(self):
         pg, p = self.create_proposal_group_with_test_proposal()
         self.assertFalse(p.can_vote(self.user))
@@ -307,6 +356,44 @@ class ProposalGroupTest(TwoUserMixin, ProposalGroupMixin, TestCase):
         with self.assertRaises(DataError, msg="No default data found"):
             p.publish()
 
+    def test_propagate_default_choices(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p.publish(default_group_to_these_choices=True)
+        pg.refresh_from_db()
+        drafts = [ProposalTestHelper.new_proposal_with_two_choices(proposal_group=pg, owned_by=self.user,
+                                                                   proposal_choice_1_name="Maybe",
+                                                                   proposal_choice_2_name="Never")
+                  for _ in range(3)]
+        trial = ProposalTestHelper.new_proposal(proposal_group=pg, owned_by=self.user)
+        trial.trial()
+        published = pg.propagate_default_choices()
+        self.assertTrue({proposal.id for proposal in published} == {draft.id for draft in drafts})
+        for draft in drafts:
+            draft.refresh_from_db()
+            self.assertTrue(draft.state == ProposalState.PUBLISHED)
+            self.assertTrue(sorted(draft.get_active_choices().values_list('text', flat=True)) == ["No", "Yes"])
+            self.assertTrue(ProposalChoice.objects.filter(proposal=draft, deactivated_date__isnull=False).count() == 2)
+        self.assertTrue(Proposal.objects.get(pk=trial.id).state == ProposalState.TRIAL)
+        with self.assertRaises(DataError):
+            pg.propagate_default_choices([trial])
+        pg2 = self.create_proposal_group(group_name="no defaults")
+        with self.assertRaises(DataError):
+            pg2.propagate_default_choices()
+
+    def test_replace_choices_statements(self):
+        pg = self.create_proposal_group()
+
+        def replace_choices_queries(proposal_count):
+            proposals = [ProposalTestHelper.new_proposal_with_two_choices(proposal_group=pg, owned_by=self.user)
+                         for _ in range(proposal_count)]
+            with CaptureQueriesContext(connection) as queries:
+                ProposalChoice.objects.replace_choices(proposals, [("A", 1), ("B", 2), ("C", 3)])
+            self.assertTrue(ProposalChoice.objects.filter(proposal__in=proposals,
+                                                          deactivated_date__isnull=True).count() == proposal_count * 3)
+            return len(queries)
+        # one update and one bulk_create however many proposals
+        self.assertTrue(replace_choices_queries(1) == replace_choices_queries(10))
+
     def test_try_to_default_with_published_proposals(self):
         pg, p = self.create_proposal_group_with_test_proposal()
         p.publish(default_group_to_these_choices=True)
@@ -382,3 +469,88 @@ class ProposalGroupTest(TwoUserMixin, ProposalGroupMixin, TestCase):
               assertRaises(DataError,
                            msg="Cannot get group statistics for a group that doesn't have a default set of choices.")):
             self.helper_get_group_statistics(pg)
+
+    def test_pending_votes_counters(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p2 = ProposalTestHelper.new_proposal_with_two_choices(proposal_group=pg, owned_by=self.user)
+        p.publish()
+        p2.publish()
+
+        def counters():
+            return {group['id']: group['propcount'] for group in ProposalGroup.objects.groups_for_member(self.user)}
+
+        self.assertTrue(counters() == {pg.id: 2})
+        # joining counts the proposals already published
+        pg.join_group(self.user2)
+        self.assertTrue(GroupMembership.objects.get(group=pg, user=self.user2).pending_votes == 2)
+        # voting
+        p.proposalchoice_set.first().vote(self.user)
+        self.assertTrue(counters() == {pg.id: 1})
+        p.proposalchoice_set.last().vote(self.user)
+        self.assertTrue(counters() == {pg.id: 1})
+        # deactivating the voted choice
+        choice = p.proposalchoice_set.last()
+        choice.deactivated_date = timezone.now()
+        choice.save()
+        self.assertTrue(counters() == {pg.id: 2})
+        # deleting the voted choice
+        choice = p2.proposalchoice_set.first()
+        choice.vote(self.user)
+        self.assertTrue(counters() == {pg.id: 1})
+        choice.delete()
+        self.assertTrue(counters() == {pg.id: 2})
+        self.assertTrue(ProposalGroup.objects.pending_votes_mismatches([self.user, self.user2]) == [])
+        # state changes and moving group
+        p2.hold()
+        self.assertTrue(counters() == {pg.id: 1})
+        pg2 = self.create_proposal_group(group_name="second group")
+        p.proposal_group = pg2
+        p.save()
+        self.assertTrue(counters() == {pg.id: 0, pg2.id: 1})
+        p.delete()
+        self.assertTrue(counters() == {pg.id: 0, pg2.id: 0})
+        self.assertTrue(ProposalGroup.objects.pending_votes_mismatches([self.user, self.user2]) == [])
+        # the sidebar is a scan of the user's membership rows
+        with self.assertNumQueries(1):
+            list(ProposalGroup.objects.groups_for_member(self.user))
+
+    def test_request_memberships(self):
+        pg = self.create_proposal_group()
+        pg2 = self.create_proposal_group(group_name="second group", owned_by=self.user2)
+        p = ProposalTestHelper.new_proposal_with_two_choices(owned_by=self.user2, proposal_group=pg2)
+        p.publish()
+        with request_memberships(self.user):
+            # one load for every check in the request
+            with self.assertNumQueries(1):
+                self.assertTrue(pg.is_user_member(self.user))
+                self.assertTrue(pg.is_user_part_of_trial(self.user))
+                self.assertFalse(pg2.is_user_member(self.user))
+                self.assertFalse(p.can_vote(self.user))
+            # the checks for other users still query
+            with self.assertNumQueries(1):
+                self.assertTrue(pg2.is_user_member(self.user2))
+            # and joining a group is seen by the rest of the request
+            pg2.join_group(self.user)
+            self.assertTrue(pg2.is_user_member(self.user) and p.can_vote(self.user))
+            self.assertFalse(pg2.is_user_part_of_trial(self.user))
+            pg2.remove_member(self.user)
+            self.assertFalse(pg2.is_user_member(self.user))
+        # outside of a request the checks query
+        with self.assertNumQueries(1):
+            self.assertTrue(pg.is_user_member(self.user))
+
+    def test_verify_pending_votes_command(self):
+        out = StringIO()
+        call_command('verify_pending_votes', '--seed', '--users=8', '--proposals=6', stdout=out)
+        self.assertTrue('Checked 8 users, 0 mismatched counters.' in out.getvalue())
+        # the seeded data is rolled back
+        self.assertTrue(Proposal.objects.filter(proposal_name__startswith='verify').count() == 0)
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p.publish()
+        GroupMembership.objects.filter(group=pg).update(pending_votes=5)
+        with self.assertRaises(CommandError):
+            call_command('verify_pending_votes', stdout=StringIO())
+        out = StringIO()
+        call_command('verify_pending_votes', '--repair', stdout=out)
+        self.assertTrue('counter 5, expected 1' in out.getvalue())
+        self.assertTrue(GroupMembership.objects.get(group=pg, user=self.user).pending_votes == 1)
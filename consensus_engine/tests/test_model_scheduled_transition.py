@@ -0,0 +1,127 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from consensus_engine.models import Proposal, ProposalChoice, ScheduledTransition, SealedTally
+from consensus_engine.utils import ProposalState
+from consensus_engine.exceptions import ProposalStateInvalid
+
+
+# models test
+class ScheduledTransitionTest(TwoUserMixin, ProposalGroupMixin, ProposalMixin, TestCase):
+
+    def test_schedule(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        due = timezone.now() + timedelta(days=1)
+        p.publish_at(due)
+        p.archive_at(due + timedelta(days=7))
+        # rescheduling a state moves its due date
+        p.publish_at(due + timedelta(hours=1))
+        self.assertTrue(ScheduledTransition.objects.filter(proposal=p).count() == 2)
+        self.assertTrue(ScheduledTransition.objects.get(proposal=p, state=ProposalState.PUBLISHED).due_date
+                        == due + timedelta(hours=1))
+        with self.assertRaises(ProposalStateInvalid):
+            ScheduledTransition.objects.schedule(p, ProposalState.TRIAL, due)
+        # nothing is due yet
+        self.assertTrue(ScheduledTransition.objects.process() == ([], []))
+        self.assertTrue(Proposal.objects.get(pk=p.id).state == ProposalState.DRAFT)
+
+    def test_process_due(self):
+        now = timezone.now()
+        published = [self.create_proposal_with_two_proposal_choices() for _ in range(5)]
+        for proposal in published:
+            proposal.publish()
+            proposal.proposalchoice_set.first().vote(self.user)
+            proposal.archive_at(now)
+        drafts = [self.create_proposal_with_two_proposal_choices() for _ in range(3)]
+        for proposal in drafts:
+            proposal.publish_at(now - timedelta(minutes=1))
+            proposal.hold_at(now)
+        later = self.create_proposal_with_two_proposal_choices()
+        later.publish_at(now + timedelta(minutes=1))
+        # archived by hand before it was due
+        archived = self.create_proposal_with_two_proposal_choices()
+        archived.hold_at(now)
+        archived.archive()
+        moved, rejected = ScheduledTransition.objects.process(batch_size=4, now=now)
+        self.assertTrue(rejected == [archived.id])
+        self.assertTrue(len(moved) == 5 + 3 + 3)
+        for proposal in published:
+            self.assertTrue(Proposal.objects.get(pk=proposal.id).state == ProposalState.ARCHIVED)
+            self.assertTrue(SealedTally.objects.get(proposal=proposal).total_voters == 1)
+        # published then held
+        for proposal in drafts:
+            self.assertTrue(Proposal.objects.get(pk=proposal.id).state == ProposalState.ON_HOLD)
+        self.assertTrue(Proposal.objects.get(pk=later.id).state == ProposalState.DRAFT)
+        self.assertTrue(list(ScheduledTransition.objects.values_list('proposal_id', flat=True)) == [later.id])
+
+    def test_publish_takes_group_default_choices(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p.publish(default_group_to_these_choices=True)
+        p2 = self.create_proposal_with_two_proposal_choices(proposal_group=pg, proposal_choice_1_name="Maybe",
+                                                            proposal_choice_2_name="Never")
+        p2.publish_at(timezone.now())
+        moved, rejected = ScheduledTransition.objects.process()
+        self.assertTrue(moved == [p2.id] and rejected == [])
+        self.assertTrue(sorted(ProposalChoice.objects.filter(proposal=p2, deactivated_date__isnull=True)
+                                                     .values_list('text', flat=True)) == ["No", "Yes"])
+
+    def test_process_order_does_not_depend_on_batch_size(self):
+        now = timezone.now()
+        for batch_size in (1, 10):
+            at_once = self.create_proposal_with_two_proposal_choices()
+            at_once.hold_at(now)
+            at_once.publish_at(now)
+            # held first, then published later
+            in_turn = self.create_proposal_with_two_proposal_choices()
+            in_turn.publish_at(now)
+            in_turn.hold_at(now - timedelta(minutes=1))
+            ScheduledTransition.objects.process(batch_size=batch_size, now=now)
+            self.assertTrue(Proposal.objects.get(pk=at_once.id).state == ProposalState.ON_HOLD)
+            self.assertTrue(Proposal.objects.get(pk=in_turn.id).state == ProposalState.PUBLISHED)
+
+    def test_rejected_publish_keeps_choices(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        p.publish(default_group_to_these_choices=True)
+        archived = self.create_proposal_with_two_proposal_choices(proposal_group=pg, proposal_choice_1_name="Maybe",
+                                                                  proposal_choice_2_name="Never")
+        archived.publish_at(timezone.now())
+        archived.archive()
+        moved, rejected = ScheduledTransition.objects.process()
+        self.assertTrue(moved == [] and rejected == [archived.id])
+        self.assertTrue(sorted(ProposalChoice.objects.filter(proposal=archived, deactivated_date__isnull=True)
+                                                     .values_list('text', flat=True)) == ["Maybe", "Never"])
+
+    def test_publish_with_default_choices(self):
+        pg, p = self.create_proposal_group_with_test_proposal()
+        held = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        held.publish()
+        held.hold()
+        p.publish_at(timezone.now(), default_group_to_these_choices=True)
+        # holding is never a default choices publish
+        held.hold_at(timezone.now() + timedelta(days=1))
+        self.assertFalse(ScheduledTransition.objects.get(proposal=held).default_choices)
+        moved, rejected = ScheduledTransition.objects.process()
+        self.assertTrue(moved == [p.id] and rejected == [])
+        pg.refresh_from_db()
+        self.assertTrue(pg.group_default_choices)
+        self.assertTrue(Proposal.objects.get(pk=p.id).state == ProposalState.PUBLISHED)
+        self.assertTrue(Proposal.objects.get(pk=held.id).state == ProposalState.ARCHIVED)
+        # a group with published proposals cannot take the defaults
+        p2 = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p2.publish_at(timezone.now(), default_group_to_these_choices=True)
+        moved, rejected = ScheduledTransition.objects.process()
+        self.assertTrue(moved == [] and rejected == [p2.id])
+        self.assertTrue(Proposal.objects.get(pk=p2.id).state == ProposalState.DRAFT)
+
+    def test_process_scheduled_transitions_command(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish_at(timezone.now())
+        out = StringIO()
+        call_command('process_scheduled_transitions', '--once', stdout=out)
+        self.assertTrue('Applied 1 scheduled transitions, rejected 0.' in out.getvalue())
+        self.assertTrue(Proposal.objects.get(pk=p.id).state == ProposalState.PUBLISHED)
+        self.assertTrue(ScheduledTransition.objects.count() == 0)
@@ -0,0 +1,99 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.template import Context, Template
+from io import StringIO
+
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from consensus_engine.caching import spread_cache
+from consensus_engine.models import ChoiceVoteCount, ConsensusHistory, Proposal, SealedTally
+from consensus_engine.utils import ProposalState
+
+
+# models test
+class SealedTallyTest(TwoUserMixin, ProposalGroupMixin, ProposalMixin, TestCase):
+
+    def create_voted_proposal(self, **kwargs):
+        p = self.create_proposal_with_two_proposal_choices(**kwargs)
+        p.publish()
+        pc1, pc2 = p.get_active_choices()
+        pc1.vote(self.user)
+        pc1.vote(self.user2)
+        return p, pc1, pc2
+
+    def test_archive_seals(self):
+        p, pc1, pc2 = self.create_voted_proposal()
+        self.assertTrue(SealedTally.objects.count() == 0)
+        p.archive()
+        tally = SealedTally.objects.get(proposal=p)
+        self.assertTrue(tally.consensus == pc1 and tally.consensus_text == "Yes")
+        self.assertTrue(tally.total_voters == 2 and tally.total_votes == 2)
+        self.assertTrue(tally.get_spread()[pc1.id]['count'] == 2)
+        self.assertTrue(tally.get_spread()[pc2.id]['percentage'] == 0)
+        # with a full history keyframe
+        self.assertTrue(tally.final_history.keyframe is None)
+        self.assertTrue(tally.final_history == ConsensusHistory.objects.filter(proposal=p).latest('snapshot_date'))
+
+    def test_bulk_archive_seals(self):
+        def archive(count):
+            proposals = [self.create_voted_proposal()[0] for _ in range(count)]
+            queries = CaptureQueriesContext(connection)
+            with queries:
+                Proposal.objects.transition(Proposal.objects.filter(id__in=[p.id for p in proposals]),
+                                            ProposalState.ARCHIVED)
+            return proposals, len(queries)
+        _, few_queries = archive(1)
+        proposals, many_queries = archive(4)
+        # sealing does not cost more statements for more proposals
+        self.assertTrue(few_queries == many_queries)
+        for p in proposals:
+            pc1, pc2 = p.get_active_choices()
+            tally = SealedTally.objects.get(proposal=p)
+            self.assertTrue(tally.consensus == pc1 and tally.consensus_text == "Yes")
+            self.assertTrue(tally.total_voters == 2 and tally.total_votes == 2)
+            self.assertTrue(tally.get_spread() == {pc1.id: {'text': "Yes", 'count': 2, 'percentage': 100.0},
+                                                   pc2.id: {'text': "No", 'count': 0, 'percentage': 0}})
+            self.assertTrue(tally.final_history == ConsensusHistory.objects.filter(proposal=p).latest('id'))
+            self.assertTrue(tally.final_history.get_consensus_data()[0]['count'] == 2)
+
+    def test_reads_from_sealed_tally(self):
+        pg = self.create_proposal_group()
+        pg.join_group(self.user2)
+        p, pc1, pc2 = self.create_voted_proposal(proposal_group=pg)
+        p.archive()
+        spread = p.get_voting_spread()
+        # the counters no longer matter once sealed
+        ChoiceVoteCount.objects.filter(proposal_choice__proposal=p).update(count=0)
+        pc1.current_consensus = False
+        pc1.save()
+        spread_cache.invalidate(p.id)
+        p = Proposal.objects.get(pk=p.id)
+        # the sealed tally and its consensus choice
+        with self.assertNumQueries(2):
+            self.assertTrue(p.get_voting_spread() == spread)
+            self.assertTrue(p.total_votes == 2 and p.get_total_votes() == 2)
+            self.assertTrue(p.current_consensus == pc1)
+        listed = Proposal.objects.in_group_with_votes(pg, self.user, states={ProposalState.ARCHIVED})
+        self.assertTrue(listed[0]['total_votes'] == 2 and listed[0]['consensus_text'] == "Yes")
+        html = Template('{% load proposaltags %}{% current_consensus proposal_id %}').render(
+            Context({'proposal_id': p.id}))
+        self.assertTrue(html.strip() == "Yes")
+
+    def test_seal_archived_command(self):
+        p1, _, _ = self.create_voted_proposal()
+        p1.archive()
+        p2, _, _ = self.create_voted_proposal()
+        p2.archive()
+        p3, _, _ = self.create_voted_proposal()
+        # archived before sealing existed
+        SealedTally.objects.all().delete()
+        out = StringIO()
+        call_command('seal_archived_proposals', '--batch-size=1', stdout=out)
+        self.assertTrue(set(SealedTally.objects.values_list('proposal_id', flat=True)) == {p1.id, p2.id})
+        self.assertTrue('Sealed 2 archived proposals in total.' in out.getvalue())
+        call_command('seal_archived_proposals', stdout=out)
+        self.assertTrue('Sealed 0 archived proposals in total.' in out.getvalue())
+        call_command('seal_archived_proposals', '--reseal', stdout=out)
+        self.assertTrue(out.getvalue().endswith('Sealed 2 archived proposals in total.\n'))
+        self.assertTrue(SealedTally.objects.count() == 2)
@@ -3,6 +3,8 @@ from .mixins import OneUserMixin, ProposalMixin, TemplateViewMixin
 
 from consensus_engine.views import StateView, StateChangeConfirmationView
 from consensus_engine.utils import ProposalState
+from consensus_engine.models import ScheduledTransition
+from django.utils import timezone
 
 
 class StateViewTest(OneUserMixin, TestCase,
@@ -68,3 +70,32 @@ class StateChangeConfirmationViewTest(OneUserMixin, TestCase,
                                                        'next_state': ProposalState.ARCHIVED}, postargs={'state': '1'})
         p.refresh_from_db()
         self.assertTrue(p.current_state == ProposalState.ARCHIVED)
+
+    def test_schedule_change_state(self):
+        p = self.create_new_proposal()
+        _, post_request = self.executeView(viewkwargs={'proposal_id': p.id, 'current_state': p.current_state,
+                                                       'next_state': ProposalState.PUBLISHED},
+                                           postargs={'due_date': '2030-01-31T23:59'})
+        p.refresh_from_db()
+        # scheduled, not changed
+        self.assertTrue(p.current_state == ProposalState.DRAFT)
+        self.assertTrue(post_request.url == '/consensus/proposals/{}/'.format(p.id))
+        transition = ScheduledTransition.objects.get(proposal=p)
+        self.assertTrue(transition.state == ProposalState.PUBLISHED)
+        self.assertTrue(timezone.localtime(transition.due_date).strftime('%Y-%m-%d %H:%M') == '2030-01-31 23:59')
+        # trials happen straight away
+        _, response = self.executeView(viewkwargs={'proposal_id': p.id, 'current_state': p.current_state,
+                                                   'next_state': ProposalState.TRIAL},
+                                       postargs={'due_date': '2030-01-31T23:59'})
+        response.render()
+        self.assertTrue(str(response.content).find("Only publishing, holding and archiving can be scheduled") > 0)
+        # rendered with the same context as the confirmation page
+        self.assertTrue(response.context_data['proposal'] == p)
+        self.assertTrue(response.context_data['next_state'] == ProposalState.TRIAL)
+        self.assertTrue(ScheduledTransition.objects.count() == 1)
+        self.assertFalse(transition.default_choices)
+        # the default choices option is kept for the scheduled publish
+        self.executeView(viewkwargs={'proposal_id': p.id, 'current_state': p.current_state,
+                                     'next_state': ProposalState.PUBLISHED},
+                         postargs={'due_date': '2030-01-31T23:59', 'default_choices': 'on'})
+        self.assertTrue(ScheduledTransition.objects.get(proposal=p).default_choices)
@@ -0,0 +1,63 @@
+from django.test import TestCase, RequestFactory
+from django.core.exceptions import PermissionDenied
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from consensus_engine.views import CloseOutGroupView
+from consensus_engine.models import Proposal, SealedTally
+from consensus_engine.utils import ProposalState
+
+
+class CloseOutGroupViewTest(TwoUserMixin, TestCase,
+                            ProposalGroupMixin, ProposalMixin):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TwoUserMixin.setUp(self)
+
+    def post_request(self, pg, user=None, **data):
+        request = self.factory.post('/', data)
+        request.user = user or self.user
+        return request
+
+    def create_group_proposals(self):
+        pg = self.create_proposal_group()
+        pg.join_group(self.user2)
+        draft = self.create_new_proposal(proposal_group=pg)
+        published = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        published.publish()
+        published.proposalchoice_set.first().vote(self.user2)
+        return pg, draft, published
+
+    def test_close_out_group_archive(self):
+        pg, draft, published = self.create_group_proposals()
+        request = self.factory.get('/')
+        request.user = self.user
+        context = CloseOutGroupView.as_view()(request, proposal_group_id=pg.id).context_data
+        self.assertTrue(context['archive_count'] == 2 and context['hold_count'] == 1)
+        response = CloseOutGroupView.as_view()(self.post_request(pg, okay_btn='Okay', state=4),
+                                               proposal_group_id=pg.id)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'Archived 2 proposals.' in response.content)
+        self.assertTrue(Proposal.objects.filter(proposal_group=pg, state=ProposalState.ARCHIVED).count() == 2)
+        self.assertTrue(SealedTally.objects.get(proposal=published).total_voters == 1)
+
+    def test_close_out_group_hold(self):
+        pg, draft, published = self.create_group_proposals()
+        response = CloseOutGroupView.as_view()(self.post_request(pg, okay_btn='Okay', state=3),
+                                               proposal_group_id=pg.id)
+        self.assertTrue(b'Put on hold 1 proposals.' in response.content)
+        self.assertTrue(Proposal.objects.get(pk=published.id).state == ProposalState.ON_HOLD)
+        self.assertTrue(Proposal.objects.get(pk=draft.id).state == ProposalState.DRAFT)
+
+    def test_close_out_group_cancel(self):
+        pg, draft, published = self.create_group_proposals()
+        response = CloseOutGroupView.as_view()(self.post_request(pg, cancel_btn='Cancel', state=4),
+                                               proposal_group_id=pg.id)
+        self.assertTrue(response.status_code == 302)
+        self.assertTrue(Proposal.objects.get(pk=published.id).state == ProposalState.PUBLISHED)
+
+    def test_close_out_group_not_owner(self):
+        pg, draft, published = self.create_group_proposals()
+        with self.assertRaises(PermissionDenied):
+            CloseOutGroupView.as_view()(self.post_request(pg, user=self.user2, okay_btn='Okay', state=4),
+                                        proposal_group_id=pg.id)
+        self.assertTrue(Proposal.objects.get(pk=published.id).state == ProposalState.PUBLISHED)
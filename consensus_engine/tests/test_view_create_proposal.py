@@ -1,5 +1,7 @@
 from django.test import TestCase, RequestFactory
-from .mixins import TwoUserMixin, ProposalGroupMixin, ViewMixin
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from .mixins import TwoUserMixin, ProposalGroupMixin, ViewMixin, membership_reads
 from django.utils import timezone
 
 from consensus_engine.views import CreateProposalView
@@ -59,3 +61,13 @@ class CreateProposalViewTest(TwoUserMixin, TestCase,
             self.getValidView(data={'proposal_name': 'test proposal',
                               'proposal_description': 'test description'},
                               viewkwargs={'proposal_group_id': pg.id}, postargs={'options': '0'})
+
+    def test_create_proposal_within_group_reads_memberships_once(self):
+        pg = self.create_proposal_group()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/proposalgroups/{}/proposals/new/'.format(pg.id),
+                             {'proposal_name': 'test proposal', 'proposal_description': 'test description',
+                              'options': '2'})
+        self.assertTrue(Proposal.objects.filter(proposal_name='test proposal', proposal_group=pg).count() == 1)
+        self.assertTrue(len(membership_reads(queries, self.user)) == 1)
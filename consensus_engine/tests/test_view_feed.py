@@ -0,0 +1,118 @@
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+import json
+import threading
+
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin
+from consensus_engine.views import ProposalFeedView, GroupFeedView, ProposalView
+from consensus_engine.live_feed import hub, PollingBridge
+
+
+class FeedHubTest(TwoUserMixin, TestCase, ProposalGroupMixin, ProposalMixin):
+
+    def test_coalesce_changes(self):
+        subscriber = hub.subscribe(['proposal:1'])
+        try:
+            # a burst of changes is sent once
+            for _ in range(5):
+                hub.publish([(1, None), (2, None)])
+            self.assertTrue(subscriber.wait(1, 0) == {1})
+            self.assertTrue(subscriber.wait(0, 0) == set())
+            # changes arriving in the coalescing window are sent with the first
+            timer = threading.Timer(0.05, hub.publish, [[(1, None)]])
+            timer.start()
+            hub.publish([(1, None)])
+            self.assertTrue(subscriber.wait(1, 0.2) == {1})
+            self.assertTrue(subscriber.wait(0, 0) == set())
+        finally:
+            hub.unsubscribe(subscriber)
+        self.assertTrue(subscriber not in hub.subscribers)
+
+    def test_group_channel(self):
+        subscriber = hub.subscribe(['group:7'])
+        try:
+            hub.publish([(1, 7), (2, 8), (3, 7), (4, None)])
+            self.assertTrue(subscriber.wait(0, 0) == {1, 3})
+        finally:
+            hub.unsubscribe(subscriber)
+
+    def test_polling_bridge(self):
+        pg = self.create_proposal_group()
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+        subscriber = hub.subscribe(['group:{}'.format(pg.id)])
+        try:
+            bridge = PollingBridge(hub, 1)
+            bridge.poll()
+            subscriber.wait(0, 0)
+            # nothing new since the last poll
+            self.assertTrue(bridge.poll() == 0)
+            p.proposalchoice_set.first().vote(self.user)
+            self.assertTrue(bridge.poll() == 1)
+            self.assertTrue(subscriber.wait(0, 0) == {p.id})
+        finally:
+            hub.unsubscribe(subscriber)
+
+
+@override_settings(CONSENSUS_LIVE_FEED=True)
+class FeedViewTest(TwoUserMixin, TestCase, ProposalGroupMixin, ProposalMixin):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TwoUserMixin.setUp(self)
+
+    def events(self, view, **kwargs):
+        request = self.factory.get('/')
+        request.user = self.user
+        response = view.as_view()(request, **kwargs)
+        self.assertTrue(response['Content-Type'] == 'text/event-stream')
+        return [chunk.decode() for chunk in response.streaming_content]
+
+    @override_settings(CONSENSUS_LIVE_FEED_MAX_AGE=0)
+    def test_proposal_feed(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        events = self.events(ProposalFeedView, proposal_id=p.id)
+        self.assertTrue(events[0].startswith('retry:'))
+        # starts with the current spread and consensus
+        self.assertTrue(events[1].startswith('event: consensus\n'))
+        data = json.loads(events[1].split('data: ')[1])
+        self.assertTrue(data['proposals'][0]['id'] == p.id)
+        self.assertTrue(data['proposals'][0]['consensus'] == 'Yes')
+        self.assertTrue(data['proposals'][0]['spread'][str(pc1.id)]['count'] == 1)
+        self.assertTrue(len(hub.subscribers) == 0)
+
+    @override_settings(CONSENSUS_LIVE_FEED_MAX_AGE=0)
+    def test_group_feed(self):
+        pg = self.create_proposal_group()
+        events = self.events(GroupFeedView, proposal_group_id=pg.id)
+        self.assertTrue(events == ['retry: 1000\n\n', ': keep-alive\n\n'])
+
+    @override_settings(CONSENSUS_LIVE_FEED=False)
+    def test_feed_disabled(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        request = self.factory.get('/')
+        request.user = self.user
+        # the browser stops reconnecting on no content
+        self.assertTrue(ProposalFeedView.as_view()(request, proposal_id=p.id).status_code == 204)
+        response = ProposalView.as_view()(request, proposal_id=p.id)
+        self.assertFalse('EventSource' in response.rendered_content)
+        with self.settings(CONSENSUS_LIVE_FEED=True):
+            response = ProposalView.as_view()(request, proposal_id=p.id)
+            self.assertTrue('EventSource' in response.rendered_content)
+
+
+class FeedPublishTest(TwoUserMixin, ProposalMixin, TransactionTestCase):
+
+    def test_vote_and_state_change_published(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        subscriber = hub.subscribe(['proposal:{}'.format(p.id)])
+        try:
+            p.proposalchoice_set.first().vote(self.user)
+            self.assertTrue(subscriber.wait(0, 0) == {p.id})
+            p.hold()
+            self.assertTrue(subscriber.wait(0, 0) == {p.id})
+        finally:
+            hub.unsubscribe(subscriber)
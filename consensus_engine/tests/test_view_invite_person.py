@@ -1,8 +1,14 @@
 from django.test import TestCase, RequestFactory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+import json
 from django.contrib.sessions.middleware import SessionMiddleware
-from .mixins import TwoUserMixin, ProposalGroupMixin, ViewMixin, ProposalMixin, TemplateViewMixin
-from consensus_engine.views import InvitesView, InviteView, InvitePersonView
-from consensus_engine.models import GroupInvite
+from .mixins import TwoUserMixin, ProposalGroupMixin, ViewMixin, ProposalMixin, TemplateViewMixin, membership_reads
+from consensus_engine.views import InvitesView, InviteView, InvitePersonView, UserSearchView, ImportPeopleView
+from consensus_engine.models import GroupInvite, GroupMembership
 
 
 class InvitesViewTest(TwoUserMixin, TestCase,
@@ -151,3 +157,110 @@ class InvitePersonViewTest(TwoUserMixin, TestCase,
                     data={'user_id': self.user2.id},
                     viewkwargs={'pk': pg.id})
         self.assertTrue(GroupInvite.objects.my_open_invites_count(self.user2) == 1)
+
+
+class UserSearchViewTest(TwoUserMixin, TestCase, ProposalGroupMixin):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TwoUserMixin.setUp(self)
+
+    def search(self, group, user=None, **params):
+        request = self.factory.get('/', params)
+        request.user = user or self.user
+        response = UserSearchView.as_view()(request, pk=group.id)
+        return json.loads(response.content)
+
+    def test_user_search(self):
+        pg = self.create_proposal_group()
+        for name in ['alice', 'alan', 'albert', 'bob']:
+            User.objects.create_user(username=name, email=name + '@example.com', password='top_secret')
+        User.objects.create_user(username='zed', email='Alias@example.com', password='top_secret')
+        self.assertTrue(self.search(pg, q='') == {'users': [], 'next': None})
+        # prefix of the username or the email, case insensitive
+        page = self.search(pg, q='AL')
+        self.assertTrue([user['username'] for user in page['users']] == ['alan', 'albert', 'alice', 'zed'])
+        self.assertTrue(page['next'] is None)
+        # members and open invitees are left out
+        self.assertTrue([user['username'] for user in self.search(pg, q='jacob')['users']] == ['jacob2'])
+        pg.invite_user(self.user, User.objects.get(username='alice'))
+        pg.join_group(User.objects.get(username='alan'))
+        with self.assertNumQueries(3):
+            page = self.search(pg, q='al')
+        self.assertTrue([user['username'] for user in page['users']] == ['albert', 'zed'])
+
+    def test_user_search_pages(self):
+        pg = self.create_proposal_group()
+        for i in range(5):
+            User.objects.create_user(username='user{}'.format(i), email='', password='top_secret')
+        with self.settings(USER_SEARCH_PAGE_SIZE=2):
+            page = self.search(pg, q='user')
+            self.assertTrue([user['username'] for user in page['users']] == ['user0', 'user1'])
+            self.assertTrue(page['next'] == 'user1')
+            page = self.search(pg, q='user', after=page['next'])
+            self.assertTrue([user['username'] for user in page['users']] == ['user2', 'user3'])
+            page = self.search(pg, q='user', after=page['next'])
+            self.assertTrue([user['username'] for user in page['users']] == ['user4'])
+            self.assertTrue(page['next'] is None)
+
+    def test_user_search_not_a_member(self):
+        pg = self.create_proposal_group()
+        with self.assertRaises(PermissionDenied):
+            self.search(pg, user=self.user2, q='jacob')
+
+    def test_user_search_reads_memberships_once(self):
+        pg = self.create_proposal_group()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/proposalgroups/{}/invite/users/'.format(pg.id), {'q': 'jacob'})
+        self.assertTrue([user['username'] for user in json.loads(response.content)['users']] == ['jacob2'])
+        self.assertTrue(len(membership_reads(queries, self.user)) == 1)
+
+
+class ImportPeopleViewTest(TwoUserMixin, TestCase, ProposalGroupMixin):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        TwoUserMixin.setUp(self)
+
+    def import_people(self, group, content, name='people.csv', user=None, **data):
+        data['people_file'] = SimpleUploadedFile(name, content)
+        request = self.factory.post('/', data)
+        request.user = user or self.user
+        return ImportPeopleView.as_view()(request, pk=group.id)
+
+    def test_import_people(self):
+        pg = self.create_proposal_group()
+        User.objects.create_user(username='user3', email='', password='top_secret')
+        response = self.import_people(pg, b'username,can_trial\njacob2,true\nuser3,\nnobody,\njacob,\n')
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'Invited 2 people, skipped 2.' in response.content)
+        self.assertTrue(b'Unknown user.' in response.content and b'Already a member.' in response.content)
+        self.assertTrue(GroupInvite.objects.filter(group=pg, accepted=None).count() == 2)
+        self.assertTrue(GroupInvite.objects.get(group=pg, invitee=self.user2).can_trial)
+
+    def test_import_people_join(self):
+        pg = self.create_proposal_group()
+        response = self.import_people(pg, b'{"username": "jacob2"}\n', name='people.ndjson', join='on')
+        self.assertTrue(b'Added 1 people, skipped 0.' in response.content)
+        self.assertTrue(GroupMembership.objects.filter(group=pg, user=self.user2).exists())
+        # only the owner can add members without an invite
+        with self.assertRaises(PermissionDenied):
+            self.import_people(pg, b'{"username": "jacob"}\n', name='people.ndjson', user=self.user2, join='on')
+
+    def test_import_people_not_objects(self):
+        pg = self.create_proposal_group()
+        response = self.import_people(pg, b'["jacob2"]\n1\nnull\nnot json\n{"username": "jacob2"}\n',
+                                      name='people.jsonl')
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b'Invited 1 people, skipped 4.' in response.content)
+        self.assertTrue(response.content.count(b'Invalid record.') == 4)
+        self.assertTrue(GroupInvite.objects.filter(group=pg, invitee=self.user2).exists())
+
+    def test_import_people_no_file(self):
+        pg = self.create_proposal_group()
+        request = self.factory.post('/', {})
+        request.user = self.user
+        response = ImportPeopleView.as_view()(request, pk=pg.id)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(b"You didn&#x27;t select a file to import." in response.content)
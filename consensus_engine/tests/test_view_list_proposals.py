@@ -1,6 +1,11 @@
 from django.test import TestCase, RequestFactory
-from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin, TemplateViewMixin
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.template import Context, Template
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin, TemplateViewMixin, membership_reads
 from consensus_engine.views import ProposalListView, ProposalListGroupView
+from consensus_engine.utils import ProposalState
+from consensus_engine.models import Proposal
 
 
 class ProposalListViewTest(TwoUserMixin, TestCase,
@@ -13,47 +18,84 @@ class ProposalListViewTest(TwoUserMixin, TestCase,
 
     def test_list_proposals_no_proposals(self):
         context, _ = self.executeView()
-        self.assertTrue(context['draft_proposals_list'].count() == 0)
+        self.assertTrue(len(context['draft_proposals_list']) == 0)
 
     def test_list_proposals_some_proposals(self):
         p = self.create_new_proposal()
         context, _ = self.executeView()
-        self.assertTrue(context['draft_proposals_list'].count() == 1)
-        self.assertTrue(context['draft_proposals_list'].first()['id'] == p.id)
-        self.assertTrue(context['trial_proposals_list'].count() == 0)
-        self.assertTrue(context['published_proposals_list'].count() == 0)
-        self.assertTrue(context['on_hold_proposals_list'].count() == 0)
-        self.assertTrue(context['archived_proposals_list'].count() == 0)
+        self.assertTrue(len(context['draft_proposals_list']) == 1)
+        self.assertTrue(context['draft_proposals_list'][0]['id'] == p.id)
+        self.assertTrue(len(context['trial_proposals_list']) == 0)
+        self.assertTrue(len(context['published_proposals_list']) == 0)
+        self.assertTrue(len(context['on_hold_proposals_list']) == 0)
+        self.assertTrue(len(context['archived_proposals_list']) == 0)
         p2 = self.create_new_proposal()
         context2, _ = self.executeView()
-        self.assertTrue(context2['draft_proposals_list'].count() == 2)
-        self.assertTrue(context2['draft_proposals_list'].filter(id=p.id).count() == 1)
-        self.assertTrue(context2['draft_proposals_list'].filter(id=p2.id).count() == 1)
-        self.assertTrue(context2['draft_proposals_list'].filter(id=99).count() == 0)
-        self.assertTrue(context['trial_proposals_list'].count() == 0)
-        self.assertTrue(context['published_proposals_list'].count() == 0)
-        self.assertTrue(context['on_hold_proposals_list'].count() == 0)
-        self.assertTrue(context['archived_proposals_list'].count() == 0)
+        self.assertTrue(len(context2['draft_proposals_list']) == 2)
+        self.assertTrue([proposal['id'] for proposal in context2['draft_proposals_list']].count(p.id) == 1)
+        self.assertTrue([proposal['id'] for proposal in context2['draft_proposals_list']].count(p2.id) == 1)
+        self.assertTrue([proposal['id'] for proposal in context2['draft_proposals_list']].count(99) == 0)
+        self.assertTrue(len(context['trial_proposals_list']) == 0)
+        self.assertTrue(len(context['published_proposals_list']) == 0)
+        self.assertTrue(len(context['on_hold_proposals_list']) == 0)
+        self.assertTrue(len(context['archived_proposals_list']) == 0)
         # create a proposal by another user
         p3 = self.create_new_proposal(owned_by=self.user2)
         context3, _ = self.executeView()
-        self.assertTrue(context3['draft_proposals_list'].count() == 2)
-        self.assertTrue(context3['draft_proposals_list'].filter(id=p.id).count() == 1)
-        self.assertTrue(context3['draft_proposals_list'].filter(id=p2.id).count() == 1)
-        self.assertTrue(context['trial_proposals_list'].count() == 0)
-        self.assertTrue(context['published_proposals_list'].count() == 0)
-        self.assertTrue(context['on_hold_proposals_list'].count() == 0)
-        self.assertTrue(context['archived_proposals_list'].count() == 0)
+        self.assertTrue(len(context3['draft_proposals_list']) == 2)
+        self.assertTrue([proposal['id'] for proposal in context3['draft_proposals_list']].count(p.id) == 1)
+        self.assertTrue([proposal['id'] for proposal in context3['draft_proposals_list']].count(p2.id) == 1)
+        self.assertTrue(len(context['trial_proposals_list']) == 0)
+        self.assertTrue(len(context['published_proposals_list']) == 0)
+        self.assertTrue(len(context['on_hold_proposals_list']) == 0)
+        self.assertTrue(len(context['archived_proposals_list']) == 0)
         # switch user
         self.current_user = self.user2
         context4, _ = self.executeView()
-        self.assertTrue(context4['draft_proposals_list'].count() == 1)
-        self.assertTrue(context4['draft_proposals_list'].filter(id=p3.id).count() == 1)
-        self.assertTrue(context4['draft_proposals_list'].filter(id=p.id).count() == 0)
-        self.assertTrue(context['trial_proposals_list'].count() == 0)
-        self.assertTrue(context['published_proposals_list'].count() == 0)
-        self.assertTrue(context['on_hold_proposals_list'].count() == 0)
-        self.assertTrue(context['archived_proposals_list'].count() == 0)
+        self.assertTrue(len(context4['draft_proposals_list']) == 1)
+        self.assertTrue([proposal['id'] for proposal in context4['draft_proposals_list']].count(p3.id) == 1)
+        self.assertTrue([proposal['id'] for proposal in context4['draft_proposals_list']].count(p.id) == 0)
+        self.assertTrue(len(context['trial_proposals_list']) == 0)
+        self.assertTrue(len(context['published_proposals_list']) == 0)
+        self.assertTrue(len(context['on_hold_proposals_list']) == 0)
+        self.assertTrue(len(context['archived_proposals_list']) == 0)
+
+
+    def test_list_proposals_in_one_query(self):
+        for state in [ProposalState.DRAFT, ProposalState.TRIAL, ProposalState.PUBLISHED]:
+            for i in range(2):
+                p = self.create_new_proposal()
+                p.state = state
+                p.save()
+        with self.assertNumQueries(1):
+            pages = Proposal.objects.owned_by_state(self.user, 10)
+        self.assertTrue([len(pages[state][0]) for state in ProposalState] == [2, 2, 2, 0, 0])
+        self.assertTrue(all(pages[state][1] is None for state in ProposalState))
+
+    def test_list_proposals_pages(self):
+        archived = []
+        for i in range(5):
+            p = self.create_new_proposal()
+            p.state = ProposalState.ARCHIVED
+            p.save()
+            archived.insert(0, p.id)
+        draft = self.create_new_proposal()
+        with self.settings(PROPOSAL_LIST_PAGE_SIZE=2):
+            context, _ = self.executeView()
+            self.assertTrue([proposal['id'] for proposal in context['archived_proposals_list']] == archived[:2])
+            self.assertTrue(context['archived_proposals_next'] == archived[1])
+            self.assertTrue(context['draft_proposals_list'][0]['id'] == draft.id)
+            self.assertTrue(context['draft_proposals_next'] is None)
+            self.path = '/proposals/?archived_before={}'.format(archived[1])
+            context, _ = self.executeView()
+            self.assertTrue([proposal['id'] for proposal in context['archived_proposals_list']] == archived[2:4])
+            self.assertTrue(context['archived_proposals_next'] == archived[3])
+            # the other states start from their first page
+            self.assertTrue(context['draft_proposals_list'][0]['id'] == draft.id)
+            self.path = '/proposals/?archived_before={}'.format(archived[3])
+            context, _ = self.executeView()
+            self.assertTrue([proposal['id'] for proposal in context['archived_proposals_list']] == archived[4:])
+            self.assertTrue(context['archived_proposals_next'] is None)
 
 
 class ProposalListGroupViewTest(TwoUserMixin, TestCase,
@@ -110,3 +152,65 @@ class ProposalListGroupViewTest(TwoUserMixin, TestCase,
         p.archive()
         context, _ = self.executeView(viewkwargs={'proposal_group_id': pg.id})
         self.assertTrue(context['proposals_list'].count() == 0)
+
+    def test_list_proposals_renders_in_one_query(self):
+        pg = self.create_proposal_group()
+        pg.join_group(self.user2)
+        for i in range(5):
+            p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+            p.publish()
+            p.proposalchoice_set.first().vote(self.user)
+            p.proposalchoice_set.last().vote(self.user2)
+        p.proposalchoice_set.first().vote(self.user2)
+        context, _ = self.executeView(viewkwargs={'proposal_group_id': pg.id})
+        template = Template('{% load proposaltags %}{% for proposal in proposals_list %}'
+                            '{% proposal_list_element proposal user_id %}{% endfor %}')
+        with self.assertNumQueries(1):
+            html = template.render(Context({'proposals_list': context['proposals_list'], 'user_id': self.user.id}))
+        self.assertTrue(html.count('My Vote: Yes') == 5)
+        self.assertTrue(html.count('Current Consensus: Yes') == 1)
+        self.assertTrue(html.count('Current Consensus: No consensus') == 4)
+        self.assertTrue(html.count('Number of Votes: 2') == 5)
+        self.assertTrue(all(proposal['state'] == ProposalState.PUBLISHED for proposal in context['proposals_list']))
+
+    def test_list_proposals_not_modified(self):
+        pg = self.create_proposal_group()
+        pg.join_group(self.user2)
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+
+        def get(**headers):
+            request = self.factory.get('/', **headers)
+            request.user = self.user
+            response = ProposalListGroupView.as_view()(request, proposal_group_id=pg.id)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        etag = get()['ETag']
+        with self.assertNumQueries(1):
+            self.assertTrue(get(HTTP_IF_NONE_MATCH=etag).status_code == 304)
+        # a vote by another member changes the totals on the page
+        p.proposalchoice_set.first().vote(self.user2)
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        etag = response['ETag']
+        # as does a member leaving
+        pg.remove_member(self.user2)
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(get(HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304)
+
+    def test_list_proposals_reads_memberships_once(self):
+        pg = self.create_proposal_group()
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+        self.client.force_login(self.user)
+        # after the sidebar is cached
+        self.client.get('/proposalgroups/{}/proposals/'.format(pg.id))
+        # the user's memberships are loaded once for the member and trial checks
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/proposalgroups/{}/proposals/'.format(pg.id))
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.context['can_edit'] and response.context['can_trial'])
+        self.assertTrue(len(membership_reads(queries, self.user)) == 1)
+        self.assertTrue(len(queries) == 6)
@@ -3,7 +3,7 @@ from .mixins import OneUserMixin, ProposalMixin, TemplateViewMixin
 from django.utils import timezone
 
 from consensus_engine.views import ProposalView
-from consensus_engine.models import ChoiceTicket, ConsensusHistory
+from consensus_engine.models import ChoiceTicket, ConsensusHistory, ProposalGroup
 from consensus_engine.converters import DateConverter
 
 
@@ -138,3 +138,47 @@ class ProposalViewTest(OneUserMixin, TestCase,
         context, _ = self.executeView(viewkwargs={'proposal_id': p.id, 'query_date': qd2})
         self.assertFalse('vote_spread' in context)
         self.assertTrue('error_message' in context)
+
+
+class ProposalViewConditionalTest(OneUserMixin, TestCase, ProposalMixin):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        OneUserMixin.setUp(self)
+
+    def get(self, proposal, **headers):
+        request = self.factory.get('/', **headers)
+        request.user = self.user
+        response = ProposalView.as_view()(request, proposal_id=proposal.id)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_not_modified(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        response = self.get(p)
+        self.assertTrue(response.status_code == 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        # answered before the page's queries are run
+        with self.assertNumQueries(1):
+            response = self.get(p, HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 304)
+        response = self.get(p, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertTrue(response.status_code == 304)
+        # a vote changes the page
+        p.proposalchoice_set.first().vote(self.user)
+        response = self.get(p, HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        etag = response['ETag']
+        # as does a state change
+        p.hold()
+        response = self.get(p, HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        etag = response['ETag']
+        # and a change to the user's sidebar
+        ProposalGroup.objects.create(group_name='new group', owned_by=self.user).join_group(self.user)
+        response = self.get(p, HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(self.get(p, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304)
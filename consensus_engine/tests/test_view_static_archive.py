@@ -0,0 +1,167 @@
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+from .mixins import TwoUserMixin, ProposalMixin
+from consensus_engine.models import ConsensusHistory, PendingArchiveRender, Proposal, ProposalGroup
+from consensus_engine.views import ProposalResultView, SidebarView
+from consensus_engine.utils import ProposalState
+
+
+class StaticArchiveMixin:
+
+    def setUp(self):
+        super().setUp()
+        self.archive_root = tempfile.mkdtemp()
+        self.archive_settings = override_settings(CONSENSUS_STATIC_ARCHIVE_ROOT=self.archive_root)
+        self.archive_settings.enable()
+
+    def tearDown(self):
+        self.archive_settings.disable()
+        shutil.rmtree(self.archive_root)
+        super().tearDown()
+
+    def archived_path(self, proposal, *names):
+        return os.path.join(self.archive_root, 'proposals', str(proposal.id), *names)
+
+
+class StaticArchiveTest(StaticArchiveMixin, TwoUserMixin, ProposalMixin, TestCase):
+
+    def create_archived_proposal(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        p.proposalchoice_set.first().vote(self.user)
+        # history from last year so there are history by month pages
+        snapshot = ConsensusHistory.build_snapshot(p)
+        snapshot.snapshot_date = snapshot.snapshot_date.replace(year=snapshot.snapshot_date.year - 1)
+        snapshot.save()
+        p.archive()
+        return p
+
+    def test_render_static_archive_command(self):
+        p = self.create_archived_proposal()
+        live = self.create_proposal_with_two_proposal_choices()
+        live.publish()
+        out = StringIO()
+        call_command('render_static_archive', stdout=out)
+        self.assertTrue(os.path.isfile(self.archived_path(p, 'index.html')))
+        months = [name for name in os.listdir(self.archived_path(p))
+                  if os.path.isdir(self.archived_path(p, name))]
+        self.assertTrue(len(months) >= 12)
+        self.assertTrue(all(os.path.isfile(self.archived_path(p, month, 'index.html')) for month in months))
+        with open(self.archived_path(p, 'result.json')) as f:
+            result = json.load(f)
+        self.assertTrue(result['consensus'] == 'Yes' and result['total_voters'] == 1)
+        self.assertTrue(result['sealed_date'] is not None)
+        # only archived proposals are rendered
+        self.assertFalse(os.path.exists(self.archived_path(live)))
+        self.assertTrue('Rendered 1 archived proposals to {} files.'.format(len(months) + 2) in out.getvalue())
+        # only the proposals queued as they were archived unless rerendering
+        self.assertFalse(PendingArchiveRender.objects.exists())
+        call_command('render_static_archive', stdout=out)
+        self.assertTrue(out.getvalue().endswith('Rendered 0 archived proposals to 0 files.\n'))
+        call_command('render_static_archive', '--rerender', stdout=out)
+        self.assertTrue(out.getvalue().endswith('Rendered 1 archived proposals to {} files.\n'.format(len(months) + 2)))
+
+    def test_served_from_archive(self):
+        p = self.create_archived_proposal()
+        call_command('render_static_archive', stdout=StringIO())
+        self.client.force_login(self.user)
+        response = self.client.get('/proposals/{}/result.json'.format(p.id))
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('application/json'))
+        self.assertTrue(json.loads(b''.join(response.streaming_content))['id'] == p.id)
+        # the pages are the same for every user and load the user's sidebar
+        response = self.client.get('/proposals/{}/'.format(p.id))
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        page = b''.join(response.streaming_content)
+        self.assertTrue(p.proposal_name.encode() in page)
+        self.assertTrue("'{}'".format(reverse('sidebar')).encode() in page)
+        month = sorted(name for name in os.listdir(self.archived_path(p))
+                       if os.path.isdir(self.archived_path(p, name)))[0]
+        self.assertTrue(self.client.get('/proposals/{}/{}/'.format(p.id, month)).streaming)
+        # results that are not in the archive go to the view
+        os.remove(self.archived_path(p, 'result.json'))
+        response = self.client.get('/proposals/{}/result.json'.format(p.id))
+        self.assertFalse(response.streaming)
+        self.assertTrue(json.loads(response.content)['id'] == p.id)
+        # and the archive is still only for logged in users
+        self.client.logout()
+        self.assertTrue(self.client.get('/proposals/{}/result.json'.format(p.id)).status_code == 302)
+
+    def test_proposal_result_view(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc1.vote(self.user)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        result = json.loads(ProposalResultView.as_view()(request, proposal_id=p.id).content)
+        self.assertTrue(result['consensus'] == 'Yes' and result['total_votes'] == 1)
+        self.assertTrue(result['spread'][str(pc1.id)]['count'] == 1)
+        self.assertTrue(result['sealed_date'] is None)
+
+    def test_sidebar_view(self):
+        pg = ProposalGroup.objects.create(group_name='sidebar group', owned_by=self.user)
+        pg.join_group(self.user)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        sidebar = json.loads(SidebarView.as_view()(request).content)
+        self.assertTrue('sidebar group' in sidebar['visible_groups'])
+        self.assertTrue('open_invites_count' in sidebar)
+
+    @override_settings(CONSENSUS_STATIC_ARCHIVE_ROOT=None)
+    def test_render_static_archive_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command('render_static_archive')
+
+
+class StaticArchiveHookTest(StaticArchiveMixin, TwoUserMixin, ProposalMixin, TransactionTestCase):
+
+    def test_archive_not_rendered_in_request(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        p.archive()
+        # left to render_static_archive
+        self.assertFalse(os.path.exists(self.archived_path(p)))
+        self.assertTrue(PendingArchiveRender.objects.filter(proposal=p).exists())
+        # and queued when archived in bulk
+        bulk = [self.create_proposal_with_two_proposal_choices() for _ in range(2)]
+        Proposal.objects.transition(Proposal.objects.filter(id__in=[proposal.id for proposal in bulk]),
+                                    ProposalState.ARCHIVED)
+        self.assertTrue(PendingArchiveRender.objects.count() == 3)
+        call_command('render_static_archive', stdout=StringIO())
+        self.assertFalse(PendingArchiveRender.objects.exists())
+        self.assertTrue(all(os.path.isfile(self.archived_path(proposal, 'index.html')) for proposal in bulk))
+
+    def test_deleted_proposal_removed(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        p.archive()
+        call_command('render_static_archive', stdout=StringIO())
+        self.assertTrue(os.path.isfile(self.archived_path(p, 'result.json')))
+        directory = self.archived_path(p)
+        p.delete()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_unarchived_proposal_removed(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+        p.archive()
+        call_command('render_static_archive', stdout=StringIO())
+        # moved out of archived by hand (the admin)
+        p.state = ProposalState.PUBLISHED
+        p.save()
+        self.assertFalse(os.path.exists(self.archived_path(p)))
+        # nor rendered again if archived before the render ran
+        p.archive()
+        p.state = ProposalState.PUBLISHED
+        p.save()
+        self.assertFalse(PendingArchiveRender.objects.exists())
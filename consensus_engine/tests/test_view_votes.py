@@ -1,7 +1,10 @@
 from django.test import TestCase, RequestFactory
-from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin, TemplateViewMixin
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from .mixins import TwoUserMixin, ProposalGroupMixin, ProposalMixin, TemplateViewMixin, membership_reads
 from django.utils import timezone
 from consensus_engine.views import MyVotesView, VoteView
+from consensus_engine.views.conditional import group_last_changed
 from consensus_engine.models import ChoiceTicket
 
 
@@ -42,6 +45,35 @@ class MyVotesViewTest(TwoUserMixin, TestCase,
         context, _ = self.executeView()
         self.assertTrue(context['votes_list'].count() == 1)
 
+    def test_list_votes_not_modified(self):
+        p = self.create_proposal_with_two_proposal_choices()
+        p.publish()
+
+        def get(**headers):
+            request = self.factory.get('/', **headers)
+            request.user = self.user
+            response = MyVotesView.as_view()(request)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        etag = get()['ETag']
+        self.assertTrue(get(HTTP_IF_NONE_MATCH=etag).status_code == 304)
+        # the user's vote and a change to a proposal voted on change the page
+        p.proposalchoice_set.first().vote(self.user)
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        etag = response['ETag']
+        p.proposalchoice_set.last().vote(self.user2)
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(get(HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304)
+        # retiring the vote changes the page too
+        etag = response['ETag']
+        ChoiceTicket.objects.retire(ChoiceTicket.objects.filter(user=self.user))
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(get(HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304)
+
 
 class VoteViewTest(TwoUserMixin, TestCase,
                    ProposalGroupMixin, ProposalMixin, TemplateViewMixin):
@@ -78,3 +110,33 @@ class VoteViewTest(TwoUserMixin, TestCase,
         self.assertTrue(p.total_votes == 0)
         self.assertTrue(ChoiceTicket.objects.filter(proposal_choice=pc1).count() == 0)
         self.assertTrue(ChoiceTicket.objects.filter(proposal_choice=pc2).count() == 0)
+
+    def test_vote_reads_memberships_once(self):
+        pg = self.create_proposal_group()
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/proposals/{}/vote/'.format(p.id), {'choice': pc1.id})
+        self.assertTrue(ChoiceTicket.objects.filter(proposal_choice=pc1, user=self.user, current=True).count() == 1)
+        self.assertTrue(len(membership_reads(queries, self.user)) == 1)
+
+    def test_vote_marks_changed_once(self):
+        pg = self.create_proposal_group()
+        p = self.create_proposal_with_two_proposal_choices(proposal_group=pg)
+        p.publish()
+        pc1 = p.proposalchoice_set.first()
+        pc2 = p.proposalchoice_set.last()
+        pc1.vote(self.user)
+        request = RequestFactory().get('/')
+        group_changed = group_last_changed(request, pg.id)
+        with CaptureQueriesContext(connection) as queries:
+            pc2.vote(self.user)
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        # the group row all its proposals share is never updated by a vote
+        self.assertFalse([sql for sql in updates if sql.startswith('UPDATE "consensus_engine_proposalgroup"')])
+        self.assertTrue(len([sql for sql in updates if sql.startswith('UPDATE "consensus_engine_proposal"')
+                             and '"last_changed"' in sql]) == 1)
+        # but the group page has changed
+        self.assertTrue(group_last_changed(request, pg.id) > group_changed)
@@ -23,12 +23,18 @@ urlpatterns = [
          views.ProposalListView.as_view(), name="my_proposals"),
     path('proposals/<int:proposal_id>/',
          views.ProposalView.as_view(), name='view_proposal'),
+    path('proposals/<int:proposal_id>/result.json',
+         views.ProposalResultView.as_view(), name='proposal_result'),
+    path('sidebar/',
+         views.SidebarView.as_view(), name='sidebar'),
     path('proposals/<int:proposal_id>/<date:query_date>/',
          views.ProposalView.as_view(), name='view_proposal_at_date'),
     path('proposals/<int:pk>/edit/',
          views.EditProposalView.as_view(), name='edit_proposal'),
     path('proposals/<int:proposal_id>/assign/group/',
          views.PickProposalGroupView.as_view(), name='assign_proposals_group'),
+    path('proposals/<int:proposal_id>/feed/',
+         views.ProposalFeedView.as_view(), name='proposal_feed'),
     path('proposals/<int:proposal_id>/vote/',
          views.VoteView.as_view(), name='vote_proposal'),
     path('proposals/<int:proposal_id>/change_state/',
@@ -53,8 +59,16 @@ urlpatterns = [
          views.EditProposalGroupView.as_view(), name='edit_proposal_group'),
     path('proposalgroups/<int:pk>/invite/',
          views.InvitePersonView.as_view(), name='invite_people'),
+    path('proposalgroups/<int:pk>/invite/users/',
+         views.UserSearchView.as_view(), name='invite_user_search'),
+    path('proposalgroups/<int:pk>/invite/import/',
+         views.ImportPeopleView.as_view(), name='import_people'),
     path('proposalgroups/<int:proposal_group_id>/proposals/',
          views.ProposalListGroupView.as_view(), name='group_proposals'),
+    path('proposalgroups/<int:proposal_group_id>/feed/',
+         views.GroupFeedView.as_view(), name='group_feed'),
+    path('proposalgroups/<int:proposal_group_id>/close/',
+         views.CloseOutGroupView.as_view(), name='close_out_group'),
     path('proposalgroups/<int:proposal_group_id>/members/',
          views.ProposalGroupMemberListView.as_view(), name='list_group_members'),
     path('groupmembership/<int:pk>/delete/',
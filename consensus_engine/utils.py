@@ -1,4 +1,5 @@
 from enum import IntEnum
+from django.utils import timezone
 
 
 class ProposalState(IntEnum):
@@ -45,3 +46,19 @@ class ProposalState(IntEnum):
         elif self.value == ProposalState.ARCHIVED:
             next_states = []
         return next_states
+
+
+class RollupPeriod(IntEnum):
+    DAY = 0
+    MONTH = 1
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+    def period_start(self, at_datetime):
+        """ Returns the first date of the period that the datetime falls in (in local time) """
+        local_date = timezone.localtime(at_datetime).date()
+        if self.value == RollupPeriod.MONTH:
+            return local_date.replace(day=1)
+        return local_date
@@ -5,6 +5,8 @@ from .proposal_view import CreateProposalView
 from .proposal_view import EditProposalView
 from .proposal_view import ProposalListView
 from .proposal_view import ProposalListGroupView
+from .proposal_view import ProposalResultView
+from .proposal_view import SidebarView
 from .proposal_choice_views import CreateProposalChoiceView
 from .proposal_choice_views import EditProposalChoiceView
 from .proposal_choice_views import DeleteProposalChoiceView
@@ -17,13 +19,18 @@ from .proposal_group_views import JoinProposalGroupMembersView
 from .proposal_group_views import ProposalGroupMemberListView
 from .proposal_group_views import RemoveGroupMemberView
 from .proposal_group_views import EditGroupMembershipView
+from .proposal_group_views import CloseOutGroupView
 from .vote_views import MyVotesView
 from .vote_views import VoteView
 from .invite_view import InvitesView
 from .invite_view import InviteView
 from .invite_view import InvitePersonView
+from .invite_view import UserSearchView
+from .invite_view import ImportPeopleView
 from .state_views import StateView
 from .state_views import StateChangeConfirmationView
+from .feed_views import ProposalFeedView
+from .feed_views import GroupFeedView
 
 __all__ = ['uiformat',
            'RememberMeLoginView',
@@ -32,6 +39,8 @@ __all__ = ['uiformat',
            'EditProposalView',
            'ProposalListView',
            'ProposalListGroupView',
+           'ProposalResultView',
+           'SidebarView',
            'CreateProposalChoiceView',
            'EditProposalChoiceView',
            'DeleteProposalChoiceView',
@@ -43,12 +52,17 @@ __all__ = ['uiformat',
            'ProposalGroupMemberListView',
            'RemoveGroupMemberView',
            'EditGroupMembershipView',
+           'CloseOutGroupView',
            'JoinProposalGroupMembersView',
            'MyVotesView',
            'VoteView',
            'InvitesView',
            'InviteView',
            'InvitePersonView',
+           'UserSearchView',
+           'ImportPeopleView',
            'StateView',
-           'StateChangeConfirmationView'
+           'StateChangeConfirmationView',
+           'ProposalFeedView',
+           'GroupFeedView'
            ]
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone as dt_timezone
+from django.db.models import Max
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from consensus_engine.caching import group_cache, sidebar_cache
+from consensus_engine.models import Proposal, ProposalGroup, PendingConsensusUpdate
+
+
+def conditional_page(page_last_changed):
+    """
+    Answers If-None-Match / If-Modified-Since on a page with a 304 before the view runs
+    - page_last_changed(request, **kwargs) returns when the data the page shows last changed
+      (None if there is no such page, which is then left to the view)
+    - the user's sidebar version is added so a page is also stale when the user's sidebar is
+    """
+    def changed(request, **kwargs):
+        # worked out once per request as both the etag and last modified functions need it
+        if not hasattr(request, '_page_changed'):
+            request._page_changed = None
+            if request.method in ('GET', 'HEAD'):
+                page_changed = page_last_changed(request, **kwargs)
+                if page_changed is not None:
+                    request._page_changed = (page_changed, sidebar_cache.version_time(request.user.id))
+        return request._page_changed
+
+    def etag(request, *args, **kwargs):
+        page_changed = changed(request, **kwargs)
+        if page_changed is None:
+            return None
+        return '{}-{}-{}'.format(request.user.id, *(int(time.timestamp() * 1000000) for time in page_changed))
+
+    def last_modified(request, *args, **kwargs):
+        page_changed = changed(request, **kwargs)
+        return max(page_changed) if page_changed is not None else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def proposal_last_changed(request, proposal_id, **kwargs):
+    # a stale write-behind consensus is brought up to date first so it is not served as not modified
+    PendingConsensusUpdate.objects.refresh_if_stale(proposal_id)
+    last_changed = Proposal.objects.filter(pk=proposal_id).values_list('last_changed', flat=True).first()
+    if last_changed is None:
+        return None
+    # the history links run up to the current month
+    start_of_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return max(last_changed, start_of_month)
+
+
+def group_last_changed(request, proposal_group_id, **kwargs):
+    # the group's own edits are on the row, changes to its proposals move on the group's version
+    last_changed = ProposalGroup.objects.filter(pk=proposal_group_id).values_list('last_changed', flat=True).first()
+    if last_changed is None:
+        return None
+    return max(last_changed, group_cache.version_time(proposal_group_id))
+
+
+def my_votes_last_changed(request, **kwargs):
+    # the proposals of the user's current votes - retiring a vote moves the user's sidebar version on,
+    # which every page's etag already includes
+    last_changed = (Proposal.objects.filter(choiceticket__user=request.user, choiceticket__current=True)
+                                    .aggregate(last_changed=Max('last_changed'))['last_changed'])
+    return last_changed or datetime.fromtimestamp(0, tz=dt_timezone.utc)
@@ -0,0 +1,38 @@
+from django.views import View
+from django.http import HttpResponse, StreamingHttpResponse
+from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
+from django.shortcuts import get_object_or_404
+
+from consensus_engine.models import Proposal, ProposalGroup
+from consensus_engine.live_feed import event_stream, feed_enabled
+
+
+def feed_response(channels, initial_proposal_ids=()):
+    if not feed_enabled():
+        # no content tells the browser's EventSource not to reconnect
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(event_stream(channels, initial_proposal_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop proxies (nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@method_decorator(login_required, name='dispatch')
+class ProposalFeedView(View):
+    """ Server-sent events with the proposal's voting spread and consensus as they change """
+
+    def get(self, request, **kwargs):
+        proposal = get_object_or_404(Proposal, pk=kwargs['proposal_id'])
+        # starts with the current spread and consensus
+        return feed_response(['proposal:{}'.format(proposal.id)], [proposal.id])
+
+
+@method_decorator(login_required, name='dispatch')
+class GroupFeedView(View):
+    """ Server-sent events with the voting spread and consensus of the group's proposals as they change """
+
+    def get(self, request, **kwargs):
+        proposal_group = get_object_or_404(ProposalGroup, pk=kwargs['proposal_group_id'])
+        return feed_response(['group:{}'.format(proposal_group.id)])
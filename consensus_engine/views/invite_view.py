@@ -1,11 +1,16 @@
+import io
 from django.views.generic.base import TemplateView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
+from django.views import View
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.shortcuts import render, get_object_or_404
 from django.db import DataError
 
+from consensus_engine.imports import batches, file_format_for, read_records
 from consensus_engine.models import GroupInvite, ProposalGroup
 
 
@@ -62,3 +67,55 @@ class InvitePersonView(TemplateView):
             })
         next = request.POST.get('next', '/')
         return HttpResponseRedirect(next)
+
+
+@method_decorator(login_required, name='dispatch')
+class ImportPeopleView(TemplateView):
+    """ Class based view for inviting (or adding, for the owner) the people in a CSV or NDJSON file to a group """
+    template_name = 'consensus_engine/import_people.html'
+
+    def get_context_data(self, **kwargs):
+        group = get_object_or_404(ProposalGroup, pk=kwargs['pk'])
+        context = {'group': group}
+        return context
+
+    def post(self, request, **kwargs):
+        group = get_object_or_404(ProposalGroup, pk=kwargs['pk'])
+        context = self.get_context_data(**kwargs)
+        if 'people_file' not in request.FILES:
+            context['error_message'] = "You didn't select a file to import."
+            return render(request, self.template_name, context)
+        people_file = request.FILES['people_file']
+        join = 'join' in request.POST
+        batch_size = getattr(settings, 'PEOPLE_IMPORT_BATCH_SIZE', 500)
+        # the upload is streamed a batch at a time
+        stream = io.TextIOWrapper(people_file.file, encoding='utf-8', newline='')
+        results = []
+        try:
+            for batch in batches(read_records(stream, file_format_for(people_file.name), ('username', 'can_trial')),
+                                 batch_size):
+                results.extend(group.bulk_add_people(request.user, batch, join=join))
+        except (ValueError, UnicodeDecodeError):
+            context['error_message'] = "The file could not be read as CSV or NDJSON."
+        added = "Joined." if join else "Invited."
+        context.update({'results': [(record[0], result) for record, result in results],
+                        'added_count': sum(1 for _, result in results if result == added),
+                        'skipped_count': sum(1 for _, result in results if result != added),
+                        'joined': join})
+        return render(request, self.template_name, context)
+
+
+@method_decorator(login_required, name='dispatch')
+class UserSearchView(View):
+    """ JSON prefix search for the users that can be invited to a group (the invite typeahead) """
+
+    def get(self, request, **kwargs):
+        group = get_object_or_404(ProposalGroup, pk=kwargs['pk'])
+        if not group.is_user_member(request.user):
+            raise PermissionDenied("Only members can invite people to the group")
+        prefix = request.GET.get('q', '').strip()
+        if not prefix:
+            return JsonResponse({'users': [], 'next': None})
+        page_size = getattr(settings, 'USER_SEARCH_PAGE_SIZE', 20)
+        users, next_after = group.users_to_invite(prefix, page_size, after=request.GET.get('after') or None)
+        return JsonResponse({'users': users, 'next': next_after})
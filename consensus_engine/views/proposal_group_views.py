@@ -9,6 +9,7 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 
 from consensus_engine.models import Proposal, ProposalGroup, GroupMembership
+from consensus_engine.utils import ProposalState
 
 
 @method_decorator(login_required, name='dispatch')
@@ -188,3 +189,44 @@ class EditGroupMembershipView(UpdateView):
             return super().form_valid(form)
         else:
             raise PermissionDenied("Editing is not allowed")
+
+
+@method_decorator(login_required, name='dispatch')
+class CloseOutGroupView(TemplateView):
+    """ Archives all of a group's proposals, or holds its published ones, at once - group owner only """
+    template_name = 'consensus_engine/close_out_group.html'
+    # the states a group can be closed out to and the proposals moved to each
+    close_out_states = {ProposalState.ARCHIVED: [ProposalState.DRAFT, ProposalState.TRIAL,
+                                                 ProposalState.PUBLISHED, ProposalState.ON_HOLD],
+                        ProposalState.ON_HOLD: [ProposalState.PUBLISHED]}
+
+    def get_group(self):
+        proposal_group = get_object_or_404(ProposalGroup, pk=self.kwargs['proposal_group_id'])
+        if proposal_group.owned_by != self.request.user:
+            raise PermissionDenied("Only the owner is allowed to close out the group.")
+        return proposal_group
+
+    def get_context_data(self, **kwargs):
+        proposal_group = self.get_group()
+        proposals = Proposal.objects.filter(proposal_group=proposal_group)
+        context = {'proposal_group': proposal_group,
+                   'archive_count': proposals.filter(state__in=self.close_out_states[ProposalState.ARCHIVED]).count(),
+                   'hold_count': proposals.filter(state__in=self.close_out_states[ProposalState.ON_HOLD]).count()}
+        return context
+
+    def post(self, request, **kwargs):
+        proposal_group = self.get_group()
+        if 'okay_btn' not in request.POST:
+            return HttpResponseRedirect(reverse('group_proposals', args=[proposal_group.id]))
+        try:
+            state = ProposalState(int(request.POST['state']))
+            from_states = self.close_out_states[state]
+        except (KeyError, ValueError):
+            context = self.get_context_data(**kwargs)
+            context['error_message'] = "You didn't select how to close out the group."
+            return render(request, self.template_name, context)
+        moved, rejected = Proposal.objects.transition(Proposal.objects.filter(proposal_group=proposal_group,
+                                                                              state__in=from_states), state)
+        context = self.get_context_data(**kwargs)
+        context.update({'closed_out_state': state, 'moved_count': len(moved), 'rejected_ids': rejected})
+        return render(request, self.template_name, context)
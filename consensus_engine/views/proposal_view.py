@@ -1,35 +1,45 @@
 from django.views.generic.base import TemplateView
 from django.views.generic.edit import CreateView, UpdateView
 from django.utils import timezone
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponseRedirect, JsonResponse
+from django.views import View
 from django.core.exceptions import PermissionDenied
 
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 
 from consensus_engine.models import Proposal, ChoiceTicket, ProposalGroup, ConsensusHistory
 from consensus_engine.utils import ProposalState
 from consensus_engine.choice_templates import ChoiceTemplates
+from consensus_engine.live_feed import feed_enabled
+from consensus_engine.templatetags.proposaltags import visible_groups, my_open_invites_count
+from .conditional import conditional_page, proposal_last_changed, group_last_changed
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(conditional_page(proposal_last_changed), name='dispatch')
 class ProposalView(TemplateView):
     template_name = 'consensus_engine/view_proposal.html'
 
     def get_context_data(self, **kwargs):
         # view the proposal choices
+        # a stale write-behind consensus has already been refreshed by the conditional page check
         proposal = get_object_or_404(Proposal, pk=self.kwargs['proposal_id'])
         if 'query_date' in self.kwargs:
             query_date = self.kwargs['query_date']
         else:
             query_date = None
-        current_choice = ChoiceTicket.objects.get_current_choice(user=self.request.user,
-                                                                 proposal=proposal)
+        # no user when pre-rendering the static archive
+        current_choice = (ChoiceTicket.objects.get_current_choice(user=self.request.user, proposal=proposal)
+                          if self.request.user.is_authenticated else None)
         active_choices = proposal.proposalchoice_set.activated()
         context = {'proposal': proposal, 'current_choice': current_choice,
                    'active_choices': active_choices, 'query_date': query_date,
-                   'can_edit': proposal.user_can_edit(self.request.user)}
+                   'can_edit': proposal.user_can_edit(self.request.user),
+                   'live_feed': feed_enabled()}
         try:
             vote_spread = proposal.get_voting_spread(query_date)
         except (KeyError, ConsensusHistory.DoesNotExist):
@@ -38,9 +48,8 @@ class ProposalView(TemplateView):
             context['vote_spread'] = vote_spread
             # get a list of previous months for history
             date_list = []
-            if ConsensusHistory.objects.filter(proposal=proposal).count() > 0:
-                earliest_history = ConsensusHistory.objects.earliest_snapshot(proposal)
-                earliest_date = earliest_history.snapshot_date
+            earliest_date = ConsensusHistory.objects.earliest_snapshot_date(proposal)
+            if earliest_date is not None:
                 now = timezone.now()
                 inc_date = earliest_date
                 inc_year = earliest_date.year
@@ -87,8 +96,7 @@ class CreateProposalView(CreateView):
         self.object.populate_from_template(population_types[populate_option])
         self.object.determine_consensus()
         # save consensus history
-        snapshot = ConsensusHistory.build_snapshot(self.object)
-        snapshot.save()
+        ConsensusHistory.objects.record_snapshot(self.object)
         return HttpResponseRedirect(self.get_success_url())
 
     def get_context_data(self, **kwargs):
@@ -113,28 +121,52 @@ class EditProposalView(UpdateView):
             raise PermissionDenied("Editing is not allowed")
 
 
+@method_decorator(login_required, name='dispatch')
+class ProposalResultView(View):
+    """ The proposal's result as JSON - archived proposals are served from the static archive when rendered """
+
+    def get(self, request, **kwargs):
+        proposal = get_object_or_404(Proposal, pk=kwargs['proposal_id'])
+        return JsonResponse(proposal.get_result())
+
+
+@method_decorator(login_required, name='dispatch')
+class SidebarView(View):
+    """ The user's sidebar groups and open invites count, loaded by the pages served from the static archive """
+
+    def get(self, request, **kwargs):
+        return JsonResponse({
+            'visible_groups': render_to_string('consensus_engine/visible_groups.html',
+                                               visible_groups(request.user), request),
+            'open_invites_count': render_to_string('consensus_engine/my_open_invites_count.html',
+                                                   my_open_invites_count(request.user), request),
+        })
+
+
 @method_decorator(login_required, name='dispatch')
 class ProposalListView(TemplateView):
     """ Shows a list of proposals """
     template_name = 'consensus_engine/list_my_proposals.html'
 
     def get_context_data(self, **kwargs):
-        # view the proposal choices
+        # view the proposal choices - a page of each state's proposals,
+        # the next page for a state comes from ?<state>_before=<id> (e.g. ?archived_before=123)
         context = {}
-        proposals_list = Proposal.objects.owned(self.request.user, states={ProposalState.DRAFT})
-        context['draft_proposals_list'] = proposals_list
-        proposals_list = Proposal.objects.owned(self.request.user, states={ProposalState.TRIAL})
-        context['trial_proposals_list'] = proposals_list
-        proposals_list = Proposal.objects.owned(self.request.user, states={ProposalState.PUBLISHED})
-        context['published_proposals_list'] = proposals_list
-        proposals_list = Proposal.objects.owned(self.request.user, states={ProposalState.ON_HOLD})
-        context['on_hold_proposals_list'] = proposals_list
-        proposals_list = Proposal.objects.owned(self.request.user, states={ProposalState.ARCHIVED})
-        context['archived_proposals_list'] = proposals_list
+        before = {}
+        for state in ProposalState:
+            state_before = self.request.GET.get(state.name.lower() + '_before', '')
+            if state_before.isdigit():
+                before[state] = int(state_before)
+        page_size = getattr(settings, 'PROPOSAL_LIST_PAGE_SIZE', 50)
+        pages = Proposal.objects.owned_by_state(self.request.user, page_size, before=before)
+        for state, (proposals_list, next_before) in pages.items():
+            context[state.name.lower() + '_proposals_list'] = proposals_list
+            context[state.name.lower() + '_proposals_next'] = next_before
         return context
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(conditional_page(group_last_changed), name='dispatch')
 class ProposalListGroupView(ProposalListView):
     """ Sub class ProposalListView to get ones in group """
     template_name = 'consensus_engine/list_proposals.html'
@@ -142,12 +174,12 @@ class ProposalListGroupView(ProposalListView):
     def get_context_data(self, **kwargs):
         # view the proposal choices
         proposal_group = get_object_or_404(ProposalGroup, pk=kwargs['proposal_group_id'])
-        states = [ProposalState.PUBLISHED]
-        if proposal_group.is_user_part_of_trial(self.request.user):
-            states.append(ProposalState.TRIAL)
-        proposals_list = Proposal.objects.in_group(proposal_group, states=states)
         can_edit = proposal_group.is_user_member(self.request.user)
         can_trial = proposal_group.is_user_part_of_trial(self.request.user)
+        states = [ProposalState.PUBLISHED]
+        if can_trial:
+            states.append(ProposalState.TRIAL)
+        proposals_list = Proposal.objects.in_group_with_votes(proposal_group, self.request.user, states=states)
         voting_enabled = can_edit
         context = {'proposals_list': proposals_list, 'proposal_group': proposal_group,
                    'can_edit': can_edit,
@@ -5,8 +5,10 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from consensus_engine.models import Proposal
+from consensus_engine.models import Proposal, ScheduledTransition
 from consensus_engine.utils import ProposalState
 
 
@@ -58,6 +60,8 @@ class StateChangeConfirmationView(TemplateView):
         proposal = get_object_or_404(Proposal, pk=kwargs['proposal_id'])
         selected_state = int(kwargs['next_state'])
         new_state = ProposalState(selected_state)
+        if request.POST.get('due_date'):
+            return self.schedule(request, proposal, new_state)
         if new_state == ProposalState.TRIAL:
             proposal.trial()
         elif new_state == ProposalState.PUBLISHED:
@@ -69,3 +73,17 @@ class StateChangeConfirmationView(TemplateView):
             proposal.archive()
         success_url = reverse('view_proposal', args=[proposal.id])
         return HttpResponseRedirect(success_url)
+
+    def schedule(self, request, proposal, new_state):
+        """ Schedules the state change for the due date posted rather than changing the state now """
+        due_date = parse_datetime(request.POST['due_date'])
+        if due_date is None or new_state not in ScheduledTransition.SCHEDULABLE_STATES:
+            context = self.get_context_data(**self.kwargs)
+            context['error_message'] = "Only publishing, holding and archiving can be scheduled for a date and time."
+            return self.render_to_response(context)
+        if timezone.is_naive(due_date):
+            due_date = timezone.make_aware(due_date)
+        default_choices = 'default_choices' in request.POST
+        ScheduledTransition.objects.schedule(proposal, new_state, due_date, default_choices=default_choices)
+        success_url = reverse('view_proposal', args=[proposal.id])
+        return HttpResponseRedirect(success_url)
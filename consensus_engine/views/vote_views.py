@@ -5,10 +5,12 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.shortcuts import render, get_object_or_404
 from consensus_engine.models import ChoiceTicket, Proposal, ProposalChoice
+from .conditional import conditional_page, my_votes_last_changed
 DOMAINS_WHITELIST = ['localhost', 'quiet-bayou-98952.herokuapp.com']
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(conditional_page(my_votes_last_changed), name='dispatch')
 class MyVotesView(TemplateView):
     """ Shows a list of proposals """
     template_name = 'consensus_engine/view_my_votes.html'
@@ -30,7 +32,7 @@ class VoteView(TemplateView):
         try:
             # should be just the one.
             current_choice = ChoiceTicket.objects.get(user=self.request.user,
-                                                      proposal_choice__proposal=proposal,
+                                                      proposal=proposal,
                                                       state=proposal.state,
                                                       current=True)
         except (KeyError, ChoiceTicket.DoesNotExist):
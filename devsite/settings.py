@@ -54,6 +54,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'consensus_engine.middleware.MembershipMiddleware',
+    'consensus_engine.middleware.StaticArchiveMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -137,6 +139,62 @@ LOGIN_REDIRECT_URL = '/consensus/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Consensus history - snapshots within the same window (in seconds) are merged into one row (0 = off)
+CONSENSUS_HISTORY_COALESCE_SECONDS = 0
+# Consensus history - store every nth snapshot in full and the rest as deltas (1 = every snapshot in full)
+CONSENSUS_HISTORY_KEYFRAME_INTERVAL = 1
+# Voting only records the vote and queues the consensus update for the process_consensus_updates worker
+CONSENSUS_WRITE_BEHIND = False
+# Seconds a queued consensus update can wait before a proposal page recomputes it itself
+CONSENSUS_WRITE_BEHIND_MAX_STALENESS = 30
+# Number of proposals shown for each state on the my proposals page before paging
+PROPOSAL_LIST_PAGE_SIZE = 50
+
+# Local memory cache per process - the sidebar and spread caches are only used with it while a single
+# process serves the site (CONSENSUS_WEB_PROCESSES), with more processes configure a shared cache such as
+# django.core.cache.backends.db.DatabaseCache (run createcachetable) or memcached
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# Number of processes serving the site (every worker of every dyno) - gunicorn runs WEB_CONCURRENCY workers
+CONSENSUS_WEB_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+# The cache used for the per-user sidebar data (groups and open invites count)
+CONSENSUS_SIDEBAR_CACHE = 'default'
+# Seconds the sidebar data is cached for - changes invalidate it before then
+CONSENSUS_SIDEBAR_CACHE_TIMEOUT = 300
+# The cache used for the proposal voting spreads - to share it between processes point this at a
+# file based or database cache (run createcachetable for the database cache) in CACHES
+CONSENSUS_SPREAD_CACHE = 'default'
+# Seconds a voting spread is cached for - votes, choice edits and state changes invalidate it before then
+CONSENSUS_SPREAD_CACHE_TIMEOUT = 3600
+# Seconds each process counts the sidebar and spread cache hits and misses for before adding them to the
+# counters in the cache that cache_stats reads
+CONSENSUS_CACHE_STATS_FLUSH = 10
+# The cache holding the group pages' versions - when the proposals listed on each group page last changed
+CONSENSUS_GROUP_CACHE = 'default'
+# Pages open live feeds of the changing spreads and consensus - each open feed holds a worker thread
+# for up to CONSENSUS_LIVE_FEED_MAX_AGE, so only turn this on with threaded workers (the Procfile runs
+# gunicorn's gthread workers) and enough threads for the open pages
+CONSENSUS_LIVE_FEED = False
+# Seconds the live feeds wait after a change for more changes so a burst of votes is sent as one event
+CONSENSUS_LIVE_FEED_COALESCE = 0.5
+# Seconds between keep-alive comments on an idle live feed
+CONSENSUS_LIVE_FEED_KEEPALIVE = 15
+# Seconds a live feed stays open before the browser is left to reconnect (frees the worker thread)
+# - kept below gunicorn's worker timeout (30 seconds by default)
+CONSENSUS_LIVE_FEED_MAX_AGE = 25
+# Seconds between polls of the changed proposals so the live feeds see the changes made by other
+# worker processes - None pushes only the changes made in the same process (a single worker)
+CONSENSUS_LIVE_FEED_POLL = None
+# Directory the archived proposals' pages and results are pre-rendered to by render_static_archive (run
+# it on a schedule to render the proposals queued as they are archived) - the pages and results are served
+# from it, None serves everything through the views
+CONSENSUS_STATIC_ARCHIVE_ROOT = None
+# Number of users returned per page by the invite typeahead
+USER_SEARCH_PAGE_SIZE = 20
+
 django_heroku.settings(locals())
 # SSL fix for local
 del DATABASES['default']['OPTIONS']['sslmode']